@@ -1,17 +1,223 @@
 """
- Async helpers for requests. These likely aren't well developed for the use 
+ Async helpers for requests. These likely aren't well developed for the use
  case at present, but act as a decent starting point for turning the syncronous
  scraping into an ascynchronous process.
- 
+
+ Requests go through an AdaptiveLimiter, which tunes concurrency AIMD-style
+ (additive increase while latency and error rate are healthy, multiplicative
+ decrease on 429 / 5xx / timeouts), and holds a token bucket per host. Live
+ throughput, in-flight and error-rate metrics are available from the limiter.
+
  -----------------------------------
  Created on Wed Feb 24 15:00:48 2021
  @author: matthew.mcfahn
 """
 
+from collections import deque
+from urllib.parse import urlparse
 import asyncio
 import aiohttp
+import json
+import time
+
+# Defaults for the adaptive limiter
+initial_concurrency = 16
+min_concurrency = 2
+max_concurrency = 256
+target_latency = 5.0        # Seconds. Slower responses stop concurrency growing
+max_error_rate = 0.05       # Over the rolling window
+requests_per_second = 50    # Per host token bucket rate, and...
+burst = 100                 # ...its capacity
+metrics_window = 30         # Seconds of history used for the live metrics
+report_every = 10           # Seconds between metrics reports in main()
+request_timeout = 300
+# Ask for compressed bodies explicitly. aiohttp decompresses them transparently
+request_headers = {'Accept-Encoding': 'gzip'}
+# Paged requests are sorted on this column: OData only keeps rows in the same
+# order between requests when asked to, so pages could otherwise overlap or skip rows
+page_order = 'Id'
+
+class TokenBucket:
+    """
+    A simple token bucket: allows 'rate' requests per second on average, with
+    bursts of up to 'capacity' requests
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Empty the bucket, e.g. when a server sends 'Retry-After'"""
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    async def acquire(self):
+        """Wait until a token is available, then take it"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return None
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency controller for requests to the GHO API.
+
+    Concurrency starts at 'initial', grows by roughly one request per round
+    trip while latency stays under 'target_latency' and the rolling error rate
+    under 'max_error_rate', and is cut by 'decrease_factor' on a 429, 5xx, or
+    timeout (at most once per round trip, so a burst of failures from one
+    overloaded moment only counts once). Each host also has a token bucket.
+
+    Use as:
+        async with limiter.slot(url) as slot:
+            ... make the request ...
+            slot.record(status)
+    """
+    def __init__(self, initial = initial_concurrency, minimum = min_concurrency, maximum = max_concurrency,
+                 target_latency = target_latency, max_error_rate = max_error_rate, decrease_factor = 0.5,
+                 rate = requests_per_second, burst = burst, window = metrics_window):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.decrease_factor = decrease_factor
+        self.rate = rate
+        self.burst = burst
+        self.window = window
+
+        self.in_flight = 0
+        self.buckets = {}
+        self.history = deque()  # (finished time, latency, ok)
+        self.errors = 0         # Errors in the history
+        self.total_latency = 0.0
+        self.last_decrease = 0.0
+        self.condition = asyncio.Condition()
+
+    def __bucket(self, url):
+        """Helper: the token bucket for the URL's host"""
+        host = urlparse(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        return self.buckets[host]
 
-async def get(url, indicator):
+    def __trim(self, now):
+        """Helper: drop history older than the metrics window"""
+        while self.history and self.history[0][0] < now - self.window:
+            _, latency, ok = self.history.popleft()
+            self.errors -= not ok
+            self.total_latency -= latency
+
+    def metrics(self):
+        """
+        Live metrics over the rolling window
+
+        Returns
+        -------
+        metrics : dict
+            'concurrency' (current limit), 'in_flight', 'throughput' (completed
+            requests per second), 'error_rate', 'mean_latency' (seconds)
+        """
+        now = time.monotonic()
+        self.__trim(now)
+        completed = len(self.history)
+        span = min(self.window, max(now - self.history[0][0], 1.0)) if completed else self.window
+        metrics = {'concurrency': int(self.limit),
+                   'in_flight': self.in_flight,
+                   'throughput': round(completed / span, 2),
+                   'error_rate': round(self.errors / completed, 4) if completed else 0.0,
+                   'mean_latency': round(self.total_latency / completed, 3) if completed else 0.0}
+        return metrics
+
+    async def acquire(self, url):
+        """Wait for a concurrency slot, then a token for the host"""
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        await self.__bucket(url).acquire()
+        return time.monotonic()
+
+    async def release(self, url, started, ok, congested, retry_after = None):
+        """Record the outcome, adjust the limit, and free the slot"""
+        now = time.monotonic()
+        latency = now - started
+        self.history.append((now, latency, ok))
+        self.errors += not ok
+        self.total_latency += latency
+        self.__trim(now)
+
+        if congested:
+            # Multiplicative decrease, at most once per round trip
+            if now - self.last_decrease > latency:
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                self.last_decrease = now
+            if retry_after:
+                self.__bucket(url).pause(retry_after)
+        elif ok:
+            healthy = latency <= self.target_latency and self.errors / len(self.history) <= self.max_error_rate
+            # Additive increase: about +1 per round trip of the whole window of requests
+            if healthy and self.in_flight >= int(self.limit) - 1:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+        return None
+
+    def slot(self, url):
+        """Context manager for one request to 'url'. See the class docstring"""
+        return _LimiterSlot(self, url)
+
+class _LimiterSlot:
+    """A single request's slot in the AdaptiveLimiter"""
+    def __init__(self, limiter, url):
+        self.limiter = limiter
+        self.url = url
+        self.status = None
+        self.retry_after = None
+
+    def record(self, status, retry_after = None):
+        """Record the HTTP status (and any 'Retry-After' seconds) of the response"""
+        self.status = status
+        self.retry_after = retry_after
+
+    async def __aenter__(self):
+        self.started = await self.limiter.acquire(self.url)
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        timed_out = exc_type is not None and issubclass(exc_type, asyncio.TimeoutError)
+        congested = timed_out or self.status == 429 or (self.status is not None and self.status >= 500)
+        ok = exc_type is None and self.status is not None and self.status < 400
+        await self.limiter.release(self.url, self.started, ok, congested, self.retry_after)
+        return False
+
+def __retry_after(response):
+    """Helper: 'Retry-After' header in seconds, if given as a number"""
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+async def __request(session, url, limiter):
+    """
+    Helper: make one GET request through the limiter, returning the body.
+    Raises on any non-200 response, so callers can retry the indicator later
+    """
+    async with limiter.slot(url) as slot:
+        async with session.get(url=url) as response:
+            slot.record(response.status, __retry_after(response))
+            response.raise_for_status()
+            return await response.read()
+
+async def get(url, indicator, session, limiter):
     """
     A simple async get function, tailored to tracking failures
 
@@ -21,6 +227,10 @@ async def get(url, indicator):
         The URL to make a request to
     indicator : str
         The name of the indicator being retrieved (to make tracking easier)
+    session : aiohttp.ClientSession
+        The shared, pooled session
+    limiter : AdaptiveLimiter
+        Controls concurrency and request rate
     Returns
     -------
     IF request fails, returns
@@ -31,32 +241,132 @@ async def get(url, indicator):
         The indicator and the HTTP response from the request
     """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url=url) as response:
-                resp = await response.read()
-                if len(resp) > 0:
-                    print(f'Successfully got url {url} with response of length {len(resp)}.')
-                    return {indicator:resp}
-                else:
-                    print(f'Response for url {url} was of length 0')
-                    return indicator
+        resp = await __request(session, url, limiter)
+        if len(resp) > 0:
+            print(f'Successfully got url {url} with response of length {len(resp)}.')
+            return {indicator:resp}
+        else:
+            print(f'Response for url {url} was of length 0')
+            return indicator
     except Exception as e:
         print(f'Unable to get url {url} due to {e.__class__}.')
         return indicator
 
-async def main(indicators_urls):
+def __page_url(url, page_size, skip, order = page_order):
+    """Helper: add OData paging parameters, in a stable order, to a URL that may already have a query"""
+    separator = '&' if '?' in url else '?'
+    orderby = '' if '$orderby=' in url else f'&$orderby={order}'
+    return f'{url}{separator}$top={page_size}&$skip={skip}{orderby}'
+
+async def get_paged(url, indicator, page_size, session, limiter):
     """
-    A wrapper around the async get function to make all requests
-    
+    An async get function that retrieves an OData endpoint in pages of
+    'page_size' rows ($top / $skip, ordered by page_order), so large
+    indicators never arrive as one giant body. Stops at the first page with
+    fewer than page_size rows.
+
+    Parameters
+    ----------
+    url : str
+        The URL to make requests to (may already contain $select / $filter)
+    indicator : str
+        The name of the indicator being retrieved (to make tracking easier)
+    page_size : int
+        The number of rows to request per page
+    session : aiohttp.ClientSession
+        The shared, pooled session
+    limiter : AdaptiveLimiter
+        Controls concurrency and request rate. Each page is one request
+    Returns
+    -------
+    IF any page fails, returns
+    indicator : str
+        The same indicator name, so the request can be retried later
+    ELSE
+    {indicator : pages}: dict(str: list)
+        The indicator and the list of page bodies, in order
+    """
+    pages = []
+    skip = 0
+    try:
+        while True:
+            resp = await __request(session, __page_url(url, page_size, skip), limiter)
+            rows = len(json.loads(resp)['value'])
+            # Guard against endpoints that ignore $skip, which would loop forever
+            if pages and resp == pages[-1]:
+                raise Exception('Endpoint returned the same page twice. Is paging supported?')
+            if rows > 0 or not pages:
+                pages += [resp]
+            if rows < page_size:
+                break
+            skip += page_size
+    except Exception as e:
+        print(f'Unable to get url {url} (page at {skip}) due to {e.__class__}.')
+        return indicator
+    print(f'Successfully got url {url} in {len(pages)} pages.')
+    return {indicator: pages}
+
+async def __report_metrics(limiter, every):
+    """Helper: print the limiter's live metrics periodically, until cancelled"""
+    while True:
+        await asyncio.sleep(every)
+        print(f'[LIMITER] {limiter.metrics()}')
+
+async def __with_callback(request, indicator, on_response):
+    """
+    Helper: await a get / get_paged request, then hand a successful result to
+    the on_response callback. What the callback returns replaces the response,
+    so bodies needn't be held in memory once they've been dealt with. If the
+    callback fails, the indicator is returned to be retried
+    """
+    result = await request
+    if on_response is None or type(result) == str:
+        return result
+    try:
+        return {indicator: await on_response(indicator, result[indicator])}
+    except Exception as e:
+        print(f'Unable to process response for {indicator} due to {e!r}.')
+        return indicator
+
+async def main(indicators_urls, page_size = None, limiter = None, on_response = None):
+    """
+    A wrapper around the async get functions to make all requests, over one
+    pooled session, through the adaptive limiter
+
     Parameters
     ----------
     indicators_urls : dict
         A dictionary of the indicators to get, and their corresponding URLs
+    page_size : int
+        If set, retrieve each URL in pages of this many rows with get_paged
+    limiter : AdaptiveLimiter
+        Optional. Pass one in to keep the tuned concurrency across retries
+    on_response : coroutine function
+        Optional. Called as 'await on_response(indicator, response)' as soon as
+        each indicator completes. Its return value is kept in place of the response
     Returns
     -------
     ret : list
         A list of all the responses from the get function
     """
-    ret = await asyncio.gather(*[get(url, indicator) for indicator, url in indicators_urls.items()])
+    if limiter is None:
+        limiter = AdaptiveLimiter()
+    connector = aiohttp.TCPConnector(limit = limiter.maximum)
+    timeout = aiohttp.ClientTimeout(total = request_timeout)
+    reporter = asyncio.create_task(__report_metrics(limiter, report_every))
+    try:
+        async with aiohttp.ClientSession(connector = connector, timeout = timeout,
+                                         headers = request_headers) as session:
+            if page_size:
+                requests = {indicator: get_paged(url, indicator, page_size, session, limiter)
+                            for indicator, url in indicators_urls.items()}
+            else:
+                requests = {indicator: get(url, indicator, session, limiter)
+                            for indicator, url in indicators_urls.items()}
+            ret = await asyncio.gather(*[__with_callback(request, indicator, on_response)
+                                         for indicator, request in requests.items()])
+    finally:
+        reporter.cancel()
     print(f'Finalized all {len(ret)} outputs.')
+    print(f'[LIMITER] {limiter.metrics()}')
     return ret
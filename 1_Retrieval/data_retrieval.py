@@ -11,12 +11,15 @@
  @author: matthew.mcfahn
 """
 
-import requests
-import json
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, quote
 import time
 
 from async_helpers import main as main
+from async_helpers import AdaptiveLimiter
+import metadata_retrieval
+import payload_archive
+import sqlite_helpers
 import asyncio
 
 # Set URLs for the API endpoints of the main things we need to scrape
@@ -27,11 +30,22 @@ dimensions = {'measures':{'url':f'{root}/Dimension'},
               'indicators':{'url':f'{root}/Indicator'}
               }
 
+# OData projection: only the columns that survive cleaning.__data_suppression.
+# SpatialDimType, TimeDimType, Date, TimeDimensionBegin/End etc. never leave the server
+select_columns = ['Id', 'IndicatorCode', 'SpatialDim', 'TimeDim', 
+                  'Dim1Type', 'Dim1', 'Dim2Type', 'Dim2', 'Dim3Type', 'Dim3',
+                  'DataSourceDim', 'Value', 'NumericValue', 'Low', 'High', 'Comments']
+# Rows per page for paged retrieval ($top / $skip). None requests each indicator whole
+page_size = 10000
+
 ### - Retrieval routines
 def __get_main_measures(dimensions):
     """
-    Just use the requests module to make requests to the API for the top level
-    dimensions we need to retrieve
+    Retrieves the top level dimensions we need from the API. Uses the shared
+    metadata fetcher, so these are requested concurrently (alongside the
+    Athena metadata, which is then cached for later stages), and cached on disk.
+    The Athena endpoints are optional here: if they fail, the OData ones are
+    still returned, and the Athena stage requests them itself
     
     Parameters
     ----------
@@ -42,89 +56,212 @@ def __get_main_measures(dimensions):
     Returns
     -------
     dimensions : dict
-        The original dictionary modified in place to add responses, json, and 
-        DataFrames from the successful API requests
+        The original dictionary modified in place to add json, and DataFrames
+        from the successful API requests
     """
+    endpoints = {'odata': {dim: contents['url'] for dim, contents in dimensions.items()},
+                 'athena': metadata_retrieval.metadata_endpoints['athena']}
+    metadata = metadata_retrieval.get_metadata(endpoints, optional_apis = ['athena'])
     
-    for dim, contents in dimensions.items():
-        # Make request
-        response = requests.get(contents['url'])
-        # Load to JSON
-        json_content = json.loads(response.content)
-        # Get the content to a DataFrame
-        frame = pd.DataFrame(json_content['value'])
-        
+    for dim in dimensions:
         # Write back to dimensions dict
-        dimensions[dim]['response'] = response
-        dimensions[dim]['json'] = json_content
-        dimensions[dim]['content'] = frame
+        dimensions[dim]['json'] = metadata['odata'][dim]['json']
+        dimensions[dim]['content'] = metadata['odata'][dim]['content']
     
     return dimensions
 
-def __extract_indicator_urls(dimensions):
-    """Helper function to pull out a list of indicators and URLs from dimensions
+def __build_odata_url(code, select = select_columns, year_range = None, areas = None):
+    """
+    Builds the OData query URL for an indicator, with column projection and
+    optional filters. Paging ($top / $skip) is added per request by async_helpers
+    
+    Parameters
+    ----------
+    code : str
+        The indicator code
+    select : list
+        Columns to return ($select). If None, all columns are returned
+    year_range : tuple
+        Optional (start, end) years, inclusive. Either can be None
+    areas : list
+        Optional list of SpatialDim codes to restrict to
+    Returns
+    -------
+    url : str
+        The URL for the indicator, with the OData query string
+    """
+    params = {}
+    if select:
+        params['$select'] = ','.join(select)
+    
+    filters = []
+    if year_range is not None:
+        start, end = year_range
+        if start is not None:
+            filters += [f'TimeDim ge {int(start)}']
+        if end is not None:
+            filters += [f'TimeDim le {int(end)}']
+    if areas:
+        filters += ['(' + ' or '.join(f"SpatialDim eq '{area}'" for area in areas) + ')']
+    if filters:
+        params['$filter'] = ' and '.join(filters)
+    
+    url = f'{root}/{code}'
+    if params:
+        url += '?' + urlencode(params, quote_via = quote, safe = "$,'()")
+    return url
+
+def __extract_indicator_urls(dimensions, select = select_columns, year_range = None, areas = None):
+    """Helper function to pull out a list of indicators and URLs from dimensions.
+    See __build_odata_url for the projection and filter parameters
     """
     indicators_frame = dimensions['indicators']['content']
     indicator_codes = indicators_frame.IndicatorCode.unique()
-    indicators_urls = {code: f'{root}/{code}' for code in indicator_codes}
+    indicators_urls = {code: __build_odata_url(code, select = select, year_range = year_range, areas = areas)
+                       for code in indicator_codes}
     return indicators_urls
 
 # Now, we load indicator data, using an async method
-async def __get_maindata_async(indicators_urls, test = False):
+async def __get_maindata_async(indicators_urls, test = False, page_size = page_size, db_file = None,
+                               archive_dir = None):
     """
     Makes requests asynchronously for all the indicator URLs to pull >2,300 API
     endpoints.
     
+    If db_file is given, the retrieval is checkpointed: each indicator is
+    written to the staging database (and the retrieval journal) as soon as it
+    arrives, and indicators already in the journal are skipped. So a restarted
+    run carries on where the last one stopped, and bodies aren't held in memory.
+    
+    If archive_dir is given, each raw response is also stored in the payload
+    archive as it arrives, and a snapshot manifest is written at the end, so
+    the staged data can later be rebuilt offline with replay_snapshot.
+    
     TODO: Review and improve the way this async functionality has been used
     
     Parameters
     ----------
     indicators_urls : dict (indicator: url)
         A dictionary of indicators and their API URLs to retrieve
+    page_size : int
+        If set, each indicator is retrieved in pages of this many rows, rather
+        than as one (potentially huge) body
+    db_file : str
+        Optional. The staging database to checkpoint into
+    archive_dir : str
+        Optional. Root of the payload archive (see payload_archive.archive_dir)
     Returns
     -------
     responses : dict
-        A dictionary of {indicator: request response}
+        A dictionary of {indicator: request response}. When paged, the
+        response is a list of page bodies. When checkpointing to db_file, this
+        is instead {indicator: row count written}, covering earlier runs too
     """
     # If we want to just test this function, we'll pull the first 250 only
     if test:
         indicators_urls = {k: indicators_urls[k] for k in list(indicators_urls)[:250]}
     
+    # Skip anything a previous (interrupted) run already wrote
+    completed = {}
+    if db_file is not None:
+        completed = sqlite_helpers.__get_completed_indicators(db_file)
+        completed = {code: rows for code, rows in completed.items() if code in indicators_urls}
+        indicators_urls = {code: url for code, url in indicators_urls.items() if code not in completed}
+        print(f'[CHECKPOINT] {len(completed)} indicators already retrieved, {len(indicators_urls)} to go')
+    
+    # SQLite writes go through a single thread (and connection), off the event loop
+    loop = asyncio.get_running_loop()
+    writer, conn = None, None
+    if db_file is not None:
+        writer = ThreadPoolExecutor(max_workers = 1)
+        conn = await loop.run_in_executor(writer, sqlite_helpers.create_connection, db_file)
+        await loop.run_in_executor(writer, sqlite_helpers.__create_retrieval_tables, conn)
+    
+    # Archive objects for this snapshot. Resumed indicators are already archived under their journal hash
+    archived = {}
+    if archive_dir is not None and db_file is not None:
+        archived = sqlite_helpers.__get_completed_indicators(db_file, column = 'content_hash')
+        archived = {code: digest for code, digest in archived.items() if code in completed}
+    
+    async def on_response(indicator, response):
+        if archive_dir is not None:
+            archived[indicator] = await loop.run_in_executor(None, payload_archive.archive_response,
+                                                             indicator, response, archive_dir)
+        if writer is not None:
+            return await loop.run_in_executor(writer, sqlite_helpers.__checkpoint_response,
+                                              conn, indicator, response)
+        return response
+    
     # Set up some control parameters
     final_responses = []
     iu = indicators_urls.copy()
     start_amount = len(iu)
     
+    # One limiter for the whole pull, so the concurrency it settles on carries over to retries
+    limiter = AdaptiveLimiter()
+    
     # Use a while loop to kep trying to async scrape the API, retrying as long as there are still failed responses
     start = time.time()
-    while len(iu) > 0:
-        amount = len(iu)
-        
-        # Create a task for scraping all the 'iu' URLs, and await it
-        task = asyncio.create_task(main(iu))
-        responses = await task
-        
-        # Only once it's done do we want to progress, so we wait for task.done()
-        if task.done():
-            print('\n\n\n')
-            # Add successful responses
-            final_responses += [x for x in responses if type(x) != str]
+    try:
+        while len(iu) > 0:
+            amount = len(iu)
             
-            # Failed responses
-            failed_resp = [x for x in responses if type(x) == str]
-            iu = {code: val for code, val in indicators_urls.items() if code in failed_resp}
-            print(f'Of {amount} requests, {len(iu)} failed. Retrying')
-            print('\n\n\n')
+            # Create a task for scraping all the 'iu' URLs, and await it
+            task = asyncio.create_task(main(iu, page_size = page_size, limiter = limiter, on_response = on_response))
+            responses = await task
+            
+            # Only once it's done do we want to progress, so we wait for task.done()
+            if task.done():
+                print('\n\n\n')
+                # Add successful responses
+                final_responses += [x for x in responses if type(x) != str]
+                
+                # Failed responses
+                failed_resp = [x for x in responses if type(x) == str]
+                iu = {code: val for code, val in indicators_urls.items() if code in failed_resp}
+                print(f'Of {amount} requests, {len(iu)} failed. Retrying')
+                print('\n\n\n')
+    finally:
+        if writer is not None:
+            writer.submit(conn.close).result()
+            writer.shutdown()
+    if archive_dir is not None:
+        payload_archive.write_snapshot(archived, archive_dir)
     # Report on time taken once we've got successful responses for all URLs
     end = time.time()
     print(f'Took {end - start} seconds to pull {start_amount} websites.')
     
     # Format final_responses nicely in a dictionary
-    del responses, failed_resp, iu, amount, start, end
-    responses = {}
+    responses = dict(completed)
     for d in final_responses:
         responses.update(d)
     
     return responses
 
-# NOTE: The above function must be called using "await __get_maindata_async(indicators_urls, test = False)"
\ No newline at end of file
+# NOTE: The above function must be called using "await __get_maindata_async(indicators_urls, test = False)"
+# Pass db_file = sqlite_helpers.db_file to checkpoint, making the pull resumable,
+# and archive_dir = payload_archive.archive_dir to keep the raw payloads for replay
+
+def replay_snapshot(snapshot_file = None, db_file = sqlite_helpers.db_file, archive_dir = payload_archive.archive_dir):
+    """
+    Replay mode: rebuilds the staged 'indicator_data' table from an archived
+    snapshot, rather than the network. Later stages then read the staged
+    database as usual
+    
+    Parameters
+    ----------
+    snapshot_file : str
+        Path to a snapshot manifest. If None, the most recent is used
+    db_file : str
+        The staging database to write to
+    archive_dir : str
+        Root of the payload archive
+    Returns
+    -------
+    None
+    """
+    start = time.time()
+    responses = payload_archive.load_snapshot(snapshot_file, archive_dir)
+    sqlite_helpers.__responses_to_sqlite(responses, db_file, replace = True)
+    print(f'[ARCHIVE] Replayed {len(responses)} indicators in {round(time.time() - start, 2)} seconds')
+    return None
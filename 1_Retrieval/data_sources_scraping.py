@@ -10,9 +10,113 @@
  @author: matthew.mcfahn
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import json
+import time
+import os
 
-def __pull_source_info(sources_df):
+import sqlite_helpers
+
+# Descriptions almost never change, so they're cached on disk by URL
+cache_file = f'{sqlite_helpers.outdir}/source_info_cache.json'
+cache_ttl_days = 30
+max_workers = 8
+
+def __parse_source_description(url):
+    """
+    Scrapes the source description from a single NLIS source page. We use 
+    pandas built in functionality as the NLIS pages have HTML tables
+    
+    Parameters
+    ----------
+    url : str
+        The URL of the source page (any http(s) URL serving the same HTML)
+    Returns
+    -------
+    source_info : str
+        The description of the source
+    """
+    source_info = pd.read_html(url)[0].loc[2].loc[0]
+    source_info = source_info[0:source_info.find('Author') - 2]
+    source_info = source_info[source_info.find(':') + 2:]
+    return source_info
+
+def __load_cache(cache_file, ttl_days):
+    """Helper: load the URL -> description cache, dropping expired entries"""
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, 'r') as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        print(f'[SOURCES] Cache {cache_file} unreadable. Ignoring')
+        return {}
+    oldest = time.time() - ttl_days * 24 * 60 * 60
+    return {url: entry for url, entry in cache.items() if entry['retrieved_at'] >= oldest}
+
+def __save_cache(cache, cache_file):
+    """Helper: write the cache atomically, so a crash can't leave it half written"""
+    os.makedirs(os.path.dirname(cache_file), exist_ok = True)
+    temp_file = f'{cache_file}.tmp'
+    with open(temp_file, 'w') as file:
+        json.dump(cache, file)
+    os.replace(temp_file, cache_file)
+    return None
+
+def __fetch_source_descriptions(sources_dict, cache_file = cache_file, ttl_days = cache_ttl_days,
+                                max_workers = max_workers):
+    """
+    Gets descriptions for each source, from the on-disk cache where we have a
+    fresh entry for the URL, and otherwise scraping concurrently with a 
+    bounded pool of threads.
+    
+    Parameters
+    ----------
+    sources_dict : dict
+        {source label: url}
+    cache_file : str
+        Filepath to the JSON cache, keyed by URL
+    ttl_days : float
+        How long a cached description is used before it's re-scraped
+    max_workers : int
+        The maximum number of concurrent requests
+    Returns
+    -------
+    responses : dict
+        {source label: description} for the sources we could get info for
+    """
+    cache = __load_cache(cache_file, ttl_days)
+    responses = {source: cache[url]['description'] for source, url in sources_dict.items() if url in cache}
+    to_fetch = {source: url for source, url in sources_dict.items() if url not in cache}
+    print(f'[SOURCES] {len(responses)} sources found in cache, {len(to_fetch)} to scrape')
+    if not to_fetch:
+        return responses
+    
+    def __fetch(url):
+        try:
+            return __parse_source_description(url)
+        except Exception as e:
+            print(f'Source at {url} couldnt be scraped ({e.__class__.__name__}). Passing.')
+            return None
+    
+    # Requests are network bound, so threads are fine despite the GIL
+    urls = list(set(to_fetch.values()))
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        descriptions = dict(zip(urls, executor.map(__fetch, urls)))
+    
+    now = time.time()
+    for url, description in descriptions.items():
+        if description is not None:
+            cache[url] = {'description': description, 'retrieved_at': now}
+    __save_cache(cache, cache_file)
+    
+    responses.update({source: descriptions[url] for source, url in to_fetch.items() 
+                      if descriptions[url] is not None})
+    return responses
+
+def __pull_source_info(sources_df, cache_file = cache_file, ttl_days = cache_ttl_days, 
+                       max_workers = max_workers):
     """
     Simple helper to pull extra source description information for a number of
     sources retrieved.
@@ -22,13 +126,19 @@ def __pull_source_info(sources_df):
     sources_df : pd.DataFrame()
         A dataframe of the data sources present, and URLs to more info about 
         them, where present
+    cache_file : str
+        Filepath to the on-disk cache of descriptions, keyed by URL
+    ttl_days : float
+        How long cached descriptions are used before being re-scraped
+    max_workers : int
+        The maximum number of concurrent requests
     Returns
     -------
     sources_df : pd.DataFrame()
         The dataframe modified in place, with 'source_description' modified
         where possible
     """
-    print("[SOURCES] Scraping extra info on sources from the web. Will take a while")
+    print("[SOURCES] Getting extra info on sources, from the cache or the web")
     # Cut just to the info we'll be pulling
     retrieval_needed = sources_df.loc[sources_df['retrieved'] == 1]
     retrieval_needed = retrieval_needed.loc[~(retrieval_needed['url'] == '')]
@@ -40,23 +150,12 @@ def __pull_source_info(sources_df):
     sources_dict = dict(zip(retrieval_needed.label, retrieval_needed.url))
     
     # Make requests and retrieve data source information
-    responses = {}
-    counter = 1
-    print(f'There are: {len(sources_dict)} datasets we need to scrape info for')
-    for source, url in sources_dict.items():
-        print(f'Grabbing source: {counter}')
-        # We use pandas built in functionality as the NLIS pages have HTML tables
-        try:
-            source_info = pd.read_html(url)[0].loc[2].loc[0]
-        except:
-            print(f'Source {source} couldnt be scraped. Passing.')
-        source_info = source_info[0:source_info.find('Author') - 2]
-        source_info = source_info[source_info.find(':') + 2:]
-        responses[source] = source_info
-        counter += 1
+    print(f'There are: {len(sources_dict)} datasets we need info for')
+    responses = __fetch_source_descriptions(sources_dict, cache_file = cache_file, ttl_days = ttl_days,
+                                            max_workers = max_workers)
     
     # Write to our original frame
-    retrieved_df = pd.DataFrame.from_dict(responses, orient='index').reset_index().rename(columns = {'index':'label',0:'description'})
+    retrieved_df = pd.DataFrame({'label': list(responses.keys()), 'description': list(responses.values())})
     sources_df = sources_df.merge(retrieved_df, on = 'label', how = 'left', validate = 'one_to_one')
     
     # Some adhoc filling
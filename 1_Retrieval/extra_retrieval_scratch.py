@@ -11,6 +11,8 @@ import requests
 import json
 import pandas as pd
 
+import metadata_retrieval
+
 # Test using the Athena API for the data sources info
 path = r'https://apps.who.int/gho/athena/data/'
 
@@ -31,8 +33,8 @@ desired_metadata = {'indicator_categories':{'url':f'{path}GHOCAT/{query_params}'
 # Tailor the data retrieval function for the Athena API
 def __get_main_measures(desired_metadata):
     """
-    Just use the requests module to make requests to the API for the top level
-    metadata we need to retrieve
+    Uses the shared metadata fetcher to request the top level metadata we need
+    to retrieve concurrently (or get it from the disk cache)
     
     Parameters
     ----------
@@ -43,20 +45,16 @@ def __get_main_measures(desired_metadata):
     Returns
     -------
     desired_metadata : dict
-        The original dictionary modified in place to add responses, json, and 
-        DataFrames from the successful API requests
+        The original dictionary modified in place to add json, and DataFrames
+        from the successful API requests
     """
+    endpoints = {'athena': {dim: contents['url'] for dim, contents in desired_metadata.items()}}
+    metadata = metadata_retrieval.get_metadata(endpoints)
     
-    for dim, contents in desired_metadata.items():
-        print(dim)
-        # Make request
-        response = requests.get(contents['url'])
-        # Load to JSON
-        json_content = json.loads(response.content)
-        
+    for dim in desired_metadata:
         # Write back to dimensions dict
-        desired_metadata[dim]['response'] = response
-        desired_metadata[dim]['json'] = json_content
+        desired_metadata[dim]['json'] = metadata['athena'][dim]['json']
+        desired_metadata[dim]['content'] = metadata['athena'][dim]['content']
     
     return desired_metadata
 
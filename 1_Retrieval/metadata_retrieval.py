@@ -0,0 +1,202 @@
+"""
+ A module to retrieve the metadata endpoints of both WHO GHO APIs (OData and
+ Athena) concurrently, over a single pooled aiohttp session. Responses are
+ cached on disk, so repeat runs within the TTL don't touch the network, and
+ are returned as pandas DataFrames.
+
+ Metadata refresh time is then set by the slowest endpoint, rather than the
+ sum of all of them.
+
+ -----------------------------------
+ Created on Mon Oct 19 13:20:15 2026
+ @author: matthew.mcfahn
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import asyncio
+import aiohttp
+import hashlib
+import json
+import time
+import os
+
+import sqlite_helpers
+
+# Metadata endpoints for each API: {api: {name: url}}
+odata_root = 'https://ghoapi.azureedge.net/api'
+athena_root = 'https://apps.who.int/gho/athena/data'
+metadata_endpoints = {'odata': {'measures': f'{odata_root}/Dimension',
+                                'countries': f'{odata_root}/DIMENSION/COUNTRY/DimensionValues',
+                                'regions': f'{odata_root}/DIMENSION/REGION/DimensionValues',
+                                'indicators': f'{odata_root}/Indicator'},
+                      'athena': {'indicator_categories': f'{athena_root}/GHOCAT/?format=json',
+                                 'indicators': f'{athena_root}/GHO/?format=json',
+                                 'datasources': f'{athena_root}/DATASOURCE/?format=json',
+                                 'location': f'{athena_root}/LOCATION/?format=json'}
+                      }
+
+cache_dir = f'{sqlite_helpers.outdir}/metadata_cache'
+cache_ttl_hours = 24
+max_connections = 8
+request_timeout = 120
+max_retries = 3
+
+### - Parsing
+def __odata_to_frame(json_content):
+    """Helper: OData responses hold their records in 'value'"""
+    return pd.DataFrame(json_content['value']).infer_objects()
+
+def __athena_to_frame(json_content):
+    """
+    Helper: Athena responses hold their records in dimension[0]['code'], with
+    extra information as a list of {'category', 'value'} in 'attr'. These are
+    flattened out into columns
+    """
+    codes = json_content['dimension'][0]['code']
+    records = [{**{key: value for key, value in code.items() if key != 'attr'},
+                **{attr['category']: attr['value'] for attr in code.get('attr', [])}}
+               for code in codes]
+    return pd.DataFrame(records).infer_objects()
+
+frame_parsers = {'odata': __odata_to_frame,
+                 'athena': __athena_to_frame}
+
+### - Disk cache
+def __cache_path(url, cache_dir):
+    """Helper: the cache file for a URL"""
+    return os.path.join(cache_dir, f"{hashlib.sha1(url.encode()).hexdigest()[:16]}.json")
+
+def __read_cache(url, cache_dir, ttl_hours):
+    """Helper: returns the cached JSON for a URL, or None if missing or expired"""
+    path = __cache_path(url, cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if cached.get('url') != url or time.time() - cached['retrieved_at'] > ttl_hours * 60 * 60:
+        return None
+    return cached['json']
+
+def __write_cache(url, json_content, cache_dir):
+    """Helper: writes the JSON for a URL to the cache atomically"""
+    os.makedirs(cache_dir, exist_ok = True)
+    path = __cache_path(url, cache_dir)
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump({'url': url, 'retrieved_at': time.time(), 'json': json_content}, file)
+    os.replace(f'{path}.tmp', path)
+    return None
+
+### - Retrieval
+async def __fetch_json(session, url, retries = max_retries):
+    """
+    Fetches and decodes a single JSON endpoint, retrying with backoff
+
+    Parameters
+    ----------
+    session : aiohttp.ClientSession
+        The shared, pooled session
+    url : str
+        The endpoint to request
+    retries : int
+        How many times to try before giving up
+    Returns
+    -------
+    json_content : dict
+        The decoded response
+    """
+    for attempt in range(1, retries + 1):
+        try:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                body = await response.read()
+                return json.loads(body)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            if attempt == retries:
+                raise Exception(f'Metadata request to {url} failed after {retries} attempts: {e!r}')
+            print(f'[METADATA] {url} failed ({e.__class__.__name__}). Retrying')
+            await asyncio.sleep(2 ** attempt)
+
+async def get_metadata_async(endpoints = metadata_endpoints, cache_dir = cache_dir,
+                             ttl_hours = cache_ttl_hours, refresh = False,
+                             max_connections = max_connections, optional_apis = ()):
+    """
+    Retrieves all the metadata endpoints concurrently, using the disk cache
+    where possible
+
+    Parameters
+    ----------
+    endpoints : dict
+        {api: {name: url}}, where api is one of 'odata' or 'athena'
+    cache_dir : str
+        Directory for the on-disk cache
+    ttl_hours : float
+        How long cached responses are used before they're requested again
+    refresh : bool
+        If True, ignore the cache and request everything
+    max_connections : int
+        The size of the session's connection pool
+    optional_apis : list
+        APIs whose endpoints may fail without failing the rest, e.g. when
+        they're only fetched to warm the cache. Failed endpoints are left out
+        of the results (and the cache)
+    Returns
+    -------
+    metadata : dict
+        {api: {name: {'url', 'json', 'content'}}}, where 'content' is a
+        pd.DataFrame() of the records in the response
+    """
+    metadata = {api: {} for api in endpoints}
+    to_fetch = []
+    for api, named_urls in endpoints.items():
+        for name, url in named_urls.items():
+            cached = None if refresh else __read_cache(url, cache_dir, ttl_hours)
+            if cached is None:
+                to_fetch += [(api, name, url)]
+            else:
+                metadata[api][name] = {'url': url, 'json': cached}
+    print(f'[METADATA] {sum(len(x) for x in metadata.values())} endpoints from cache, {len(to_fetch)} to request')
+
+    if to_fetch:
+        start = time.time()
+        connector = aiohttp.TCPConnector(limit = max_connections)
+        timeout = aiohttp.ClientTimeout(total = request_timeout)
+        async with aiohttp.ClientSession(connector = connector, timeout = timeout) as session:
+            results = await asyncio.gather(*[__fetch_json(session, url) for _, _, url in to_fetch],
+                                           return_exceptions = True)
+        for (api, name, url), json_content in zip(to_fetch, results):
+            if isinstance(json_content, Exception):
+                if api not in optional_apis:
+                    raise json_content
+                print(f'[METADATA] Skipping {api} {name}: {json_content}')
+                continue
+            __write_cache(url, json_content, cache_dir)
+            metadata[api][name] = {'url': url, 'json': json_content}
+        print(f'[METADATA] Requested {len(to_fetch)} endpoints in {round(time.time() - start, 2)} seconds')
+
+    for api, named_contents in metadata.items():
+        for name, contents in named_contents.items():
+            contents['content'] = frame_parsers[api](contents['json'])
+    return metadata
+
+def get_metadata(endpoints = metadata_endpoints, cache_dir = cache_dir, ttl_hours = cache_ttl_hours,
+                 refresh = False, max_connections = max_connections, optional_apis = ()):
+    """
+    Synchronous wrapper around get_metadata_async. Works whether or not an
+    event loop is already running (e.g. in Spyder / IPython), by running the
+    requests in a separate thread if one is.
+
+    See get_metadata_async for parameters and returns.
+    """
+    coroutine = get_metadata_async(endpoints, cache_dir = cache_dir, ttl_hours = ttl_hours,
+                                   refresh = refresh, max_connections = max_connections,
+                                   optional_apis = optional_apis)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers = 1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
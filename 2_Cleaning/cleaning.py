@@ -14,24 +14,32 @@
  @author: matthew.mcfahn
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 pd.options.mode.chained_assignment = None  # default='warn'
 import numpy as np
+import json
+import os
+import re
 
 import regex_cleaning
+import instrumentation
 from who_helpers import __isnumber, __makenumber, __likenumber, __camel_to_snake
 import sqlite_helpers
 import data_sources_scraping
 
 db_file = f'{sqlite_helpers.outdir}/{sqlite_helpers.sqlite_name}.sqlite3'
 out_db_file = f'{sqlite_helpers.outdir}/who_gho_cleaned.sqlite3'
+# Data-driven rules for cleaning indicator names and categories
+rules_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indicator_rules.json')
 
+@instrumentation.timed(rows = True)
 def __data_suppression(indicator_dataframe):
     """Helper function to reduce data used by the large indicator dataframe"""
-    # Couple columns we just don't need
+    # Couple columns we just don't need. These aren't present if retrieval used an OData $select
     indicator_dataframe.drop(columns = {'SpatialDimType','TimeDimType','DataSourceDimType',
                               'Date','TimeDimensionValue','TimeDimensionBegin','TimeDimensionEnd'}, 
-                   inplace = True)
+                   inplace = True, errors = 'ignore')
     
     # Memory suppression of columns: Numerical
     indicator_dataframe['TimeDim'] = indicator_dataframe['TimeDim'].astype('Int16') # Note, we have to make it Int16 to support Nulls, rather than int16
@@ -118,6 +126,7 @@ def __report_datafill_stats(dataframe, numerics, lows, highs):
               from {start_vals['Percentage']}% to {end_vals['Percentage']}%''')
     return None
 
+@instrumentation.timed(rows = True)
 def __clean_numerical_values(dataframe):
     """Helper function to add NumericValue, Low and High if possible to get 
     this information from parsing the Value column.
@@ -206,6 +215,7 @@ def __clean_numerical_values(dataframe):
     
     return dataframe
     
+@instrumentation.timed(rows = True)
 def clean_indicator_data(dataframe):
     """
     Takes the 'indicator_data' ingested as is, and cleans it:
@@ -242,83 +252,104 @@ def clean_indicator_data(dataframe):
     
     return dataframe, data_sources
 
-def __clean_indicator_info(indicators):
+def __load_indicator_rules(rules_file = rules_file):
     """
-    Cleans the strings contained the the indicator / category dataframe
+    Loads the rule table used to clean indicator info, and compiles it. Name
+    rules stay in order, as each applies to the text left by the ones before
+    it; a single regex of them all finds the names any rule applies to.
+    
+    Parameters
+    ----------
+    rules_file : str
+        Filepath to the JSON rule table
+    Returns
+    -------
+    rules : dict
+        > 'name_regex': an alternation of every name rule, to find the names
+          that need cleaning in one pass
+        > 'name_rules': list of (compiled pattern, replacement), in order
+        > 'category_map': {raw category: cleaned category} overrides
+        > 'category_word_replacements': list of (old, new) word fixes
+        > 'code_regex': an optional lookahead per code rule, so a single
+          match reports every rule that applies to an IndicatorCode
+        > 'code_categories': list of categories, in rule priority order
+    """
+    with open(rules_file, 'r') as file:
+        raw_rules = json.load(file)
+    
+    name_patterns = [rule['pattern'] if rule.get('regex') else re.escape(rule['pattern'])
+                     for rule in raw_rules['name_replacements']]
+    name_rules = [(re.compile(pattern), rule['replacement'])
+                  for pattern, rule in zip(name_patterns, raw_rules['name_replacements'])]
+    
+    code_patterns = [f"(?:(?=.*?(?P<code{i}>{re.escape(rule['contains'])})))?"
+                     for i, rule in enumerate(raw_rules['code_categories'])]
+    
+    rules = {'name_regex': re.compile('|'.join(f'(?:{pattern})' for pattern in name_patterns)),
+             'name_rules': name_rules,
+             'category_map': raw_rules['category_overrides'],
+             'category_word_replacements': raw_rules['category_word_replacements'],
+             'code_regex': re.compile('^' + ''.join(code_patterns)),
+             'code_categories': [rule['category'] for rule in raw_rules['code_categories']]}
+    return rules
+
+@instrumentation.timed(rows = True)
+def __clean_indicator_info(indicators, rules = None):
+    """
+    Cleans the strings contained the the indicator / category dataframe, using
+    the rule table in 'indicator_rules.json'
     
     Parameters
     ----------
     indicators : pd.DataFrame()
         A dataframe of indicator information
+    rules : dict
+        Compiled rules from __load_indicator_rules. Loaded if not passed
     Returns
     -------
     indicators : pd.DataFrame()
         A dataframe of indicator information
     """
-    ### Cleaning 'IndicatorName'
-    # Simple stuff - double spaces, etc.
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace('  ',' ')
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace('<sub>','')
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace('</sub>',' ')
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace('<sup>','')
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace('</sup>',' ')
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace('&#956; ',' ')
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace('&#8805; ',' ')
-    
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace('1 000 000','1,000,000')
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace("1'000'000",'1,000,000')
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace("1000000",'1,000,000')
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace("million population",'1,000,000 population')
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace('100 000','100,000')
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace("100'000","100,000")
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace("100000","100,000")
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace("10'000","10,000")
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace("10 000","10,000")
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace("10000","10,000")
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace("1'000","1,000")
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace("1 000","1,000")
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace("1000","1,000")
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace("\( ","(")
-    indicators['IndicatorName'] = indicators['IndicatorName'].str.replace(" \)",")")
-    
+    if rules is None:
+        rules = __load_indicator_rules()
+    
+    ### Cleaning 'IndicatorName': html tags, spacing, and number formats
+    # Rules apply in order (a later rule can match text an earlier one left), so
+    # names are passed through them one at a time - but only the names that any
+    # rule matches, found in one pass. Any other name is unchanged by the rules
+    to_clean = indicators['IndicatorName'].str.contains(rules['name_regex'], na = False)
+    names = indicators.loc[to_clean, 'IndicatorName']
+    for pattern, replacement in rules['name_rules']:
+        names = names.str.replace(pattern, replacement, regex = True)
+    indicators.loc[to_clean, 'IndicatorName'] = names
     indicators['IndicatorName'] = indicators['IndicatorName'].str.strip()
     
     ### Cleaning 'Category': Standardise spelling and map a couple variants
     categories = [x for x in indicators['CATEGORY'].unique() if not x == None]
     categories = {category: category.title() for category in categories}
-    categories['Negelected tropical diseases'] = 'Neglected Tropical Diseases'
-    categories['Rsud: Governance, Policy And Financing : Prevention'.upper()] = 'RSUD: Governance, Policy And Financing: Prevention'
-    categories['UHC'] = 'Universal Health Coverage'
-    categories['HIV/AIDS and other STIs'] = 'HIV/AIDS And Other STIs'
-    categories['ICD'] = 'ICD'
-    categories['Noncommunicable Diseases Ccs'] = 'Noncommunicable Diseases'
-    categories = {key: val.replace('Amr','AMR').replace('Goe','GOe').replace('Rsud','RSUD').replace('And','and') 
-                 for (key, val) in categories.items()}
+    categories.update(rules['category_map'])
+    for old, new in rules['category_word_replacements']:
+        categories = {key: val.replace(old, new) for (key, val) in categories.items()}
     indicators['CATEGORY'] = indicators['CATEGORY'].map(categories)
     
-    # Add some categories based on desk research. 13 indicators still not mapped
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('GDO_'), 'CATEGORY'] = 'Global Dementia Observatory'
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('EMF'), 'CATEGORY'] = 'Electromagnetic Fields'
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('FAMILYPLANNINGUNPDUHC'), 'CATEGORY'] = 'Sexual and Reproductive Health'
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('SG_DMK_SRCR_FN_ZS'), 'CATEGORY'] = 'Sexual and Reproductive Health'
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('GHED_'), 'CATEGORY'] = 'Health Financing'
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('_UHC'), 'CATEGORY'] = 'Universal Health Coverage'
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('IHRSPAR_'), 'CATEGORY'] = 'International Health Regulations (2005) Monitoring Framework'
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('NLIS_'), 'CATEGORY'] = 'Nutrition'
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('PHE_'), 'CATEGORY'] = 'Public Health and Environment'
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('RADON'), 'CATEGORY'] = 'Public Health and Environment'
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('SA_'), 'CATEGORY'] = 'Global Information System on Alcohol and Health'
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('SE_'), 'CATEGORY'] = "Global Strategy For Women's, Children's and Adolescents' Health"
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('SG_'), 'CATEGORY'] = "Global Strategy For Women's, Children's and Adolescents' Health"
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('SH_'), 'CATEGORY'] = "Global Strategy For Women's, Children's and Adolescents' Health"
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('SI_'), 'CATEGORY'] = "Global Strategy For Women's, Children's and Adolescents' Health"
-    indicators.loc[indicators['CATEGORY'].isna() & indicators['IndicatorCode'].str.contains('SP_'), 'CATEGORY'] = "Global Strategy For Women's, Children's and Adolescents' Health"
+    # Add some categories based on desk research, from the code rules. 13 indicators still not mapped.
+    # Every rule is tested in one match: the first rule (in priority order) that applies wins
+    missing = indicators['CATEGORY'].isna() & indicators['IndicatorCode'].notna()
+    matches = indicators.loc[missing, 'IndicatorCode'].str.extract(rules['code_regex'])
+    if not matches.empty:
+        matched = matches.notna().to_numpy()
+        first_rule = matched.argmax(axis = 1)
+        code_categories = np.array(rules['code_categories'], dtype = object)
+        new_categories = pd.Series(np.where(matched.any(axis = 1), code_categories[first_rule], None),
+                                   index = matches.index)
+        indicators.loc[missing, 'CATEGORY'] = new_categories
     
     # Reorder columns
     indicators = indicators[['IndicatorCode', 'IndicatorName', 'CATEGORY', 'display_sequence', 'url','DEFINITION_XML']]
     
     return indicators
 
+@instrumentation.timed(rows = True)
 def __clean_sources(sources_df):
     """
     Bespoke function for cleaning up the Data Sources data that's been retrieved.
@@ -342,6 +373,7 @@ def __clean_sources(sources_df):
     # TODO: More cleaning - this is messy AF
     return sources_df
 
+@instrumentation.timed(rows = True)
 def __split_ind_data(indicator_dataframe):
     """
     Helper to split out indicator_dataframe into those with and without 
@@ -420,6 +452,7 @@ def __update_column_names(final_frames):
         
     return final_frames
 
+@instrumentation.profile_stage('cleaning')
 def main(db_file, out_db_file):
     """
     Takes the data from the db_file, cleans it, and outputs it to the 
@@ -443,8 +476,20 @@ def main(db_file, out_db_file):
     final_frames = {}
     
     ### - Cleaning
-    # Indicator data (this is the most intensive)
+    # Data source scraping is network bound, so start it now and let it run while the
+    # indicator data is cleaned. 'retrieved' sources are those with indicator data, which
+    # is the same set clean_indicator_data's data_sources ends up with
     indicator_dataframe = input_frames.pop('indicator_data')
+    sources_df = input_frames.pop('data_sources')
+    ind_sources = pd.DataFrame(indicator_dataframe['DataSourceDim'].replace({'NA':None}).dropna().unique()).rename(columns = {0:'DataSourceDim'})
+    ind_sources['retrieved'] = 1
+    sources_df = sources_df.merge(ind_sources, how = 'left', validate = 'one_to_one', left_on = 'label', right_on = 'DataSourceDim')
+    sources_df.drop(columns = {'DataSourceDim'}, inplace = True)
+    sources_df['retrieved'] = sources_df['retrieved'].fillna(0)
+    executor = ThreadPoolExecutor(max_workers = 1)
+    sources_future = executor.submit(__clean_sources, sources_df)
+    
+    # Indicator data (this is the most intensive)
     print('''[INDICATORS] Reducing memory usage of the indicator data... ''')
     print(f'Starting memory used: {round(indicator_dataframe.memory_usage().sum() / (1024**2),2)} Mb')
     indicator_dataframe = __data_suppression(indicator_dataframe)
@@ -484,13 +529,8 @@ def main(db_file, out_db_file):
     
     # - Data sources
     print("[SOURCES] Cleaning info for data sources... ")
-    sources_df = input_frames.pop('data_sources')
-    ind_sources = pd.DataFrame(data_sources['DataSourceDim'].unique()).rename(columns = {0:'DataSourceDim'})
-    ind_sources['retrieved'] = 1
-    sources_df = sources_df.merge(ind_sources, how = 'left', validate = 'one_to_one', left_on = 'label', right_on = 'DataSourceDim')
-    sources_df.drop(columns = {'DataSourceDim'}, inplace = True)
-    sources_df['retrieved'] = sources_df['retrieved'].fillna(0)
-    sources_df = __clean_sources(sources_df)
+    sources_df = sources_future.result()
+    executor.shutdown()
     final_frames['data_sources'] = sources_df
     print("[SOURCES] Cleaning info for data sources... DONE")
     
@@ -36,6 +36,8 @@
 
 import re
 
+import instrumentation
+
 def __identify_cases(string):
     """
     NOTE: This function is a mess. It works, but barely.
@@ -114,6 +116,7 @@ def __identify_cases(string):
     
     return codes
 
+@instrumentation.timed(rows = True)
 def __group_cases(df):
     """
     Used to group cases based on what logic will apply for filling the 
@@ -184,6 +187,7 @@ def __group_cases(df):
     
     return df
 
+@instrumentation.timed(rows = True)
 def __hackgroups(df):
     """
     The Grouping and Regex puts a couple cases into Group 7, when they should be
@@ -200,6 +204,7 @@ def __hackgroups(df):
     df.loc[(df['Group'] == group_number) & (df['Numbers'].apply(lambda x: len(x)) == 2), 'Group'] = 2
     return df
 
+@instrumentation.timed(rows = True)
 def __make_replacements(df):
     """
     Based on the 'Group' column, extracts the numeric parts of the 'Value' col
@@ -265,6 +270,7 @@ def __make_replacements(df):
 
     return df
 
+@instrumentation.timed(rows = True)
 def __clean_likenumbers(likenumbers_df):
     """
     A helper function utilised during the cleaning module to parse the 'Value'
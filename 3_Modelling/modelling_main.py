@@ -7,16 +7,25 @@
  @author: matthew.mcfahn
 """
 
+import numpy as np
 import pandas as pd
+import os
+
 import sqlite_helpers
+import instrumentation
+import surrogate_keys
 
 db_file = f'{sqlite_helpers.outdir}/who_gho_cleaned.sqlite3'
 out_db_file = f'{sqlite_helpers.outdir}/who_data_model.sqlite3'
+# The code and schema the model is built with. When any of them change, an
+# incremental build starts again from scratch
+model_sources = [os.path.abspath(__file__), surrogate_keys.__file__, sqlite_helpers.create_db_script]
 
+@instrumentation.timed(rows = True)
 def __change_code_to_id(indicator_data, other_df, target = 'indicator'):
     """
     Helper function to overwrite 'indicator_code' and 'area_code' with an ID 
-    instead using the 'other_df'
+    instead using the 'other_df', in place
     """
     if target == 'indicator':
         new_col = 'indicator_id'
@@ -25,35 +34,63 @@ def __change_code_to_id(indicator_data, other_df, target = 'indicator'):
         new_col = 'area_id'
         cur_col = 'area_code'
     
-    other_df = other_df[[new_col,cur_col]]
-    indicator_data = indicator_data.merge(other_df, on = cur_col, how = 'left',
-                                          validate = 'many_to_one')
+    indicator_data[new_col] = surrogate_keys.map_codes(indicator_data[cur_col], other_df[cur_col], other_df[new_col],
+                                                       key_name = cur_col)
     indicator_data.drop(columns = {cur_col}, inplace = True)
     return indicator_data
 
-def __deal_with_indicators(indicator_data, granular_data):
+def __long_dims(granular_data, column):
+    """
+    Helper: factorizes the dim1-3 columns 'dim{k}' / 'dim{k}_type' (column =
+    'dim' / 'type') as one long column: dim1 rows, then dim2, then dim3.
+    Returns the codes (-1 for nulls) and the unique values
+    """
+    names = [f'dim{k}' if column == 'dim' else f'dim{k}_type' for k in (1, 2, 3)]
+    # Factorized a column at a time, so the strings are never copied into one long array
+    codes, uniques = zip(*[pd.factorize(granular_data[name]) for name in names])
+    all_uniques = pd.Index(pd.unique(np.concatenate([x.to_numpy(dtype = object) for x in uniques])))
+    # A trailing -1 to look nulls (code -1) up in, as a column can have no values at all
+    codes = np.concatenate([np.append(all_uniques.get_indexer(y), -1)[x] for x, y in zip(codes, uniques)])
+    return codes, all_uniques.to_numpy(dtype = object)
+
+@instrumentation.timed(rows = True)
+def __get_parameters(granular_data, key_conn):
+    """Helper: the parameters table, with stable parameter_ids from the key store"""
+    _, parameter_names = __long_dims(granular_data, 'type')
+    parameters_df = pd.DataFrame({'parameter_name': parameter_names})
+    parameters_df['parameter_id'] = surrogate_keys.assign_ids(key_conn, 'parameter', parameters_df['parameter_name'])
+    parameters_df = parameters_df[['parameter_id','parameter_name']]
+    return parameters_df
+
+@instrumentation.timed(rows = True)
+def __deal_with_indicators(indicator_data, granular_data, parameters_df):
     """Helper for modelling indicators and parameters, also pulling out comments"""
     indicator_data['is_main_measure'] = 1
     granular_data['is_main_measure'] = 0
     
-    # Split out parameters
-    parameters_df = pd.concat([granular_data[['dim1_type']].rename(columns = {'dim1_type':'parameter_name'}),
-                               granular_data[['dim2_type']].rename(columns = {'dim2_type':'parameter_name'}),
-                               granular_data[['dim3_type']].rename(columns = {'dim3_type':'parameter_name'}),
-                               ]).drop_duplicates().dropna().reset_index(drop = True)
-    results_to_params_df = pd.concat([granular_data[['id','dim1_type','dim1']].rename(columns = {'dim1_type':'parameter_name','dim1':'parameter_value'}),
-                                      granular_data[['id','dim2_type','dim2']].rename(columns = {'dim2_type':'parameter_name','dim2':'parameter_value'}),
-                                      granular_data[['id','dim3_type','dim3']].rename(columns = {'dim3_type':'parameter_name','dim3':'parameter_value'}),
-                                      ]).drop_duplicates().dropna().reset_index(drop = True)
-    # Add id for parameters, reorder cols
-    parameters_df['parameter_id'] = range(0, len(parameters_df))
-    parameters_df = parameters_df[['parameter_id','parameter_name']]
-    # Deal with the bridge table: Add an ID and overwrite parameter name with parameter ID
-    results_to_params_df = results_to_params_df.merge(parameters_df, on = 'parameter_name', how = 'left',
-                                                      validate = 'many_to_one')
-    results_to_params_df.rename(columns = {'id':'measurement_id'}, inplace = True)
-    results_to_params_df['result_to_param_id'] = range(0, len(results_to_params_df))    
-    results_to_params_df = results_to_params_df[['result_to_param_id','measurement_id','parameter_id','parameter_value']]
+    # Split out parameters: dim1-3 to long form, as codes, without copying the frame.
+    # 'slot' (which of dim1-3) makes result_to_param_id stable
+    type_codes, type_names = __long_dims(granular_data, 'type')
+    value_codes, values = __long_dims(granular_data, 'dim')
+    measurement_ids = np.tile(granular_data['id'].to_numpy(dtype = 'int64'), 3)
+    slots = np.repeat(np.array([1, 2, 3], dtype = 'int64'), len(granular_data))
+    
+    # Keep the first of each (measurement, parameter, value), dropping nulls
+    rows = np.flatnonzero((type_codes >= 0) & (value_codes >= 0))
+    measurement_codes, measurement_uniques = pd.factorize(measurement_ids[rows])
+    packed = surrogate_keys.pack_codes((measurement_codes, len(measurement_uniques)),
+                                       (type_codes[rows], len(type_names)),
+                                       (value_codes[rows], len(values)))
+    rows = rows[~pd.Series(packed).duplicated().to_numpy()]
+    
+    # Parameter name codes to parameter IDs
+    parameter_ids = surrogate_keys.map_codes(type_names, parameters_df['parameter_name'], parameters_df['parameter_id'],
+                                             key_name = 'parameter_name')
+    results_to_params_df = pd.DataFrame({'result_to_param_id': surrogate_keys.result_to_param_ids(measurement_ids[rows],
+                                                                                                 slots[rows]),
+                                         'measurement_id': measurement_ids[rows],
+                                         'parameter_id': parameter_ids[type_codes[rows]],
+                                         'parameter_value': values[value_codes[rows]]})
     
     ### - Now we can recombine some indicator data!
     granular_data.drop(columns = {'dim1_type','dim1','dim2_type','dim2','dim3_type','dim3'}, inplace = True)
@@ -65,29 +102,83 @@ def __deal_with_indicators(indicator_data, granular_data):
                                      'value':'measurement_value'}, inplace = True)
     # This is now fine, apart from needing to overwrite indicator_id, and area_id later instead of codes
     
-    # Pull out comments, then drop from indicator_data
+    # Pull out comments, then drop from indicator_data. One per measurement, so that's the key
     comments_df = indicator_data[['measurement_id','comments']].dropna()
-    comments_df['comment_id'] = range(0, len(comments_df))
+    comments_df['comment_id'] = comments_df['measurement_id']
     comments_df = comments_df[['comment_id','measurement_id','comments']]
     
     indicator_data.drop(columns = {'comments'}, inplace = True)
     
-    return indicator_data, parameters_df, results_to_params_df, comments_df
+    return indicator_data, results_to_params_df, comments_df
+
+def __composite_keys(left, right, columns):
+    """
+    Helper: packs 'columns' of both frames into one int64 key per row, with
+    codes shared between the frames. Nulls get a code of their own, so they
+    match each other as in a merge. Left rows with a value that isn't in right
+    can never match, and get key -1. Also returns the number of possible keys
+    """
+    left_codes, right_codes, in_right = [], [], np.ones(len(left), dtype = bool)
+    for column in columns:
+        codes, uniques = pd.factorize(right[column])
+        positions = pd.Index(uniques).get_indexer(left[column])
+        left_nulls = left[column].isna().to_numpy()
+        in_right &= (positions >= 0) | left_nulls
+        left_codes += [(np.where(left_nulls, len(uniques), positions), len(uniques) + 1)]
+        right_codes += [(np.where(codes == -1, len(uniques), codes), len(uniques) + 1)]
+    left_keys = surrogate_keys.pack_codes(*[(np.maximum(codes, 0), size) for codes, size in left_codes])
+    cardinality = int(np.prod([size for _, size in right_codes]))
+    return np.where(in_right, left_keys, -1), surrogate_keys.pack_codes(*right_codes), cardinality
 
-def __get_indicator_category_tables(indicator_info_df):
+@instrumentation.timed(rows = True)
+def __bridge_measurements(datasource_bridge_df, indicator_data):
+    """
+    Helper: the datasource bridge's (indicator_code, area_code,
+    measurement_year) rows to measurement_ids. A sort-merge join on a packed
+    composite key, so every intermediate array is the size of the output.
+    Rows with no measurement are dropped
+
+    Returns
+    -------
+    bridge : pd.DataFrame()
+        measurement_id, datasource_code: one row per pair, in bridge order
+        then measurement order
+    """
+    key_columns = ['indicator_code','area_code','measurement_year']
+    bridge_keys, measurement_keys, key_count = __composite_keys(datasource_bridge_df, indicator_data, key_columns)
+    
+    # One row per (key, datasource), before the join rather than after it
+    datasource_codes, datasource_uniques = pd.factorize(datasource_bridge_df['datasource_code'])
+    packed = surrogate_keys.pack_codes((bridge_keys + 1, key_count + 1), (datasource_codes + 1, len(datasource_uniques) + 1))
+    bridge_rows = np.flatnonzero(~pd.Series(packed).duplicated().to_numpy() & (bridge_keys >= 0))
+    bridge_keys = bridge_keys[bridge_rows]
+    
+    # Each bridge row matches a run of the sorted measurement keys
+    order = np.argsort(measurement_keys, kind = 'stable')
+    sorted_keys = measurement_keys[order]
+    starts = np.searchsorted(sorted_keys, bridge_keys, side = 'left')
+    counts = np.searchsorted(sorted_keys, bridge_keys, side = 'right') - starts
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    measurement_rows = order[np.repeat(starts, counts) + offsets]
+    
+    bridge = pd.DataFrame({'measurement_id': indicator_data['measurement_id'].to_numpy()[measurement_rows],
+                           'datasource_code': datasource_bridge_df['datasource_code'].to_numpy(dtype = object)[np.repeat(bridge_rows, counts)]})
+    return bridge
+
+@instrumentation.timed(rows = True)
+def __get_indicator_category_tables(indicator_info_df, key_conn):
     """Sequence for getting indicator and category info"""
     indicator_info_df.drop(columns = {'display_sequence'}, inplace = True)
     category_df = indicator_info_df[['category']].drop_duplicates().sort_values(by = 'category').reset_index(drop = True)
-    category_df['category_id'] = range(0, len(category_df))
     category_df.rename(columns = {'category':'category_name'}, inplace = True)
     category_df.dropna(inplace = True)
+    category_df['category_id'] = surrogate_keys.assign_ids(key_conn, 'category', category_df['category_name'])
 
-    indicator_info_df['indicator_id'] = range(0, len(indicator_info_df))
+    indicator_info_df['indicator_id'] = surrogate_keys.assign_ids(key_conn, 'indicator', indicator_info_df['indicator_code'])
     
-    indicator_info_df.rename(columns = {'category':'category_name'}, inplace = True)
-    indicator_info_df = indicator_info_df.merge(category_df, on = 'category_name', how = 'left',
-                                                validate = 'many_to_one')
-    indicator_info_df.drop(columns = {'category_name'}, inplace = True)
+    indicator_info_df['category_id'] = surrogate_keys.map_codes(indicator_info_df['category'], category_df['category_name'],
+                                                                category_df['category_id'], key_name = 'category')
+    indicator_info_df.drop(columns = {'category'}, inplace = True)
     
     # Columns order
     indicator_info_df = indicator_info_df[['indicator_id','indicator_code','indicator_name','url','definition_xml','category_id']]
@@ -95,10 +186,12 @@ def __get_indicator_category_tables(indicator_info_df):
     
     return indicator_info_df, category_df
     
-def main(db_file, out_db_file):
+@instrumentation.profile_stage('modelling')
+def main(db_file, out_db_file, incremental = False, key_db_file = surrogate_keys.key_db_file):
     """
     Takes the data from the db_file, creates a dimensional model, and outputs
-    to a new sqlite file
+    to a new sqlite file. Surrogate keys are stable between builds (see
+    surrogate_keys), so a rebuild only renumbers nothing.
     
     Parameters
     ----------
@@ -106,6 +199,14 @@ def main(db_file, out_db_file):
         The filepath to the cleaned data
     out_db_file : str
         The filepath to the database to be created
+    incremental : bool
+        If True and out_db_file already exists, only the measurements of
+        indicators whose cleaned rows changed since the last build are
+        rewritten (upserted). Dimension tables are always refreshed whole.
+        The existing out_db_file must have been built with the same key store.
+        If it was built by different code (see model_sources), it's rebuilt
+    key_db_file : str
+        The key store: surrogate key maps, and each indicator's fingerprint
     Returns
     -------
     None
@@ -114,14 +215,39 @@ def main(db_file, out_db_file):
     starting_tables = sqlite_helpers.__get_table_schema(db_file)
     input_frames = sqlite_helpers.__load_db_to_pandas(db_file, starting_tables)
     final_frames = {}
-
-
-    ### - Recombine indicator and granular data, splitting out parameters
-    print('Dealing with measurement data, parameters, and comments... ')
+    key_conn = surrogate_keys.connect(key_db_file)
+    
     indicator_data = input_frames.pop('indicator_data')
     granular_data = input_frames.pop('granular_data')
+    datasource_bridge_df = input_frames.pop('datasource_to_indicator_year_and_area')
+    parameters_df = __get_parameters(granular_data, key_conn)
+    
+    ### - Change detection: in incremental mode, only changed indicators' measurements are rebuilt
+    version = surrogate_keys.code_version(model_sources)
+    fingerprints = surrogate_keys.indicator_fingerprints(indicator_data, granular_data, datasource_bridge_df,
+                                                         version = version)
+    previous = surrogate_keys.load_fingerprints(key_conn)
+    if incremental and os.path.exists(out_db_file):
+        # Nothing to compare the existing model with (e.g. a new key store), or it
+        # was built by other code, so the unchanged indicators would be stale too
+        if previous.empty:
+            print('[INCREMENTAL] No fingerprints from a previous build: rebuilding in full')
+            os.remove(out_db_file)
+        elif surrogate_keys.fingerprint_versions(previous) != {version}:
+            print('[INCREMENTAL] The model code or schema changed since the last build: rebuilding in full')
+            os.remove(out_db_file)
+    incremental = incremental and os.path.exists(out_db_file)
+    if incremental:
+        changed, removed = surrogate_keys.changed_indicators(previous, fingerprints)
+        print(f'[INCREMENTAL] {len(changed)} of {len(fingerprints)} indicators changed, {len(removed)} removed')
+        indicator_data = indicator_data.loc[indicator_data['indicator_code'].isin(changed)]
+        granular_data = granular_data.loc[granular_data['indicator_code'].isin(changed)]
+        datasource_bridge_df = datasource_bridge_df.loc[datasource_bridge_df['indicator_code'].isin(changed)]
+        replaced_indicator_ids = surrogate_keys.assign_ids(key_conn, 'indicator', changed + removed)
     
-    indicator_data, parameters_df, results_to_params_df, comments_df = __deal_with_indicators(indicator_data, granular_data)
+    ### - Recombine indicator and granular data, splitting out parameters
+    print('Dealing with measurement data, parameters, and comments... ')
+    indicator_data, results_to_params_df, comments_df = __deal_with_indicators(indicator_data, granular_data, parameters_df)
     # Write the frames that are ready to our output dict
     final_frames['comments'] = comments_df
     final_frames['results_to_parameters'] = results_to_params_df
@@ -133,7 +259,7 @@ def main(db_file, out_db_file):
     print('Dealing with indicators and categories... ')
     indicator_info_df = input_frames.pop('indicator_info')
     
-    indicator_info_df, category_df = __get_indicator_category_tables(indicator_info_df)
+    indicator_info_df, category_df = __get_indicator_category_tables(indicator_info_df, key_conn)
     # Write the frames that are ready to our output dict
     final_frames['indicator_info'] = indicator_info_df
     final_frames['categories'] = category_df
@@ -147,21 +273,18 @@ def main(db_file, out_db_file):
                                   'url':'source_url',
                                   'source_description':'description'}, inplace = True)
     datasources.drop(columns = {'display_sequence','retrieved'}, inplace = True)
-    datasources['datasource_id'] = range(0, len(datasources))
+    datasources['datasource_id'] = surrogate_keys.assign_ids(key_conn, 'datasource', datasources['datasource_code'])
     datasources = datasources[['datasource_id','datasource_code', 'display', 'source_url', 'description']]
         
-    datasource_bridge_df = input_frames.pop('datasource_to_indicator_year_and_area')
-    datasource_bridge_df.rename(columns = {'time_dim':'measurement_year',
+    datasource_bridge_df = datasource_bridge_df.rename(columns = {'time_dim':'measurement_year',
                                           'spatial_dim':'area_code',
-                                          'data_source_dim':'datasource_code'}, inplace = True)
-    datasource_bridge_df = datasource_bridge_df.merge(indicator_data[['measurement_id','indicator_code','area_code','measurement_year']], 
-                                                      on = ['indicator_code','area_code','measurement_year'],how = 'left')
-    datasource_bridge_df.drop(columns = {'indicator_code','area_code','measurement_year'}, inplace = True)
-    datasource_bridge_df = datasource_bridge_df.drop_duplicates()
-    
-    datasource_bridge_df['matching_id'] = range(0, len(datasource_bridge_df))
-    datasource_bridge_df = datasource_bridge_df.merge(datasources[['datasource_id', 'datasource_code']], on = 'datasource_code',
-                                                      how = 'left', validate = 'many_to_one')
+                                          'data_source_dim':'datasource_code'})
+    datasource_bridge_df = __bridge_measurements(datasource_bridge_df, indicator_data)
+    datasource_bridge_df['datasource_id'] = surrogate_keys.map_codes(datasource_bridge_df['datasource_code'],
+                                                                     datasources['datasource_code'],
+                                                                     datasources['datasource_id'], key_name = 'datasource_code')
+    datasource_bridge_df['matching_id'] = surrogate_keys.matching_ids(datasource_bridge_df['measurement_id'],
+                                                                      datasource_bridge_df['datasource_id'])
     datasource_bridge_df = datasource_bridge_df[['matching_id','datasource_id','measurement_id']]
     
     final_frames['datasources'] = datasources
@@ -176,7 +299,7 @@ def main(db_file, out_db_file):
                             'title':'area_name'}, inplace = True)
     areas_df.drop(columns = {'parent_dimension', 'parent_title'}, inplace = True)
     areas_df = areas_df.sort_values(by = ['dimension','area_code']).reset_index(drop = True)
-    areas_df['area_id'] = range(0, len(areas_df))
+    areas_df['area_id'] = surrogate_keys.assign_ids(key_conn, 'area', areas_df['area_code'])
     areas_df = areas_df[['area_id','area_code','area_name','dimension','parent_code']]
     final_frames['areas'] = areas_df
     print('Dealing with areas... DONE')
@@ -194,6 +317,12 @@ def main(db_file, out_db_file):
     
     # Do outputs
     print('[OUTPUT] Outputting to SQLite')
-    sqlite_helpers.__output_modelled_data(final_frames, out_db_file)
+    if incremental:
+        sqlite_helpers.__upsert_modelled_data(final_frames, out_db_file, replaced_indicator_ids)
+    else:
+        sqlite_helpers.__output_modelled_data(final_frames, out_db_file)
     
+    # Only record what was built once it's written, so a failed run is simply redone
+    surrogate_keys.save_fingerprints(key_conn, fingerprints)
+    key_conn.close()
     return None
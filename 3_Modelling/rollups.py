@@ -0,0 +1,140 @@
+"""
+ Builds the regional rollup cube for the visualisation model: for each
+ indicator, group of countries, parameter value and year, the mean, median,
+ min and max over the countries in the group, and how many there are. So the
+ app can serve regional comparisons without aggregating the country rows on
+ each request.
+
+ Groups are the WHO regions (each country's parent_code) and the world. The
+ GHO country dimension doesn't carry an income group, so there isn't one
+ here, but rollup_groups has a group_type for other groupings to be added.
+
+ Countries with several measurements for the same indicator, year and
+ parameter value (e.g. a value for each age group) are averaged first, so
+ each country counts once. Main measures have parameter_value_id -1.
+
+ -----------------------------------
+ Created on Mon Oct 19 19:02:37 2026
+ @author: matthew.mcfahn
+"""
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+world_group = {'group_id': 0, 'group_type': 'WORLD', 'group_code': 'GLOBAL', 'group_name': 'World'}
+main_measure_value_id = -1
+
+def __grouped_stats(keys, values):
+    """
+    Helper: groups rows on the key columns with one sort (by keys, then
+    value), and reduces each group with NumPy
+
+    Parameters
+    ----------
+    keys : list of np.ndarray
+        Integer key columns, most significant first
+    values : np.ndarray
+        The values to reduce
+    Returns
+    -------
+    group_keys : list of np.ndarray
+        The key columns, one row per group, in key order
+    stats : dict
+        'count', 'mean', 'median', 'min', 'max' arrays, one per group
+    """
+    order = np.lexsort([values] + keys[::-1])
+    keys = [column[order] for column in keys]
+    values = values[order]
+
+    change = np.zeros(len(values), dtype = bool)
+    change[:1] = True
+    for column in keys:
+        change[1:] |= column[1:] != column[:-1]
+    starts = np.flatnonzero(change)
+    counts = np.diff(np.r_[starts, len(values)])
+
+    ends = starts + counts - 1
+    stats = {'count': counts,
+             'mean': np.add.reduceat(values, starts) / counts if len(values) else values,
+             'median': (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2,
+             'min': values[starts],
+             'max': values[ends]}
+    return [column[starts] for column in keys], stats
+
+def __rollup_groups(areas_df):
+    """
+    Helper: the groups (world, then WHO regions), and the region group of each
+    country area_id (-1 if it has none)
+    """
+    countries = areas_df.loc[areas_df['dimension'] == 'COUNTRY']
+    region_codes = sorted(countries['parent_code'].dropna().unique())
+    region_names = areas_df.drop_duplicates(subset = 'area_code').set_index('area_code')['area_name']
+
+    groups = pd.DataFrame({'group_id': np.arange(1, len(region_codes) + 1),
+                           'group_type': 'WHO_REGION',
+                           'group_code': region_codes,
+                           'group_name': [region_names.get(code, code) for code in region_codes]})
+    groups = pd.concat([pd.DataFrame([world_group]), groups]).reset_index(drop = True)
+
+    region_ids = pd.Series(groups['group_id'].values, index = groups['group_code'])
+    country_groups = pd.Series(countries['parent_code'].map(region_ids).fillna(-1).astype('int64').values,
+                               index = countries['area_id'])
+    return groups, country_groups
+
+@instrumentation.timed(rows = True)
+def build_rollups(values_table_df, granular_table_df, results_to_parameters, areas_df):
+    """
+    Computes the rollup cube from the visualisation model's fact tables
+
+    Parameters
+    ----------
+    values_table_df, granular_table_df : pd.DataFrame()
+        The main and granular measurements (indicator_id, area_id, year,
+        measurement_id, numeric_value), countries only
+    results_to_parameters : pd.DataFrame()
+        parameter_value_id, measurement_id for the granular measurements
+    areas_df : pd.DataFrame()
+        The modelled areas, with dimension and parent_code
+    Returns
+    -------
+    rollups : pd.DataFrame()
+        indicator_id, group_id, parameter_value_id, year, country_count,
+        mean_value, median_value, min_value, max_value
+    rollup_groups : pd.DataFrame()
+        group_id, group_type, group_code, group_name
+    """
+    groups, country_groups = __rollup_groups(areas_df)
+
+    # Granular values, once per parameter value they have
+    positions = pd.Index(granular_table_df['measurement_id']).get_indexer(results_to_parameters['measurement_id'])
+    if (positions == -1).any():
+        raise Exception('results_to_parameters refers to measurements not in granular_table')
+    facts = {}
+    for column in ['indicator_id', 'area_id', 'year']:
+        facts[column] = np.concatenate([values_table_df[column].to_numpy(dtype = 'int64'),
+                                        granular_table_df[column].to_numpy(dtype = 'int64')[positions]])
+    facts['parameter_value_id'] = np.concatenate([np.full(len(values_table_df), main_measure_value_id, dtype = 'int64'),
+                                                  results_to_parameters['parameter_value_id'].to_numpy(dtype = 'int64')])
+    values = np.concatenate([values_table_df['numeric_value'].to_numpy(dtype = float),
+                             granular_table_df['numeric_value'].to_numpy(dtype = float)[positions]])
+    keep = ~np.isnan(values)
+
+    # One value per country first
+    keys, country_stats = __grouped_stats([facts['indicator_id'][keep], facts['parameter_value_id'][keep],
+                                           facts['year'][keep], facts['area_id'][keep]], values[keep])
+    indicator_ids, parameter_value_ids, years, area_ids = keys
+
+    # Each country counts towards its region, and the world
+    region_ids = country_groups.reindex(area_ids).fillna(-1).to_numpy(dtype = 'int64')
+    in_region = region_ids >= 0
+    group_ids = np.concatenate([np.full(len(area_ids), world_group['group_id'], dtype = 'int64'), region_ids[in_region]])
+    rows = np.concatenate([np.arange(len(area_ids)), np.flatnonzero(in_region)])
+
+    keys, stats = __grouped_stats([indicator_ids[rows], group_ids, parameter_value_ids[rows], years[rows]],
+                                  country_stats['mean'][rows])
+    rollups = pd.DataFrame({'indicator_id': keys[0], 'group_id': keys[1], 'parameter_value_id': keys[2], 'year': keys[3],
+                            'country_count': stats['count'], 'mean_value': stats['mean'], 'median_value': stats['median'],
+                            'min_value': stats['min'], 'max_value': stats['max']})
+    return rollups, groups
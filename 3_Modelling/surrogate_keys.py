@@ -0,0 +1,262 @@
+"""
+ Stable surrogate keys for the dimensional model, so rebuilding the model
+ never renumbers rows that haven't changed.
+
+ Keys come in two kinds:
+     * Dimension keys (indicator, area, category, datasource, parameter) are
+       looked up in a persisted key map, {natural key: id}, kept in a small
+       SQLite key store. New natural keys get the next free id; ids are never
+       reused or reassigned.
+     * Measurement level keys are derived from the GHO measurement 'Id',
+       which is already stable, so they need no map:
+           comment_id          = measurement_id
+           result_to_param_id  = measurement_id * 4 + dimension slot (1-3)
+           matching_id         = measurement_id * 2**20 + datasource_id
+
+ The key store also holds a fingerprint of each indicator's cleaned rows, so
+ an incremental model refresh can work out which indicators changed. Each
+ fingerprint starts with a version of the code (and schema) that built the
+ model, so a model built by different code is rebuilt rather than updated.
+
+ -----------------------------------
+ Created on Mon Oct 19 17:58:32 2026
+ @author: matthew.mcfahn
+"""
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import hashlib
+import os
+
+import sqlite_helpers
+
+key_db_file = f'{sqlite_helpers.outdir}/who_data_model_keys.sqlite3'
+datasource_bits = 20    # Room for 2**20 datasources in matching_id
+
+create_key_tables_sql = """CREATE TABLE IF NOT EXISTS key_maps (
+                               key_name varchar(50) NOT NULL,
+                               natural_key NOT NULL,
+                               surrogate_id integer NOT NULL,
+                               PRIMARY KEY (key_name, natural_key)
+                           ) WITHOUT ROWID;
+                           CREATE TABLE IF NOT EXISTS indicator_fingerprints (
+                               indicator_code varchar(100) PRIMARY KEY,
+                               fingerprint varchar(40) NOT NULL,
+                               updated_at datetime NOT NULL
+                           );"""
+
+def connect(key_db_file = key_db_file):
+    """Opens the key store, creating its tables if needed"""
+    conn = sqlite_helpers.create_connection(key_db_file)
+    conn.executescript(create_key_tables_sql)
+    return conn
+
+### - Dimension keys
+def load_key_map(conn, key_name):
+    """
+    The persisted key map for one natural key
+
+    Returns
+    -------
+    key_map : pd.Series
+        surrogate ids, indexed by natural key
+    """
+    rows = conn.execute('SELECT natural_key, surrogate_id FROM key_maps WHERE key_name = ?', (key_name,)).fetchall()
+    if not rows:
+        return pd.Series([], index = pd.Index([], dtype = object), dtype = 'int64')
+    natural_keys, ids = zip(*rows)
+    return pd.Series(ids, index = pd.Index(natural_keys), dtype = 'int64')
+
+def assign_ids(conn, key_name, natural_keys):
+    """
+    Looks up the surrogate id of each natural key, giving new keys the next
+    free ids (in order of first appearance) and persisting them
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The key store (see connect)
+    key_name : str
+        Which key map, e.g. 'indicator'
+    natural_keys : array-like
+        The natural keys, e.g. indicator codes. Nulls aren't allowed
+    Returns
+    -------
+    ids : np.ndarray (int64)
+        The surrogate id for each natural key, in the same order
+    """
+    natural_keys = pd.Series(natural_keys, dtype = object).reset_index(drop = True)
+    if natural_keys.isna().any():
+        raise Exception(f"Null natural keys can't be given a '{key_name}' id")
+    key_map = load_key_map(conn, key_name)
+    positions = key_map.index.get_indexer(natural_keys)
+
+    new_keys = pd.unique(natural_keys[positions == -1])
+    if len(new_keys):
+        first_id = int(key_map.max()) + 1 if len(key_map) else 0
+        new_ids = np.arange(first_id, first_id + len(new_keys), dtype = 'int64')
+        with conn:
+            conn.executemany('INSERT INTO key_maps (key_name, natural_key, surrogate_id) VALUES (?, ?, ?)',
+                             [(key_name, key, int(i)) for key, i in zip(new_keys, new_ids)])
+        key_map = pd.concat([key_map, pd.Series(new_ids, index = pd.Index(new_keys))])
+        positions = key_map.index.get_indexer(natural_keys)
+    return key_map.to_numpy()[positions]
+
+def map_codes(codes, key_codes, key_ids, key_name = 'code'):
+    """
+    Swaps natural keys for their ids with a hash lookup on the key table's
+    codes (Index.get_indexer), rather than merging frames
+
+    Parameters
+    ----------
+    codes : array-like
+        The natural keys to look up, e.g. a frame's indicator_code column
+    key_codes : array-like
+        The key table's natural keys, which must be unique
+    key_ids : array-like
+        The key table's ids, in the same order as key_codes
+    key_name : str
+        What the codes are, for error messages
+    Returns
+    -------
+    ids : np.ndarray
+        The id of each code. Null codes match a null key if there is one (as
+        a merge would), and are NaN otherwise, making the array float
+    """
+    key_codes = pd.Index(key_codes)
+    if not key_codes.is_unique:
+        raise Exception(f"Duplicate {key_name}s in the key table: can't map them to ids")
+    codes = np.asarray(codes, dtype = object)
+    positions = key_codes.get_indexer(codes)
+    nulls = pd.isna(codes)
+    missing = (positions == -1) & ~nulls
+    if missing.any():
+        raise Exception(f'{missing.sum()} {key_name}s have no id, e.g. {list(pd.unique(codes[missing])[:5])}')
+    ids = np.asarray(key_ids)[positions]
+    if (positions == -1).any():
+        ids = np.where(positions == -1, np.nan, ids)
+    return ids
+
+### - Measurement level keys
+def result_to_param_ids(measurement_ids, slots):
+    """result_to_param_id from the measurement and its dimension slot (1, 2 or 3)"""
+    return np.asarray(measurement_ids, dtype = 'int64') * 4 + np.asarray(slots, dtype = 'int64')
+
+def matching_ids(measurement_ids, datasource_ids):
+    """matching_id from the measurement and datasource ids"""
+    datasource_ids = np.asarray(datasource_ids, dtype = 'int64')
+    if len(datasource_ids) and datasource_ids.max() >= 2**datasource_bits:
+        raise Exception(f'More than 2**{datasource_bits} datasources: matching_id would overflow')
+    return (np.asarray(measurement_ids, dtype = 'int64') << datasource_bits) + datasource_ids
+
+### - Composite keys
+def pack_codes(*codes):
+    """
+    Packs several columns of factorized codes into one int64 key per row, so
+    composite keys can be deduplicated or joined as a single integer column
+
+    Parameters
+    ----------
+    *codes : (np.ndarray, int)
+        (codes, cardinality) pairs, with codes in 0 - cardinality-1
+    Returns
+    -------
+    packed : np.ndarray (int64)
+    """
+    if np.prod([float(max(cardinality, 1)) for _, cardinality in codes]) >= 2**63:
+        raise Exception('Composite key too large to pack into int64')
+    packed = np.zeros(len(codes[0][0]), dtype = 'int64')
+    for column, cardinality in codes:
+        packed = packed * max(cardinality, 1) + np.asarray(column, dtype = 'int64')
+    return packed
+
+### - Change detection
+def code_version(paths):
+    """
+    A short hash of the files a model is built from (its code and schema).
+    Missing files are hashed by name only
+
+    Parameters
+    ----------
+    paths : list
+        Filepaths, e.g. the modules that build the model
+    Returns
+    -------
+    version : str
+        12 hex characters
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                digest.update(file.read())
+    return digest.hexdigest()[:12]
+
+def indicator_fingerprints(*frames, code_column = 'indicator_code', version = ''):
+    """
+    An order independent fingerprint of each indicator's rows, across frames
+
+    Parameters
+    ----------
+    *frames : pd.DataFrame()
+        Frames with a code_column, e.g. the cleaned indicator and granular data
+    code_column : str
+        The indicator code column
+    version : str
+        The code version (see code_version) the rows are modelled with
+    Returns
+    -------
+    fingerprints : pd.Series
+        '<version>:<sum of row hashes>-<row count>' (hex), indexed by indicator code
+    """
+    codes, hashes = [], []
+    for frame in frames:
+        codes += [frame[code_column].to_numpy(dtype = object)]
+        hashes += [pd.util.hash_pandas_object(frame, index = False).to_numpy()]
+    codes, uniques = pd.factorize(np.concatenate(codes))
+    hashes = np.concatenate(hashes)
+
+    order = np.argsort(codes, kind = 'stable')
+    codes, hashes = codes[order], hashes[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    # uint64 addition wraps, so this is a sum mod 2**64
+    sums = np.add.reduceat(hashes, starts) if len(hashes) else np.array([], dtype = 'uint64')
+    counts = np.diff(np.r_[starts, len(codes)])
+    return pd.Series([f'{version}:{int(total):016x}-{count}' for total, count in zip(sums, counts)],
+                     index = pd.Index(uniques[codes[starts]]), dtype = object)
+
+def load_fingerprints(conn):
+    """The fingerprints saved by the last successful model build"""
+    rows = conn.execute('SELECT indicator_code, fingerprint FROM indicator_fingerprints').fetchall()
+    return pd.Series(dict(rows), dtype = object)
+
+def save_fingerprints(conn, fingerprints):
+    """Replaces the saved fingerprints with those of the model just built"""
+    updated_at = datetime.now().isoformat(timespec = 'seconds')
+    with conn:
+        conn.execute('DELETE FROM indicator_fingerprints')
+        conn.executemany('INSERT INTO indicator_fingerprints VALUES (?, ?, ?)',
+                         [(code, fingerprint, updated_at) for code, fingerprint in fingerprints.items()])
+    return None
+
+def fingerprint_versions(fingerprints):
+    """The code versions in a set of fingerprints (see indicator_fingerprints)"""
+    return set(fingerprints.str.split(':').str[0]) if len(fingerprints) else set()
+
+def changed_indicators(previous, current):
+    """
+    Compares fingerprints
+
+    Returns
+    -------
+    changed : list
+        Codes that are new, or whose rows changed
+    removed : list
+        Codes no longer present
+    """
+    removed = sorted(set(previous.index) - set(current.index))
+    previous = previous.reindex(current.index)
+    changed = current.index[previous.isna() | (previous != current)].tolist()
+    return changed, removed
@@ -3,11 +3,13 @@
  model that's been developed.
  
  The visualisation model does a couple of things:
-     > Combines some of the dimension tables for less joins for the model
-       front end
      > Cuts the data down just to 'COUNTRY' entries
      > Drops other irrelevant data (e.g. indicator not in a category)
-     > Replaces some IDs with _code's
+     > Splits the main measures from the granular (parameterised) ones
+     > Keeps only small integer keys in the fact tables, clustered on
+       (indicator_id, area_id, year, measurement_id). Names and codes live in
+       the small dimension tables, which the app holds in memory
+     > Pre-aggregates WHO region and world rollups (see rollups.py)
  
  -----------------------------------
  Created on Tue Mar 16 12:58:02 2021
@@ -15,40 +17,73 @@
 """
 
 
+import numpy as np
 import pandas as pd
 import sqlite_helpers
+import instrumentation
+import surrogate_keys
+import rollups
 
 db_file = f'{sqlite_helpers.outdir}/who_data_model.sqlite3'
 out_db_file = f'{sqlite_helpers.outdir}/visualisation_model.sqlite3'
+# 'year' is part of the primary key, so can't be null. Measurements without one get this
+year_sentinel = -1
+fact_key = ['indicator_id','area_id','year','measurement_id']
 
-def __cut_values(values_table_df, areas_df, indicator_info_df, categories):
+@instrumentation.timed(rows = True)
+def __cut_values(values_table_df, areas_df, indicator_info_df):
     """
-    Helper function to cut to just countries and indicators with a category.
-    Also eplaces the '_id' with '_code'
+    Helper function to cut to just countries and indicators with a category,
+    and numeric values. Keeps the integer keys only
     """
     target_areas = areas_df.loc[areas_df['dimension'].isin(['COUNTRY'])].area_id
     target_indicators = indicator_info_df.loc[indicator_info_df['category_id'].notna()].indicator_id
-    area_mapping = areas_df.loc[areas_df['dimension'].isin(['COUNTRY'])][['area_id','area_code','area_name']]
-    indicator_mapping = indicator_info_df.loc[indicator_info_df['category_id'].notna()][['indicator_id','indicator_code','indicator_name','category_id']]
-    indicator_mapping = indicator_mapping.merge(categories, on = 'category_id', how = 'left', validate = 'many_to_one')
-    indicator_mapping.drop(columns = {'category_id'}, inplace = True)
     
     # Cut the data
-    values_table_df = values_table_df.loc[values_table_df['area_id'].isin(target_areas)]
-    values_table_df = values_table_df.loc[values_table_df['indicator_id'].isin(target_indicators)]
-    values_table_df = values_table_df.loc[values_table_df['numeric_value'].notna()]
+    values_table_df = values_table_df.loc[values_table_df['area_id'].isin(target_areas)
+                                          & values_table_df['indicator_id'].isin(target_indicators)
+                                          & values_table_df['numeric_value'].notna()]
     
-    # Overwrite the '_id' cols with '_name', or '_code'
-    values_table_df = values_table_df.merge(area_mapping, on = 'area_id', how = 'left',
-                                            validate = 'many_to_one')
-    values_table_df = values_table_df.merge(indicator_mapping, on = 'indicator_id', how = 'left',
-                                            validate = 'many_to_one')
-    
-    values_table_df = values_table_df[['measurement_id','area_code', 'area_name', 'indicator_code', 'indicator_name','category_name','measurement_year',
-                                       'measurement_value', 'numeric_value', 'low', 'high', 'is_main_measure']]
+    values_table_df = values_table_df.rename(columns = {'measurement_year':'year'})
+    values_table_df['year'] = values_table_df['year'].fillna(year_sentinel).astype('int64')
+    values_table_df = values_table_df.sort_values(by = fact_key).reset_index(drop = True)
     
+    values_table_df = values_table_df[fact_key + ['measurement_value', 'numeric_value', 'low', 'high', 'is_main_measure']]
     return values_table_df
 
+@instrumentation.timed(rows = True)
+def __parameter_values(results_to_parameters, granular_table_df):
+    """
+    Helper: gives each (parameter, value) of the granular rows a
+    parameter_value_id, so the bridge tables hold integers only
+
+    Returns
+    -------
+    parameter_values, results_to_parameters, indicator_to_parameters : pd.DataFrame()
+    """
+    results_to_parameters = results_to_parameters.loc[results_to_parameters['measurement_id'].isin(granular_table_df['measurement_id'])]
+    parameter_ids = results_to_parameters['parameter_id'].to_numpy(dtype = 'int64')
+    value_codes, values = pd.factorize(results_to_parameters['parameter_value'])
+    packed = surrogate_keys.pack_codes((parameter_ids, int(parameter_ids.max(initial = 0)) + 1), (value_codes, len(values)))
+    # Sorted, so ids run in order of parameter
+    codes, uniques = pd.factorize(packed, sort = True)
+    
+    parameter_values = pd.DataFrame({'parameter_value_id': np.arange(len(uniques)),
+                                     'parameter_id': uniques // max(len(values), 1),
+                                     'parameter_value': np.asarray(values, dtype = object)[uniques % max(len(values), 1)]})
+    results_to_parameters = pd.DataFrame({'parameter_value_id': codes,
+                                          'measurement_id': results_to_parameters['measurement_id'].to_numpy()})
+    results_to_parameters = results_to_parameters.drop_duplicates().sort_values(by = ['parameter_value_id','measurement_id'])
+    
+    # Get an indicator to parameter matching
+    indicator_ids = surrogate_keys.map_codes(results_to_parameters['measurement_id'], granular_table_df['measurement_id'],
+                                             granular_table_df['indicator_id'], key_name = 'measurement_id')
+    indicator_to_parameters = pd.DataFrame({'indicator_id': indicator_ids,
+                                            'parameter_value_id': results_to_parameters['parameter_value_id'].to_numpy()})
+    indicator_to_parameters = indicator_to_parameters.drop_duplicates().sort_values(by = ['indicator_id','parameter_value_id'])
+    return parameter_values, results_to_parameters, indicator_to_parameters
+
+@instrumentation.profile_stage('visualisation')
 def main(db_file, out_db_file):
     """
     Takes the data from the db_file, creates a simpler dimensional model, and 
@@ -75,45 +110,49 @@ def main(db_file, out_db_file):
     indicator_info_df = input_frames.pop('indicator_info')
     categories = input_frames.pop('categories')
     
-    values_table_df = __cut_values(values_table_df, areas_df, indicator_info_df, categories)
-    granular_table_df = values_table_df.loc[values_table_df['is_main_measure'] == 0]
-    values_table_df = values_table_df.loc[values_table_df['is_main_measure'] == 1]
-    
+    values_table_df = __cut_values(values_table_df, areas_df, indicator_info_df)
+    is_main_measure = values_table_df.pop('is_main_measure') == 1
+    granular_table_df = values_table_df.loc[~is_main_measure]
+    values_table_df = values_table_df.loc[is_main_measure]
     
     final_frames['value_table'] = values_table_df
     final_frames['granular_table'] = granular_table_df
     
+    # Dimensions: just the rows the fact tables use
+    present = pd.concat([values_table_df[['indicator_id','area_id']], granular_table_df[['indicator_id','area_id']]])
+    areas_model_df = areas_df
+    areas_df = areas_df.loc[areas_df['area_id'].isin(present['area_id'])]
+    indicator_info_df = indicator_info_df.loc[indicator_info_df['indicator_id'].isin(present['indicator_id'])]
+    categories = categories.loc[categories['category_id'].isin(indicator_info_df['category_id'])]
+    final_frames['areas'] = areas_df[['area_id','area_code','area_name']]
+    final_frames['indicators'] = indicator_info_df[['indicator_id','indicator_code','indicator_name','category_id']].astype({'category_id':'int64'})
+    final_frames['categories'] = categories[['category_id','category_name']]
+    
     # Leave data sources as-is
     datasource_bridge_table = input_frames.pop('datasource_bridge_table')
     datasources = input_frames.pop('datasources')
     final_frames['datasource_bridge_table'] = datasource_bridge_table
     final_frames['datasources'] = datasources
     
-    # Make results_to_params have more info, and only for granular rows
+    # Parameters, and results_to_params, only for granular rows
     results_to_parameters = input_frames.pop('results_to_parameters')
     parameters = input_frames.pop('parameters')
-    results_to_parameters = results_to_parameters.merge(parameters, on = 'parameter_id',
-                                                        how = 'left', validate = 'many_to_one')
-    results_to_parameters.drop(columns = {'result_to_param_id'}, inplace = True)
-    present_rows = granular_table_df[['measurement_id']]
-    results_to_parameters = results_to_parameters.merge(present_rows, how = 'right', validate = 'many_to_one')
-    
+    parameter_values, results_to_parameters, indicator_to_parameters = __parameter_values(results_to_parameters, granular_table_df)
+    final_frames['parameters'] = parameters.loc[parameters['parameter_id'].isin(parameter_values['parameter_id'])]
+    final_frames['parameter_values'] = parameter_values
     final_frames['results_to_parameters'] = results_to_parameters
+    final_frames['indicator_to_parameters'] = indicator_to_parameters
     
-    # Get an indicator to parameter matching
-    ind_to_param = granular_table_df[['measurement_id','indicator_code']]
-    ind_to_param = ind_to_param.merge(results_to_parameters, on = 'measurement_id', how = 'inner', validate = 'one_to_many')
-    ind_to_param.drop(columns = {'measurement_id'}, inplace = True)
-    ind_to_param.drop_duplicates(inplace = True)
-    final_frames['indicator_to_parameters'] = ind_to_param
+    # Regional and world rollups, over countries
+    rollup_df, rollup_groups = rollups.build_rollups(values_table_df, granular_table_df, results_to_parameters, areas_model_df)
+    final_frames['rollups'] = rollup_df
+    final_frames['rollup_groups'] = rollup_groups
     
     # Leave comments as-is
     comments = input_frames.pop('comments')
     final_frames['comments'] = comments
 
     ### - OUTPUT
-    sqlite_helpers.__dimensions_to_sqlite(dimensions = final_frames, 
-                                          db_file = out_db_file, 
-                                          val_is_frame = True)
+    sqlite_helpers.__output_visualisation_data(final_frames, out_db_file)
     return None
 
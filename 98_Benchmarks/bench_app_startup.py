@@ -0,0 +1,62 @@
+"""
+ Benchmark: worker boot time and memory for the Dash app. Each measurement runs
+ in a fresh interpreter, so it reflects what a new gunicorn worker pays:
+     > import: importing app.py (what a worker does before accepting requests)
+     > first layout: import, plus building the layout (loads static assets)
+ The static assets are measured both from the database ('cold', no snapshot),
+ and from the serialized snapshot ('warm').
+ 
+     python 98_Benchmarks/bench_app_startup.py
+ 
+ -----------------------------------
+ Created on Mon Oct 19 11:03:29 2026
+ @author: matthew.mcfahn
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from bench_helpers import repo_root
+import dash_data_extraction
+
+# Runs in the child interpreter: reports wall times and peak RSS as JSON
+child_script = """
+import json, resource, sys, time
+sys.path[:0] = {paths}
+start = time.perf_counter()
+import app
+imported = time.perf_counter() - start
+if {build_layout}:
+    app.app.layout()
+ready = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+peak_mb = peak / 1024 if sys.platform != 'darwin' else peak / (1024 ** 2)
+print(json.dumps({{'import_s': imported, 'ready_s': ready, 'peak_rss_mb': peak_mb}}))
+"""
+
+def __run_child(build_layout):
+    """Helper: run the child script in a fresh interpreter, returning its stats"""
+    paths = [repo_root, os.path.join(repo_root, '99_Shared')]
+    script = child_script.format(paths = repr(paths), build_layout = build_layout)
+    result = subprocess.run([sys.executable, '-c', script], capture_output = True, 
+                            text = True, cwd = repo_root, check = True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    """Prints boot time and peak memory for each scenario"""
+    scenarios = []
+    if os.path.exists(dash_data_extraction.snapshot_file):
+        os.remove(dash_data_extraction.snapshot_file)
+    scenarios += [('import only', __run_child(False))]
+    scenarios += [('first layout (cold, from db)', __run_child(True))]
+    scenarios += [('first layout (warm, snapshot)', __run_child(True))]
+    
+    print(f"{'scenario':<34}{'import s':>10}{'ready s':>10}{'peak RSS Mb':>14}")
+    for name, stats in scenarios:
+        print(f"{name:<34}{stats['import_s']:>10.3f}{stats['ready_s']:>10.3f}{stats['peak_rss_mb']:>14.1f}")
+    return None
+
+if __name__ == "__main__":
+    main()
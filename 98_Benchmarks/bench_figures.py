@@ -0,0 +1,68 @@
+"""
+ Benchmark: time to render the graph callbacks' figures, from query results
+ to the JSON Dash sends, for:
+     > dicts: app.py's plain dict figures, from its pre-built layouts and
+       trace styles
+     > graph_objects: the same figures, passed through go.Figure, which
+       validates every property (as building them with graph_objects did)
+ The query results are fetched once, so only figure building (including
+ app.py's data preparation) and JSON encoding, with plotly's encoder as Dash
+ does, are timed.
+
+     python 98_Benchmarks/bench_figures.py [--area GBR] [--indicator WHOSIS_000014] [--repeats 200]
+
+ -----------------------------------
+ Created on Mon Oct 19 21:34:50 2026
+ @author: matthew.mcfahn
+"""
+
+import argparse
+import json
+import time
+
+import plotly.graph_objects as go
+import plotly.utils
+
+from bench_helpers import graph_inputs, percentile
+import app as dash_app
+from dash_data_extraction import __get_linegraph_data, __get_worldmap_data
+
+### - Timing
+def __time_render(render, repeats):
+    """Helper: render and JSON encode a figure repeatedly, returning (times in ms, payload bytes)"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        payload = json.dumps(render(), cls = plotly.utils.PlotlyJSONEncoder)
+        times += [(time.perf_counter() - start) * 1000]
+    return times, len(payload)
+
+def main(area_code, ind_code, repeats):
+    """Prints per-render times for each figure and approach"""
+    lookups = dash_app.load_static_assets()['lookups']
+    ind_id = lookups['indicator_id'][ind_code]
+    line_data = __get_linegraph_data(lookups['area_id'][area_code], ind_id)
+    globe_data = __get_worldmap_data(ind_id)
+    lineplot = lambda: dash_app.__lineplot_figure(line_data, area_code, ind_code, None)
+    globe = lambda: dash_app.__globe_figure(globe_data.copy(), ind_code, None)
+
+    renders = [('line plot', 'dicts', lineplot),
+               ('line plot', 'graph_objects', lambda: go.Figure(lineplot())),
+               ('world map', 'dicts', globe),
+               ('world map', 'graph_objects', lambda: go.Figure(globe()))]
+
+    print(f'[BENCH] Figure render + JSON encode: {area_code}, {ind_code}, {repeats} repeats '
+          f"({len(line_data['year'])} line plot rows, {len(globe_data)} world map rows)")
+    print(f"{'figure':<12}{'approach':<16}{'p50 ms':>10}{'p90 ms':>10}{'bytes':>10}")
+    for figure, approach, render in renders:
+        times, size = __time_render(render, repeats)
+        print(f'{figure:<12}{approach:<16}{percentile(times, 50):>10.3f}{percentile(times, 90):>10.3f}{size:>10}')
+    return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Benchmark figure rendering for the graph callbacks')
+    parser.add_argument('--area', default = graph_inputs[0][1])
+    parser.add_argument('--indicator', default = graph_inputs[1][1])
+    parser.add_argument('--repeats', type = int, default = 200)
+    arguments = parser.parse_args()
+    main(arguments.area, arguments.indicator, arguments.repeats)
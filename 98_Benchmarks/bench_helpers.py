@@ -0,0 +1,62 @@
+"""
+ Shared helpers for the benchmark scripts: path setup so the pipeline and app
+ modules can be imported, and builders for Dash callback request payloads.
+ 
+ -----------------------------------
+ Created on Mon Oct 19 09:40:02 2026
+ @author: matthew.mcfahn
+"""
+
+import os
+import sys
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ['', '1_Retrieval', '2_Cleaning', '3_Modelling', '99_Shared']:
+    path = os.path.join(repo_root, folder)
+    if path not in sys.path:
+        sys.path.append(path)
+
+# The graph callback (line plot and world map together), and its default selections
+graph_outputs = ['single_country_graph', 'globe_graph']
+graph_inputs = [('area_dropdown', 'GBR'), ('indicator_dropdown', 'WHOSIS_000014'), ('parameter_dropdown', None)]
+
+def callback_payload(output_id, output_property, inputs, state = None):
+    """
+    Builds the JSON body Dash's front end sends to '/_dash-update-component'
+
+    Parameters
+    ----------
+    output_id : str or list
+        The component id of the callback output, or a list of ids for a
+        callback with several outputs
+    output_property : str
+        The property of the output component(s), e.g. 'figure'
+    inputs : list
+        A list of (component_id, value) tuples, all on the 'value' property
+    state : list
+        Optional list of (component_id, property, value) tuples
+    Returns
+    -------
+    payload : dict
+        The request body, to be sent as JSON
+    """
+    if isinstance(output_id, list):
+        output = '..' + '...'.join(f'{cid}.{output_property}' for cid in output_id) + '..'
+        outputs = [{'id': cid, 'property': output_property} for cid in output_id]
+    else:
+        output = f'{output_id}.{output_property}'
+        outputs = {'id': output_id, 'property': output_property}
+    payload = {'output': output,
+               'outputs': outputs,
+               'inputs': [{'id': cid, 'property': 'value', 'value': value} for cid, value in inputs],
+               'changedPropIds': [f'{inputs[0][0]}.value'],
+               'state': [{'id': cid, 'property': prop, 'value': value} for cid, prop, value in (state or [])]}
+    return payload
+
+def percentile(values, pct):
+    """Simple nearest-rank percentile of a list of numbers"""
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
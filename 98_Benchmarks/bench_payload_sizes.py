@@ -0,0 +1,60 @@
+"""
+ Benchmark: payload sizes for the Dash graph callbacks and static assets,
+ before (identity) and after (gzip / brotli) compression, plus the cost of
+ repeat requests served from the callback payload cache / HTTP validators.
+ 
+ Run from anywhere, against an existing visualisation database:
+     python 98_Benchmarks/bench_payload_sizes.py
+ 
+ -----------------------------------
+ Created on Mon Oct 19 09:52:17 2026
+ @author: matthew.mcfahn
+"""
+
+import time
+
+from bench_helpers import callback_payload, graph_outputs, graph_inputs
+import app as dash_app
+
+indicators = ['WHOSIS_000014', 'WHOSIS_000001', 'MDG_0000000001']
+encodings = ['identity', 'gzip', 'br']
+
+def __time_request(client, method, path, **kwargs):
+    """Helper: make a request with the test client, returning (response, ms)"""
+    start = time.perf_counter()
+    response = getattr(client, method)(path, **kwargs)
+    elapsed = (time.perf_counter() - start) * 1000
+    return response, elapsed
+
+def main():
+    """Prints a table of payload sizes and timings for each encoding"""
+    client = dash_app.server.test_client()
+    
+    print('[BENCH] Callback payload sizes (bytes) and timings (ms)')
+    print(f"{'callback':<40}{'encoding':<10}{'bytes':>10}{'cold ms':>10}{'warm ms':>10}")
+    for ind_code in indicators:
+        graphs = callback_payload(graph_outputs, 'figure',
+                                  [graph_inputs[0], ('indicator_dropdown', ind_code), graph_inputs[2]])
+        for name, payload in [(f'graphs:{ind_code}', graphs)]:
+            for encoding in encodings:
+                headers = {'Accept-Encoding': encoding}
+                # Change a throwaway key so the first request misses the payload cache
+                cold_payload = {**payload, 'bench_encoding': encoding}
+                response, cold = __time_request(client, 'post', '/_dash-update-component',
+                                                json = cold_payload, headers = headers)
+                response, warm = __time_request(client, 'post', '/_dash-update-component',
+                                                json = cold_payload, headers = headers)
+                print(f"{name:<40}{encoding:<10}{len(response.data):>10}{cold:>10.1f}{warm:>10.1f}")
+    
+    print('\n[BENCH] Static assets: first load vs revalidation (bytes)')
+    for asset in ['style.css', 'favicon.ico']:
+        response, _ = __time_request(client, 'get', f'/assets/{asset}', headers = {'Accept-Encoding': 'br'})
+        first = len(response.get_data())
+        etag = response.headers.get('ETag')
+        response, _ = __time_request(client, 'get', f'/assets/{asset}', headers = {'Accept-Encoding': 'br',
+                                                                                   'If-None-Match': etag or ''})
+        print(f"{asset:<40}first: {first:>8}  repeat: {len(response.get_data()):>8} (HTTP {response.status_code})")
+    return None
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+ Benchmarks the pipeline stages (cleaning -> modelling -> visualisation) on a
+ synthetic staging database of a chosen size (see synthetic_data.py), and
+ appends the results to a JSON-lines history so throughput and peak memory
+ can be tracked over time, and regressions spotted.
+
+ Each stage runs in its own spawned process (as in pipeline.py), so its wall
+ time and peak RSS are its own. Every run records the git commit, and is
+ compared with the last run of the same stage at the same scale.
+
+ Usage:
+     python bench_pipeline.py --rows 1000000 10000000 [--stages cleaning] [--regenerate]
+
+ -----------------------------------
+ Created on Mon Oct 19 17:20:44 2026
+ @author: matthew.mcfahn
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import multiprocessing
+import subprocess
+import platform
+import argparse
+import json
+import os
+
+import pandas as pd
+
+from bench_helpers import repo_root
+import synthetic_data
+import sqlite_helpers
+import pipeline
+
+bench_dir = f'{sqlite_helpers.outdir}/benchmarks'
+history_file = f'{bench_dir}/pipeline_history.jsonl'
+# Each stage reads the previous stage's output
+stage_functions = {'cleaning': ('cleaning', 'main'),
+                   'modelling': ('modelling_main', 'main'),
+                   'visualisation': ('visualisation_model', 'main')}
+
+def __git_commit():
+    """Helper: the current commit, with '+dirty' if there are local changes"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = repo_root,
+                                capture_output = True, text = True, check = True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd = repo_root,
+                               capture_output = True, text = True, check = True).stdout.strip()
+        return commit + ('+dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def __load_history(history_file):
+    """Helper: previous benchmark records"""
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file, 'r') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def __append_history(record, history_file):
+    """Helper: add one record to the history"""
+    os.makedirs(os.path.dirname(history_file), exist_ok = True)
+    with open(history_file, 'a') as file:
+        file.write(json.dumps(record) + '\n')
+    return None
+
+def __compare(record, history):
+    """Helper: a short comparison with the last successful run of the same stage and scale"""
+    previous = [x for x in history if x['stage'] == record['stage'] and x['rows'] == record['rows']
+                and x['status'] == 'ok']
+    if not previous or record['status'] != 'ok':
+        return ''
+    last = previous[-1]
+    time_change = (record['wall_s'] / last['wall_s'] - 1) * 100 if last['wall_s'] else 0
+    memory_change = ((record['peak_rss_mb'] / last['peak_rss_mb'] - 1) * 100
+                     if record['peak_rss_mb'] and last['peak_rss_mb'] else 0)
+    return f" ({time_change:+.1f}% time, {memory_change:+.1f}% memory vs {last['commit']})"
+
+def run(rows, stages = list(stage_functions), regenerate = False, bench_dir = bench_dir,
+        history_file = history_file, seed = 0):
+    """
+    Benchmarks the stages at one scale
+
+    Parameters
+    ----------
+    rows : int
+        The number of synthetic indicator_data rows
+    stages : list
+        The stages to run, in pipeline order. A stage's input is the previous
+        stage's output, so earlier outputs must exist if stages are skipped
+    regenerate : bool
+        Re-generate the synthetic staging database even if it exists
+    bench_dir : str
+        Where the synthetic and stage output databases go
+    history_file : str
+        The JSON-lines history to append to
+    seed : int
+        Random seed for the synthetic data
+    Returns
+    -------
+    records : list
+        The records appended to the history
+    """
+    os.makedirs(bench_dir, exist_ok = True)
+    staged_file = f'{bench_dir}/synthetic_{rows}.sqlite3'
+    if regenerate or not os.path.exists(staged_file):
+        synthetic_data.write_staged_db(staged_file, rows, seed = seed)
+
+    history = __load_history(history_file)
+    common = {'timestamp': datetime.now().isoformat(timespec = 'seconds'), 'commit': __git_commit(),
+              'rows': rows, 'python': platform.python_version(), 'pandas': pd.__version__,
+              'machine': platform.machine()}
+    context = multiprocessing.get_context('spawn')
+    records = []
+    input_file = staged_file
+    for stage in stage_functions:
+        output_file = f'{bench_dir}/synthetic_{rows}_{stage}.sqlite3'
+        if stage in stages:
+            # Modelling gets its own key store, so each run is a full build with fresh keys
+            key_file = f'{bench_dir}/synthetic_{rows}_keys.sqlite3'
+            kwargs = {'key_db_file': key_file} if stage == 'modelling' else None
+            for path in [output_file] + ([key_file] if kwargs else []):
+                if os.path.exists(path):
+                    os.remove(path)
+            print(f'[BENCHMARK] {stage} on {rows:,} rows... ')
+            with ProcessPoolExecutor(max_workers = 1, mp_context = context) as executor:
+                future = executor.submit(pipeline.__run_stage, *stage_functions[stage], (input_file, output_file), kwargs)
+                try:
+                    stats = future.result()
+                    status = 'ok'
+                except Exception as e:
+                    stats = {'wall_time': None, 'peak_rss_mb': None}
+                    status = f'{e.__class__.__name__}: {e}'
+            record = {**common, 'stage': stage, 'status': status, 'wall_s': stats['wall_time'],
+                      'rows_per_s': round(rows / stats['wall_time']) if stats['wall_time'] else None,
+                      'peak_rss_mb': stats['peak_rss_mb']}
+            print(f"[BENCHMARK] {stage} on {rows:,} rows... {status}: {record['wall_s']}s, "
+                  f"{record['rows_per_s']} rows/s, peak RSS {record['peak_rss_mb']} Mb{__compare(record, history)}")
+            __append_history(record, history_file)
+            records += [record]
+            if status != 'ok':
+                break
+        input_file = output_file
+    return records
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the pipeline stages on synthetic data')
+    parser.add_argument('--rows', type = int, nargs = '+', default = [1_000_000])
+    parser.add_argument('--stages', nargs = '+', choices = list(stage_functions), default = list(stage_functions))
+    parser.add_argument('--regenerate', action = 'store_true', help = 'Re-generate the synthetic data')
+    parser.add_argument('--bench-dir', default = bench_dir)
+    parser.add_argument('--history', default = history_file)
+    arguments = parser.parse_args()
+    for rows in arguments.rows:
+        run(rows, stages = arguments.stages, regenerate = arguments.regenerate,
+            bench_dir = arguments.bench_dir, history_file = arguments.history)
@@ -0,0 +1,121 @@
+"""
+ Benchmark (and check) of data source description scraping, against a local
+ fixture server rather than NLIS. The server serves pages with the same table
+ layout as the NLIS source pages, after a fixed delay, and counts requests:
+     > cold: an empty cache, scraped with 1 worker, then with max_workers
+     > warm: the cache from the cold run, so only the missing source (which
+       is never cached) is requested again
+     > expired: the same cache with a TTL of 0, so everything is re-scraped
+ A URL that returns 404 is included, and must be skipped (and not cached).
+ Every description scraped is checked against the one served.
+
+     python 98_Benchmarks/bench_source_scraping.py [--sources 40] [--latency 0.2] [--workers 8]
+
+ -----------------------------------
+ Created on Mon Oct 19 23:02:14 2026
+ @author: matthew.mcfahn
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import argparse
+import tempfile
+import time
+import os
+
+import bench_helpers  # Path setup, so the retrieval modules can be imported
+import data_sources_scraping
+
+fixture_page = """<html><body><table>
+<tr><td>Survey: {label}</td></tr>
+<tr><td>Country: Fixture</td></tr>
+<tr><td>Title: {description}, Author: Fixture server</td></tr>
+</table></body></html>"""
+
+### - Fixture server
+def __description(label):
+    """Helper: the description the fixture server serves for a source"""
+    return f'Fixture survey {label}'
+
+def __fixture_server(latency):
+    """Helper: starts the fixture server on a free port, returning (server, request counter)"""
+    requests = {'count': 0}
+    lock = threading.Lock()
+    # Names starting '__' would be mangled inside the class
+    description = __description
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                requests['count'] += 1
+            time.sleep(latency)
+            label = self.path.rsplit('/', 1)[-1]
+            if not label.startswith('NLIS_'):
+                self.send_error(404)
+                return
+            body = fixture_page.format(label = label, description = description(label)).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server, requests
+
+### - Scenarios
+def __run(sources_dict, requests, cache_file, ttl_days, workers):
+    """Helper: one scrape, returning (descriptions, seconds, requests served)"""
+    before = requests['count']
+    start = time.perf_counter()
+    descriptions = data_sources_scraping.__fetch_source_descriptions(sources_dict, cache_file = cache_file,
+                                                                    ttl_days = ttl_days, max_workers = workers)
+    return descriptions, time.perf_counter() - start, requests['count'] - before
+
+def __check(descriptions, sources_dict):
+    """Helper: raises unless every fixture source was scraped correctly, and the 404 was skipped"""
+    expected = {label: __description(label) for label in sources_dict if label.startswith('NLIS_')}
+    if descriptions != expected:
+        wrong = sorted(set(descriptions.items()) ^ set(expected.items()))[:5]
+        raise Exception(f'Scraped descriptions differ from the fixtures, e.g. {wrong}')
+    return None
+
+def main(source_count, latency, workers):
+    """Prints time and requests for each scenario, checking the descriptions of each"""
+    server, requests = __fixture_server(latency)
+    root = f'http://127.0.0.1:{server.server_address[1]}'
+    sources_dict = {f'NLIS_{i}': f'{root}/sources/NLIS_{i}' for i in range(source_count)}
+    sources_dict['MISSING_0'] = f'{root}/sources/MISSING_0'
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache_file = os.path.join(temp_dir, 'source_info_cache.json')
+        sequential_cache = os.path.join(temp_dir, 'sequential_cache.json')
+        scenarios = [('cold, 1 worker', sequential_cache, 30, 1),
+                     (f'cold, {workers} workers', cache_file, 30, workers),
+                     ('warm cache', cache_file, 30, workers),
+                     ('expired (TTL 0)', cache_file, 0, workers)]
+        for name, scenario_cache, ttl_days, scenario_workers in scenarios:
+            descriptions, seconds, served = __run(sources_dict, requests, scenario_cache, ttl_days, scenario_workers)
+            __check(descriptions, sources_dict)
+            results += [(name, seconds, served)]
+    server.shutdown()
+
+    print(f'\n[BENCH] Source scraping: {source_count} sources (+1 missing), {latency}s per request')
+    print(f"{'scenario':<24}{'seconds':>10}{'requests':>10}")
+    for name, seconds, served in results:
+        print(f'{name:<24}{seconds:>10.2f}{served:>10}')
+    print('[BENCH] All scraped descriptions matched the fixtures')
+    return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Benchmark data source scraping against a local fixture server')
+    parser.add_argument('--sources', type = int, default = 40)
+    parser.add_argument('--latency', type = float, default = 0.2)
+    parser.add_argument('--workers', type = int, default = data_sources_scraping.max_workers)
+    arguments = parser.parse_args()
+    main(arguments.sources, arguments.latency, arguments.workers)
@@ -0,0 +1,131 @@
+"""
+ Check that cleaning.__clean_indicator_info cleans indicator names exactly as
+ the original chain of str.replace calls did (kept below as __original_clean).
+ Names are taken from:
+     > the 'indicators' table of the retrieved database, when there is one
+     > a set of edge cases: markup next to brackets, entities, number formats
+     > random names, built from real name fragments and the markup, entities
+       and number formats the rules deal with (seeded, so repeatable)
+ Every name that is cleaned differently is printed, and the script exits 1.
+
+     python 98_Benchmarks/check_indicator_names.py [--db WHO_Data.sqlite3] [--random 20000] [--seed 0]
+
+ -----------------------------------
+ Created on Tue Oct 20 09:14:37 2026
+ @author: matthew.mcfahn
+"""
+
+import argparse
+import random
+import time
+import sys
+import os
+
+import pandas as pd
+
+import bench_helpers  # Path setup, so the cleaning modules can be imported
+import sqlite_helpers
+import cleaning
+
+edge_cases = ['Population (&#8805; 15 years)',
+              'Ambient air pollution ( PM<sub>10</sub> )',
+              "(</sup>'000</sub>0</sup>) ",
+              'Concentrations of fine particulate matter (PM<sub>2.5</sub>)',
+              'Annual mean concentration (&#956;g/m<sup>3</sup> )',
+              'Incidence (per 100 000 population)',
+              "Deaths (per 1'000'000 population)",
+              'Cases per million population',
+              'Density per 10000 population',
+              'Births (per 1000 live births)',
+              'Rate  (  per 1 000 )',
+              '<sub>1</sub>000 <sup>',
+              None,
+              '']
+
+name_fragments = ['Population', 'Ambient air pollution', 'Mortality rate', 'Prevalence of obesity',
+                  'Concentrations of fine particulate matter', 'Incidence of tuberculosis',
+                  'per', 'population', 'years', 'live births', 'aged', '%', 'PM', 'g/m', 'CO', '2.5', '10']
+markup = ['<sub>', '</sub>', '<sup>', '</sup>', '&#956; ', '&#8805; ', '(', ')', '( ', ' )', ' ', '  ',
+          '1', '0', '00', '000', "'000", ' 000', '1000', '10000', '100000', '1000000', 'million population']
+
+def __original_clean(names):
+    """Helper: IndicatorName cleaning as it was, one str.replace after another (regex, as pandas 1.2 defaulted to)"""
+    names = names.str.replace('  ',' ', regex = True)
+    names = names.str.replace('<sub>','', regex = True)
+    names = names.str.replace('</sub>',' ', regex = True)
+    names = names.str.replace('<sup>','', regex = True)
+    names = names.str.replace('</sup>',' ', regex = True)
+    names = names.str.replace('&#956; ',' ', regex = True)
+    names = names.str.replace('&#8805; ',' ', regex = True)
+
+    names = names.str.replace('1 000 000','1,000,000', regex = True)
+    names = names.str.replace("1'000'000",'1,000,000', regex = True)
+    names = names.str.replace("1000000",'1,000,000', regex = True)
+    names = names.str.replace("million population",'1,000,000 population', regex = True)
+    names = names.str.replace('100 000','100,000', regex = True)
+    names = names.str.replace("100'000","100,000", regex = True)
+    names = names.str.replace("100000","100,000", regex = True)
+    names = names.str.replace("10'000","10,000", regex = True)
+    names = names.str.replace("10 000","10,000", regex = True)
+    names = names.str.replace("10000","10,000", regex = True)
+    names = names.str.replace("1'000","1,000", regex = True)
+    names = names.str.replace("1 000","1,000", regex = True)
+    names = names.str.replace("1000","1,000", regex = True)
+    names = names.str.replace("\( ","(", regex = True)
+    names = names.str.replace(" \)",")", regex = True)
+    return names.str.strip()
+
+def __retrieved_names(db_file):
+    """Helper: the indicator names in a retrieved database, or none if there isn't one"""
+    if not os.path.exists(db_file):
+        print(f'[CHECK] No retrieved database at {db_file}, so no retrieved names are checked')
+        return []
+    indicators = sqlite_helpers.__load_db_to_pandas(db_file, ['indicators'])['indicators']
+    return list(indicators['IndicatorName'])
+
+def __random_names(count, seed):
+    """Helper: names built from real fragments and the markup the rules deal with"""
+    generator = random.Random(seed)
+    pieces = name_fragments + markup * 2
+    return [''.join(generator.choice(pieces) for _ in range(generator.randint(2, 12))) for _ in range(count)]
+
+def main(db_file, random_count, seed):
+    """Cleans every name both ways, and prints the names that differ"""
+    sets = [('retrieved', __retrieved_names(db_file)),
+            ('edge cases', edge_cases),
+            ('random', __random_names(random_count, seed))]
+    differences = 0
+    for set_name, names in sets:
+        if not names:
+            continue
+        indicators = pd.DataFrame({'IndicatorCode': [f'CODE_{i}' for i in range(len(names))],
+                                   'IndicatorName': pd.Series(names, dtype = object),
+                                   'CATEGORY': None, 'display_sequence': range(len(names)),
+                                   'url': None, 'DEFINITION_XML': None})
+        start = time.perf_counter()
+        expected = __original_clean(indicators['IndicatorName'].copy())
+        original_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        cleaned = cleaning.__clean_indicator_info(indicators.copy())['IndicatorName']
+        new_seconds = time.perf_counter() - start
+
+        differ = ~((cleaned == expected) | (cleaned.isna() & expected.isna()))
+        differences += int(differ.sum())
+        print(f'[CHECK] {set_name}: {len(names)} names, {int(differ.sum())} differ '
+              f'(original {original_seconds:.3f}s, rules {new_seconds:.3f}s)')
+        for name, old, new in list(zip(indicators.loc[differ, 'IndicatorName'], expected[differ], cleaned[differ]))[:10]:
+            print(f'    {name!r}: {old!r} != {new!r}')
+
+    if differences:
+        print(f'[CHECK] {differences} names are cleaned differently to the original')
+        sys.exit(1)
+    print('[CHECK] Every name was cleaned the same as the original')
+    return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Check indicator name cleaning against the original str.replace chain')
+    parser.add_argument('--db', default = cleaning.db_file, help = 'A retrieved database, with an indicators table')
+    parser.add_argument('--random', type = int, default = 20000, help = 'Number of random names to check')
+    parser.add_argument('--seed', type = int, default = 0)
+    arguments = parser.parse_args()
+    main(arguments.db, arguments.random, arguments.seed)
@@ -0,0 +1,104 @@
+"""
+ Load test for the Dash graph callbacks, against a locally running instance:
+     gunicorn app:server --preload --config gunicorn.conf.py
+     python 98_Benchmarks/load_test_callbacks.py --url http://localhost:8050
+ 
+ Fires requests for the graph callback (line plot and world map) from a pool
+ of client threads, cycling through a set of areas / indicators so responses
+ aren't all served from the payload cache, and reports requests/sec and
+ latency percentiles for each callback.
+ 
+ -----------------------------------
+ Created on Mon Oct 19 11:58:10 2026
+ @author: matthew.mcfahn
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import itertools
+import json
+import time
+import urllib.request
+
+from bench_helpers import callback_payload, graph_outputs, percentile
+
+default_areas = ['GBR', 'FRA', 'USA', 'IND', 'BRA', 'ZAF', 'JPN', 'NGA']
+default_indicators = ['WHOSIS_000014', 'WHOSIS_000001', 'MDG_0000000001']
+
+def __build_requests(areas, indicators):
+    """Helper: an infinite cycle of (callback name, JSON body) to send"""
+    bodies = []
+    for ind_code, area_code in itertools.product(indicators, areas):
+        bodies += [('graphs', callback_payload(graph_outputs, 'figure',
+                                               [('area_dropdown', area_code),
+                                                ('indicator_dropdown', ind_code),
+                                                ('parameter_dropdown', None)]))]
+    return itertools.cycle([(name, json.dumps(body).encode()) for name, body in bodies])
+
+def __send(url, name, body):
+    """Helper: POST one callback, returning (name, latency in ms, ok)"""
+    request = urllib.request.Request(f'{url}/_dash-update-component', data = body, method = 'POST',
+                                     headers = {'Content-Type': 'application/json',
+                                                'Accept-Encoding': 'br, gzip'})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout = 30) as response:
+            response.read()
+            ok = response.status == 200
+    except Exception:
+        ok = False
+    return name, (time.perf_counter() - start) * 1000, ok
+
+def main(url, concurrency, total_requests, areas, indicators):
+    """
+    Runs the load test, printing a summary table
+    
+    Parameters
+    ----------
+    url : str
+        Base URL of the running app, e.g. http://localhost:8050
+    concurrency : int
+        Number of concurrent client threads
+    total_requests : int
+        Total number of callback requests to send
+    areas : list
+        Area codes to cycle through
+    indicators : list
+        Indicator codes to cycle through
+    Returns
+    -------
+    results : dict
+        {callback name: list of (latency ms, ok)}
+    """
+    requests_cycle = __build_requests(areas, indicators)
+    work = [next(requests_cycle) for _ in range(total_requests)]
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = concurrency) as executor:
+        outcomes = list(executor.map(lambda item: __send(url, *item), work))
+    elapsed = time.perf_counter() - start
+    
+    results = {}
+    for name, latency, ok in outcomes:
+        results.setdefault(name, []).append((latency, ok))
+    
+    print(f'[LOAD TEST] {total_requests} requests, concurrency {concurrency}, {round(elapsed, 2)} seconds')
+    print(f'[LOAD TEST] Overall throughput: {total_requests / elapsed:.1f} requests/sec')
+    print(f"{'callback':<12}{'count':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, rows in results.items():
+        latencies = [latency for latency, ok in rows if ok]
+        errors = sum(1 for _, ok in rows if not ok)
+        print(f"{name:<12}{len(rows):>8}{errors:>8}{len(rows) / elapsed:>10.1f}"
+              f"{percentile(latencies, 50):>10.1f}{percentile(latencies, 90):>10.1f}"
+              f"{percentile(latencies, 99):>10.1f}{max(latencies, default = float('nan')):>10.1f}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Load test the Dash graph callbacks')
+    parser.add_argument('--url', default = 'http://localhost:8050')
+    parser.add_argument('--concurrency', type = int, default = 16)
+    parser.add_argument('--requests', type = int, default = 2000)
+    parser.add_argument('--areas', nargs = '+', default = default_areas)
+    parser.add_argument('--indicators', nargs = '+', default = default_indicators)
+    args = parser.parse_args()
+    main(args.url, args.concurrency, args.requests, args.areas, args.indicators)
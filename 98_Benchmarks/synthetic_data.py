@@ -0,0 +1,234 @@
+"""
+ Generates synthetic GHO-shaped staging databases at chosen scales (e.g. 1M,
+ 10M, 50M indicator_data rows), for benchmarking the pipeline stages without
+ the API.
+
+ Rows are resampled from the template rows in data_sample.csv, so null rates,
+ Dim1-3 types and values (and their cardinalities), SpatialDimType mix and the
+ 'Value' string formats (one per regex_cleaning case) follow the real data.
+ Each template also gets 'variants' in which every number in Value,
+ NumericValue, Low and High is scaled by the same factor, keeping its format
+ (thousands separators, decimal places, ranges in brackets), so values aren't
+ simply repeated. Indicator codes are multiplied out to 'indicators' codes,
+ and years jittered, to give realistic key cardinalities.
+
+ The other staged tables (countries, regions, indicators, data_sources,
+ measures) are generated to match, so cleaning.main can run on the output.
+
+ Usage:
+     python synthetic_data.py --rows 1000000 --out synthetic.sqlite3
+
+ -----------------------------------
+ Created on Mon Oct 19 16:48:10 2026
+ @author: matthew.mcfahn
+"""
+
+import argparse
+import sqlite3
+import time
+import re
+import os
+
+import numpy as np
+import pandas as pd
+
+from bench_helpers import repo_root
+import sqlite_helpers
+
+sample_file = os.path.join(repo_root, 'data_sample.csv')
+chunk_size = 1_000_000
+indicator_count = 2300      # Roughly the size of the GHO catalogue
+variant_count = 16          # Scaled copies of each template row
+year_jitter = (-10, 5)      # Years are moved within this range of the template's
+who_regions = ['AFR', 'AMR', 'SEAR', 'EUR', 'EMR', 'WPR']
+categories = ['Mortality and global health estimates', 'Nutrition', 'Tobacco control', 'UHC',
+              'HIV/AIDS and other STIs', 'Noncommunicable Diseases Ccs', 'Negelected tropical diseases', None]
+
+# Numbers as they appear in 'Value': '1 718', '12,440', '1,426.1', '0.03', '7.9'
+number_pattern = re.compile(r'\d{1,3}(?:[ ,]\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?')
+
+### - Templates
+def __scale_number(token, factor):
+    """Helper: scale a number token from 'Value', keeping its separator and decimal places"""
+    separator = ' ' if ' ' in token else (',' if ',' in token else '')
+    digits = token.replace(separator, '') if separator else token
+    decimals = len(digits.split('.')[1]) if '.' in digits else 0
+    scaled = round(float(digits) * factor, decimals)
+    text = f'{scaled:,.{decimals}f}' if separator else f'{scaled:.{decimals}f}'
+    return text.replace(',', separator) if separator == ' ' else text
+
+def __load_templates(sample_file, variants, rng):
+    """
+    Helper: the template rows, and for each a table of 'variants' scaled
+    copies of Value / NumericValue / Low / High
+
+    Returns
+    -------
+    templates : pd.DataFrame()
+        The sample rows
+    values : np.ndarray (templates x variants) of object
+        Value strings
+    numbers : dict
+        {'NumericValue' / 'Low' / 'High': np.ndarray (templates x variants)}
+    """
+    templates = pd.read_csv(sample_file, dtype = {'Value': object, 'Comments': object})
+    factors = np.concatenate([[1.0], rng.uniform(0.5, 1.5, variants - 1)])
+
+    values = np.empty((len(templates), variants), dtype = object)
+    for row, value in enumerate(templates['Value']):
+        if isinstance(value, str) and number_pattern.search(value):
+            values[row] = [number_pattern.sub(lambda match: __scale_number(match.group(0), factor), value)
+                           for factor in factors]
+        else:
+            values[row] = value
+    numbers = {column: templates[column].to_numpy(dtype = float)[:, None] * factors[None, :]
+               for column in ['NumericValue', 'Low', 'High']}
+    return templates, values, numbers
+
+### - Generation
+def generate_indicator_data(rows, seed = 0, chunk_size = chunk_size, indicators = indicator_count,
+                            sample_file = sample_file):
+    """
+    Generates synthetic 'indicator_data' rows, a chunk at a time
+
+    Parameters
+    ----------
+    rows : int
+        The total number of rows
+    seed : int
+        Random seed, so a given scale is the same each time
+    chunk_size : int
+        Rows per chunk
+    indicators : int
+        Roughly how many distinct IndicatorCodes to generate
+    sample_file : str
+        The CSV of template rows
+    Yields
+    ------
+    chunk : pd.DataFrame()
+        Rows with the same columns as the staged 'indicator_data' table
+    """
+    rng = np.random.default_rng(seed)
+    templates, values, numbers = __load_templates(sample_file, variant_count, rng)
+    template_codes = templates['IndicatorCode'].to_numpy(dtype = object)
+    replicas = max(1, -(-indicators // templates['IndicatorCode'].nunique()))
+    template_years = templates['TimeDim'].to_numpy(dtype = float)
+
+    written = 0
+    while written < rows:
+        size = min(chunk_size, rows - written)
+        picks = rng.integers(0, len(templates), size)
+        variants = rng.integers(0, variant_count, size)
+        chunk = templates.iloc[picks].reset_index(drop = True)
+
+        chunk['ID'] = np.arange(written + 1, written + size + 1)
+        replica = rng.integers(0, replicas, size)
+        codes = template_codes[picks]
+        chunk['IndicatorCode'] = np.where(replica == 0, codes,
+                                          codes + '_S' + replica.astype(str).astype(object))
+        chunk['Value'] = values[picks, variants]
+        for column, table in numbers.items():
+            chunk[column] = table[picks, variants]
+
+        years = template_years[picks] + rng.integers(year_jitter[0], year_jitter[1] + 1, size)
+        years = np.clip(years, 1950, 2025)
+        chunk['TimeDim'] = years
+        has_year = ~np.isnan(years)
+        year_text = pd.Series(years).astype('Int64').astype(str)
+        chunk['TimeDimensionValue'] = year_text.where(has_year, None)
+        chunk['TimeDimensionBegin'] = (year_text + '-01-01T00:00:00+01:00').where(has_year, None)
+        chunk['TimeDimensionEnd'] = (year_text + '-12-31T00:00:00+01:00').where(has_year, None)
+
+        written += size
+        yield chunk
+
+def __dimension_tables(indicator_codes, areas, data_sources, rng):
+    """Helper: the staged tables other than indicator_data, matching the generated codes"""
+    countries = areas.loc[areas['SpatialDimType'] == 'COUNTRY', 'SpatialDim'].unique()
+    regions = areas.loc[areas['SpatialDimType'] != 'COUNTRY', 'SpatialDim'].unique()
+    country_regions = np.array(who_regions, dtype = object)[rng.integers(0, len(who_regions), len(countries))]
+    tables = {}
+    tables['countries'] = pd.DataFrame({'Code': countries, 'Title': [f'Country {x}' for x in countries],
+                                        'ParentDimension': 'REGION', 'Dimension': 'COUNTRY',
+                                        'ParentCode': country_regions,
+                                        'ParentTitle': [f'Region {x}' for x in country_regions]})
+    tables['regions'] = pd.DataFrame({'Code': regions, 'Title': [f'Region {x}' for x in regions],
+                                      'ParentDimension': None, 'Dimension': 'REGION',
+                                      'ParentCode': None, 'ParentTitle': None})
+
+    # Indicator names include the markup and number formats __clean_indicator_info deals with
+    name_markup = ['', ' (per 100 000 population)', ' (PM<sub>2.5</sub>)', ' (&#956;g/m<sup>3</sup> )', '  (%)']
+    indicator_codes = sorted(indicator_codes)
+    tables['indicators'] = pd.DataFrame({'IndicatorCode': indicator_codes,
+                                         'IndicatorName': [f'Synthetic indicator {code}{name_markup[i % len(name_markup)]}'
+                                                           for i, code in enumerate(indicator_codes)],
+                                         'CATEGORY': [categories[i % len(categories)] for i in range(len(indicator_codes))],
+                                         'display_sequence': np.arange(len(indicator_codes)),
+                                         'url': None,
+                                         'DEFINITION_XML': None})
+    tables['data_sources'] = pd.DataFrame({'label': sorted(data_sources), 'display': sorted(data_sources),
+                                           'display_sequence': np.arange(len(data_sources)),
+                                           'url': None, 'source_description': None})
+    tables['measures'] = pd.DataFrame({'Code': ['COUNTRY', 'REGION', 'SEX', 'AGEGROUP'],
+                                       'Title': ['Country', 'Region', 'Sex', 'Age Group']})
+    return tables
+
+def write_staged_db(db_file, rows, seed = 0, chunk_size = chunk_size, indicators = indicator_count):
+    """
+    Writes a complete synthetic staging database, in the shape cleaning.main expects
+
+    Parameters
+    ----------
+    db_file : str
+        The database to create (replaced if it exists)
+    rows : int
+        The number of indicator_data rows
+    seed : int
+        Random seed
+    chunk_size : int
+        Rows generated and written at a time, which bounds memory
+    indicators : int
+        Roughly how many distinct IndicatorCodes to generate
+    Returns
+    -------
+    stats : dict
+        'rows', 'seconds', 'db_mb'
+    """
+    start = time.time()
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    conn = sqlite3.connect(db_file)
+    conn.execute(sqlite_helpers.indicator_data_sql)
+
+    indicator_codes, data_sources, areas = set(), set(), []
+    for chunk in generate_indicator_data(rows, seed = seed, chunk_size = chunk_size, indicators = indicators):
+        chunk.to_sql('indicator_data', conn, if_exists = 'append', index = False)
+        indicator_codes.update(chunk['IndicatorCode'].unique())
+        data_sources.update(chunk['DataSourceDim'].dropna().unique())
+        areas += [chunk[['SpatialDimType', 'SpatialDim']].drop_duplicates()]
+        print(f'[SYNTHETIC] Written {chunk["ID"].iloc[-1]:,} of {rows:,} rows')
+
+    areas = pd.concat(areas).drop_duplicates()
+    tables = __dimension_tables(indicator_codes, areas, data_sources, np.random.default_rng(seed))
+    for name, frame in tables.items():
+        frame.to_sql(name, conn, index = False)
+    conn.commit()
+    conn.close()
+
+    stats = {'rows': rows, 'seconds': round(time.time() - start, 2),
+             'db_mb': round(os.path.getsize(db_file) / 1024**2, 1)}
+    print(f"[SYNTHETIC] {db_file}: {rows:,} rows, {stats['db_mb']} Mb in {stats['seconds']}s")
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate a synthetic GHO-shaped staging database')
+    parser.add_argument('--rows', type = int, default = 1_000_000)
+    parser.add_argument('--out', default = None, help = 'Defaults to <outdir>/benchmarks/synthetic_<rows>.sqlite3')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--chunk-size', type = int, default = chunk_size)
+    parser.add_argument('--indicators', type = int, default = indicator_count)
+    arguments = parser.parse_args()
+    out = arguments.out or f'{sqlite_helpers.outdir}/benchmarks/synthetic_{arguments.rows}.sqlite3'
+    os.makedirs(os.path.dirname(out) or '.', exist_ok = True)
+    write_staged_db(out, arguments.rows, seed = arguments.seed,
+                    chunk_size = arguments.chunk_size, indicators = arguments.indicators)
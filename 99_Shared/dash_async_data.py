@@ -0,0 +1,182 @@
+"""
+ Non-blocking data access for the app.py Dash app. The queries a callback
+ needs (e.g. the line graph and world map for a new indicator) are run
+ concurrently with asyncio, on a small pool of threads that each keep a
+ connection to the visualisation database. Each query has a timeout, and is
+ cancelled inside SQLite (via a progress handler) when it runs past it, or
+ when a newer request from the same browser session replaces it, e.g. the
+ user picks another indicator while the last one is still loading.
+
+ Dash 1.x callbacks are synchronous, so run_queries() runs the event loop for
+ the duration of a callback. Requests replacing each other are tracked per
+ worker process: under gunicorn, requests from one session handled by
+ different workers don't cancel each other (they still time out).
+
+ Settings (environment variables):
+     WHO_QUERY_THREADS   Query threads (and connections) per worker process
+     WHO_QUERY_TIMEOUT   Seconds before a query is interrupted
+
+ -----------------------------------
+ Created on Mon Oct 19 20:11:06 2026
+ @author: matthew.mcfahn
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import itertools
+import threading
+import asyncio
+import time
+import os
+
+import dash_data_extraction
+from dash_data_extraction import create_connection, __get_db_version
+
+query_threads = int(os.environ.get('WHO_QUERY_THREADS', 4))
+query_timeout = float(os.environ.get('WHO_QUERY_TIMEOUT', 10))
+progress_steps = 1000           # SQLite VM instructions between cancellation checks
+max_tracked_sessions = 4096     # Sessions whose latest request is remembered
+
+class QueryCancelled(Exception):
+    """A newer request from the same session replaced this one"""
+
+class QueryTimeout(Exception):
+    """A query ran for longer than its timeout"""
+
+### - Thread pool and connections
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_local = threading.local()
+
+def _get_executor():
+    """Helper: the query thread pool, created on first use in each process (threads don't survive a fork)"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers = query_threads, thread_name_prefix = 'who-query')
+            _executor_pid = os.getpid()
+    return _executor
+
+def _get_connection():
+    """Helper: this thread's connection, reopened when the database is rebuilt"""
+    db_file = dash_data_extraction.db_file
+    db_version = __get_db_version(db_file)
+    if getattr(_local, 'db_version', None) != db_version:
+        if getattr(_local, 'conn', None) is not None:
+            _local.conn.close()
+        _local.conn = create_connection(db_file)
+        _local.db_version = db_version
+    return _local.conn
+
+### - Request tracking
+_generations = OrderedDict()
+_generation_lock = threading.Lock()
+_generation_counter = itertools.count(1)
+
+def _begin_request(session_id, channel):
+    """Helper: registers a new request on (session_id, channel), replacing any in flight"""
+    if session_id is None:
+        return None, None
+    key = (session_id, channel)
+    with _generation_lock:
+        generation = next(_generation_counter)
+        _generations[key] = generation
+        _generations.move_to_end(key)
+        if len(_generations) > max_tracked_sessions:
+            _generations.popitem(last = False)
+    return key, generation
+
+class _Ticket:
+    """Helper: one query's deadline, and the request it belongs to"""
+    def __init__(self, key, generation, timeout):
+        self.key = key
+        self.generation = generation
+        self.deadline = time.monotonic() + timeout
+
+    def stop_reason(self):
+        """The exception to stop the query with, or None to carry on"""
+        if self.key is not None and _generations.get(self.key, self.generation) != self.generation:
+            return QueryCancelled
+        if time.monotonic() > self.deadline:
+            return QueryTimeout
+        return None
+
+    def interrupt(self):
+        """SQLite progress handler: a non-zero return aborts the running statement"""
+        return int(self.stop_reason() is not None)
+
+def _run_query(name, query, ticket):
+    """Helper: runs one query on this thread's connection, interruptible by its ticket"""
+    reason = ticket.stop_reason()
+    if reason is not None:
+        raise reason(name)
+    conn = _get_connection()
+    conn.set_progress_handler(ticket.interrupt, progress_steps)
+    try:
+        return query(conn = conn)
+    except Exception as e:
+        # pandas wraps SQLite's 'interrupted' error, so check the ticket instead
+        reason = ticket.stop_reason()
+        if reason is not None:
+            raise reason(name) from e
+        raise
+    finally:
+        conn.set_progress_handler(None, progress_steps)
+
+### - Entry points
+async def fetch_all(queries, session_id = None, channel = 'default', timeout = query_timeout):
+    """
+    Runs queries concurrently on the query threads
+
+    Parameters
+    ----------
+    queries : dict
+        {name: query}, where query is a callable taking a conn keyword, e.g.
+        functools.partial(__get_worldmap_data, indicator_id)
+    session_id : str
+        The browser session (see dash_server_helpers.get_session_id). A new
+        request on the same session and channel cancels this one. None to
+        never cancel
+    channel : str
+        Which of the session's requests this is, e.g. a callback name
+    timeout : float
+        Seconds each query may run for
+    Returns
+    -------
+    results : dict
+        {name: the query's result}
+    Raises
+    ------
+    QueryCancelled
+        A newer request replaced this one
+    QueryTimeout
+        A query ran past the timeout
+    """
+    key, generation = _begin_request(session_id, channel)
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    names = list(queries)
+    tasks = [asyncio.wait_for(loop.run_in_executor(executor, _run_query, name, queries[name],
+                                                   _Ticket(key, generation, timeout)), timeout)
+             for name in names]
+    results = await asyncio.gather(*tasks, return_exceptions = True)
+
+    errors = [x for x in results if isinstance(x, BaseException)]
+    # A cancelled request's other errors don't matter: nobody is waiting for it
+    for error in errors:
+        if isinstance(error, QueryCancelled):
+            raise error
+    for name, error in zip(names, results):
+        if isinstance(error, asyncio.TimeoutError):
+            raise QueryTimeout(name) from error
+    if errors:
+        raise errors[0]
+    return dict(zip(names, results))
+
+def run_queries(queries, session_id = None, channel = 'default', timeout = query_timeout):
+    """
+    Runs queries concurrently (see fetch_all), from synchronous code such as a
+    Dash callback, and waits for all of them
+    """
+    return asyncio.run(fetch_all(queries, session_id = session_id, channel = channel, timeout = timeout))
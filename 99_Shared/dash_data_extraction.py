@@ -9,11 +9,16 @@
 """
 
 import pandas as pd
+import numpy as np
 import sqlite3
 from sqlite3 import Error
 from getpass import getuser
+import hashlib
+import pickle
 import os
 
+import query_metrics
+
 # Set up the db location, based on the user, and whether the OS is Mac or Windows
 if os.name == 'posix':
     outdir = f'/Users/{getuser()}/Documents/World Health Organisation project'
@@ -22,6 +27,15 @@ else:
 sqlite_name = 'visualisation_model'
 
 db_file = f'{outdir}/{sqlite_name}.sqlite3'
+# Serialized snapshot of the static assets (and dropdown options) for db_file
+snapshot_file = f'{outdir}/{sqlite_name}_static_assets.pickle'
+# Memory map the database: mapped pages live in the OS page cache, so they're
+# shared between all gunicorn workers rather than copied into each one
+mmap_size = int(os.environ.get('WHO_SQLITE_MMAP_SIZE', 1024 ** 3))
+# Measurements without a year are stored with this year (see visualisation_model)
+year_sentinel = -1
+# The columns of exported rows (see __iter_export_rows)
+export_columns = ['indicator_code', 'area_code', 'area_name', 'year', 'measurement_value', 'numeric_value', 'low', 'high']
 
 ##############################################################################
 #   - Helper functions for plotting
@@ -67,9 +81,13 @@ def __get_static_queries():
     indicator_query = f'{helper_path}/dash_get_indicators.sql'
     category_query = f'{helper_path}/dash_get_categories.sql'
     area_query = f'{helper_path}/dash_get_areas.sql'
+    parameter_query = f'{helper_path}/dash_get_parameters.sql'
+    rollup_group_query = f'{helper_path}/dash_get_rollup_groups.sql'
     query_paths = {'indicators':indicator_query,
                    'categories':category_query,
-                   'areas':area_query}
+                   'areas':area_query,
+                   'parameters':parameter_query,
+                   'rollup_groups':rollup_group_query}
     queries = {}
     for key, query_loc in query_paths.items():
         sql = ""
@@ -82,21 +100,48 @@ def create_connection(db_file = db_file):
     """Create a connection to the SQLite database specified by db_file"""
     try:
         conn = sqlite3.connect(db_file)
+        conn.execute(f'PRAGMA mmap_size = {mmap_size}')
         return conn
     except Error as e:
         raise Exception(f'SQLite connection failed with error code {e}')
 
+def __get_db_version(db_file):
+    """
+    Helper to get a short version string for the database file. Changes
+    whenever the file is rebuilt (size or modified time changes)
+
+    Parameters
+    ----------
+    db_file : str
+        Filepath to the visualisation database
+    Returns
+    -------
+    db_version : str
+        A short hash identifying this version of the database
+    """
+    try:
+        stat = os.stat(db_file)
+    except OSError:
+        return 'missing'
+    fingerprint = f'{db_file}:{stat.st_mtime_ns}:{stat.st_size}'
+    db_version = hashlib.sha1(fingerprint.encode()).hexdigest()[:12]
+    return db_version
+
 def get_static_data_assets(db_file):
     """
+    Queries the visualisation model for the static assets used by the app:
+    its small dimension tables, which the app holds in memory
     
     Parameters
     ----------
-    conn : Connection object to visualisation model
+    db_file : str
+        Filepath to the visualisation database
 
     Returns
     -------
-    #TODO:
-
+    indicators, categories, areas, parameters, rollup_groups : pd.DataFrame()
+        Frames of the indicators, categories, areas, parameter values, and
+        rollup groups (regions / world) present in the model
     """
     conn = create_connection(db_file)
     
@@ -109,111 +154,356 @@ def get_static_data_assets(db_file):
     
     conn.close()
     
-    return frames['indicators'], frames['categories'], frames['areas']
+    return frames['indicators'], frames['categories'], frames['areas'], frames['parameters'], frames['rollup_groups']
+
+def __build_dropdown_options(indicators, categories, areas):
+    """Helper: build the label / value option lists for the app dropdowns"""
+    # Only indicators and areas with main measures are offered
+    indicators = indicators.loc[indicators['has_main_measure'] == 1]
+    areas = areas.loc[areas['has_main_measure'] == 1]
+    options = {'indicators': [{'label': name, 'value': code} 
+                              for code, name in zip(indicators['indicator_code'], indicators['indicator_name'])],
+               'areas': [{'label': name, 'value': code} 
+                         for code, name in zip(areas['area_code'], areas['area_name'])],
+               'categories': [{'label': name, 'value': name} for name in categories['category_name']]}
+    return options
+
+def __build_lookups(indicators, areas):
+    """Helper: code -> id lookups for queries, and id -> code / name lookups for results"""
+    lookups = {'indicator_id': pd.Series(indicators['indicator_id'].values, index = indicators['indicator_code']),
+               'area_id': pd.Series(areas['area_id'].values, index = areas['area_code']),
+               'area_code': pd.Series(areas['area_code'].values, index = areas['area_id']),
+               'area_name': pd.Series(areas['area_name'].values, index = areas['area_id'])}
+    return lookups
+
+def get_static_snapshot(db_file, snapshot_file = snapshot_file):
+    """
+    Gets the static assets and dropdown options for the app, from a serialized
+    snapshot if one exists for this version of the database. Otherwise, the
+    database is queried and the snapshot (re)written for next time.
+    
+    Parameters
+    ----------
+    db_file : str
+        Filepath to the visualisation database
+    snapshot_file : str
+        Filepath to the pickled snapshot
+    Returns
+    -------
+    snapshot : dict
+        {'db_version', 'indicators', 'categories', 'areas', 'parameters',
+        'rollup_groups', 'options', 'lookups'}, where 'options' is a dict of dropdown option
+        lists, and 'lookups' a dict of code <-> id Series
+    """
+    db_version = __get_db_version(db_file)
+    if os.path.exists(snapshot_file):
+        try:
+            with open(snapshot_file, 'rb') as file:
+                snapshot = pickle.load(file)
+            if snapshot.get('db_version') == db_version:
+                return snapshot
+        except Exception as e:
+            print(f'[DATA LOAD] Ignoring unreadable snapshot {snapshot_file}: {e}')
+    
+    indicators, categories, areas, parameters, rollup_groups = get_static_data_assets(db_file)
+    snapshot = {'db_version': db_version,
+                'indicators': indicators,
+                'categories': categories,
+                'areas': areas,
+                'parameters': parameters,
+                'rollup_groups': rollup_groups,
+                'options': __build_dropdown_options(indicators, categories, areas),
+                'lookups': __build_lookups(indicators, areas)}
+    # Write to a temporary file, and move, so workers never read a partial file
+    try:
+        temp_file = f'{snapshot_file}.{os.getpid()}.tmp'
+        with open(temp_file, 'wb') as file:
+            pickle.dump(snapshot, file, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, snapshot_file)
+    except OSError as e:
+        print(f'[DATA LOAD] Unable to write snapshot {snapshot_file}: {e}')
+    return snapshot
 
 
-def __get_available_areas(ind_code):
+def __read_sql(sql, params, conn = None):
     """
-    Helper: Get a list of areas available for the given indicator code
+    Helper: runs a query on conn (e.g. a pooled connection, see
+    dash_async_data), or on a new connection that's closed afterwards
     """
+    query_metrics.record_statement(sql, params)
+    if conn is not None:
+        return pd.read_sql(sql, con = conn, params = params)
     conn = create_connection(db_file)
+    try:
+        return pd.read_sql(sql, con = conn, params = params)
+    finally:
+        conn.close()
+
+def __read_columns(sql, params, dtypes, conn = None):
+    """
+    Helper: runs a query, and returns its columns as NumPy arrays straight
+    from the cursor, with no DataFrame in between. For the hot callback paths
+
+    Parameters
+    ----------
+    sql : str
+        The query
+    params : list
+        Its parameters
+    dtypes : dict
+        {column: dtype}. Nulls become NaN in float columns. Columns not
+        given are object arrays
+    conn : sqlite3.Connection
+        Connection to use, else a new connection is opened and closed
+    Returns
+    -------
+    columns : dict
+        {column name: np.ndarray}, in the query's column order
+    """
+    query_metrics.record_statement(sql, params)
+    close = conn is None
+    if close:
+        conn = create_connection(db_file)
+    try:
+        cursor = conn.execute(sql, params)
+        names = [column[0] for column in cursor.description]
+        rows = cursor.fetchall()
+    finally:
+        if close:
+            conn.close()
+    values = zip(*rows) if rows else [()] * len(names)
+    return {name: np.array(column, dtype = dtypes.get(name, object)) for name, column in zip(names, values)}
+
+def __read_measurements(sql, params, conn = None):
+    """
+    Helper: runs a query on value_table / granular_table, with the year
+    sentinel turned back into a null year
+    """
+    data = __read_sql(sql, params, conn)
+    data['year'] = data['year'].where(data['year'] != year_sentinel)
+    return data
+
+def __parameter_filter(parameter_value_ids):
+    """Helper: SQL restricting granular rows to the parameter values, and its parameters"""
+    placeholders = ', '.join('?' * len(parameter_value_ids))
+    sql = f"""AND measurement_id IN (SELECT measurement_id
+                                     FROM results_to_parameters
+                                     WHERE parameter_value_id IN ({placeholders}))"""
+    return sql, [int(x) for x in parameter_value_ids]
 
-    sql = f"""SELECT DISTINCT area_code
-              FROM value_table
-              WHERE indicator_code = '{ind_code}'"""
+@query_metrics.timed_query('available_areas')
+def __get_available_areas(indicator_id, conn = None):
+    """
+    Helper: Get a list of area_ids available for the given indicator_id
+    """
+    sql = """SELECT DISTINCT area_id
+             FROM value_table
+             WHERE indicator_id = ?"""
     
-    areas = pd.read_sql(sql, con = conn)
-    conn.close()
-    return list(areas.area_code)
+    areas = __read_sql(sql, [int(indicator_id)], conn)
+    return list(areas.area_id)
 
-def __get_linegraph_data(area_code, ind_code, param_value):
+@query_metrics.timed_query('linegraph')
+def __get_linegraph_data(area_id, indicator_id, parameter_value_ids = None, conn = None):
     """
-    Helper: Get the data for a linegraph (or barchart) for the area and ind code
+    Helper: Get the data for a linegraph (or barchart) for the area and
+    indicator, from the granular rows if parameter_value_ids are given.
+    Returned as arrays rather than a DataFrame, as it's rendered on every
+    area change
+
+    Returns
+    -------
+    data : dict
+        {'year', 'numeric_value', 'low', 'high'} float arrays, ordered by
+        year. Years are NaN for measurements without one
     """
-    conn = create_connection(db_file)
-    if not param_value:
-        sql = f"""SELECT *
-                  FROM value_table
-                  WHERE 
-                      indicator_code = '{ind_code}'
-                  AND area_code = '{area_code}'
-                  ORDER BY measurement_year"""
+    if not parameter_value_ids:
+        table, filter_sql, filter_params = 'value_table', '', []
     else:
-        sql = f"""WITH value_data AS (
-                  SELECT *
-                  FROM granular_table
-                  WHERE indicator_code = '{ind_code}'
-                  AND area_code = '{area_code}'
-                  ),
-    bridge_table AS (
-        SELECT * 
-        FROM results_to_parameters
-        WHERE parameter_value = '{param_value}'
-        )
-    SELECT *
-    FROM bridge_table
-    INNER JOIN value_data
-    ON bridge_table.measurement_id = value_data.measurement_id
-    ORDER BY measurement_year"""
-    
-    data = pd.read_sql(sql, con = conn).rename(columns = {'measurement_year':'year'})
-    conn.close()
+        table = 'granular_table'
+        filter_sql, filter_params = __parameter_filter(parameter_value_ids)
+    sql = f"""SELECT year, numeric_value, low, high
+              FROM {table}
+              WHERE indicator_id = ?
+              AND area_id = ?
+              {filter_sql}
+              ORDER BY year"""
+    data = __read_columns(sql, [int(indicator_id), int(area_id)] + filter_params,
+                          dict.fromkeys(['year', 'numeric_value', 'low', 'high'], float), conn)
+    data['year'][data['year'] == year_sentinel] = np.nan
     return data
 
-def __get_worldmap_data(ind_code, param_value = None):
+@query_metrics.timed_query('worldmap')
+def __get_worldmap_data(indicator_id, parameter_value_ids = None, conn = None):
     """
+    Helper: Get every area's data for the indicator, from the granular rows if
+    parameter_value_ids are given
     """
-    conn = create_connection(db_file)
+    if not parameter_value_ids:
+        table, filter_sql, filter_params = 'value_table', '', []
+    else:
+        table = 'granular_table'
+        filter_sql, filter_params = __parameter_filter(parameter_value_ids)
+    sql = f"""SELECT measurement_id, area_id, year, measurement_value, numeric_value, low, high
+              FROM {table}
+              WHERE indicator_id = ?
+              {filter_sql}
+              ORDER BY year"""
+    return __read_measurements(sql, [int(indicator_id)] + filter_params, conn)
 
-    if not param_value:
-        sql = f"""SELECT *
+@query_metrics.timed_query('rollups')
+def __get_rollup_data(indicator_id, group_ids = None, parameter_value_id = -1, conn = None):
+    """
+    Helper: the pre-aggregated region / world values for an indicator (see
+    rollups.py), for all groups or just group_ids. parameter_value_id -1 is
+    the main measure
+    """
+    group_sql, group_params = '', []
+    if group_ids:
+        group_sql = f"AND group_id IN ({', '.join('?' * len(group_ids))})"
+        group_params = [int(x) for x in group_ids]
+    sql = f"""SELECT group_id, year, country_count, mean_value, median_value, min_value, max_value
+              FROM rollups
+              WHERE indicator_id = ?
+              {group_sql}
+              AND parameter_value_id = ?
+              ORDER BY group_id, year"""
+    return __read_measurements(sql, [int(indicator_id)] + group_params + [int(parameter_value_id)], conn)
+
+@query_metrics.timed_query('parameter_values')
+def __get_parameter_values_for_ind(indicator_id, conn = None):
+    """Helper: the parameter_value_ids present for an indicator"""
+    sql = """SELECT parameter_value_id
+             FROM indicator_to_parameters
+             WHERE indicator_id = ?"""
+    data = __read_sql(sql, [int(indicator_id)], conn)
+    return list(data.parameter_value_id)
+
+def __placeholders(values):
+    """Helper: '?, ?, ...' for an IN list, and its parameters"""
+    return ', '.join('?' * len(values)), [int(x) for x in values]
+
+@query_metrics.timed_query('comparison')
+def __get_comparison_data(area_ids, indicator_ids, parameter_value_ids = None, conn = None):
+    """
+    Helper: the line graph data for several areas, indicators and parameter
+    values at once, from one query, so comparing N areas costs one query
+    rather than N. The IN lists are seeks on the tables' primary keys, and
+    rows come back in key order, so they're split into groups without a sort
+
+    Parameters
+    ----------
+    area_ids, indicator_ids : list
+        The areas and indicators to compare (every combination is returned)
+    parameter_value_ids : list
+        Parameter values, to compare granular rows. None for the main measures
+    conn : sqlite3.Connection
+        Connection to use, else a new connection is opened and closed
+    Returns
+    -------
+    groups : dict
+        {(indicator_id, area_id, parameter_value_id): {'year', 'numeric_value',
+        'low', 'high'} float arrays, ordered by year}, for the combinations
+        with data. parameter_value_id is -1 for main measures
+    """
+    if not area_ids or not indicator_ids:
+        return {}
+    indicator_sql, indicator_params = __placeholders(indicator_ids)
+    area_sql, area_params = __placeholders(area_ids)
+    if not parameter_value_ids:
+        sql = f"""SELECT indicator_id, area_id, -1 AS parameter_value_id, year, numeric_value, low, high
                   FROM value_table
-                  WHERE 
-                      indicator_code = '{ind_code}'
-                  ORDER BY measurement_year"""
+                  WHERE indicator_id IN ({indicator_sql})
+                  AND area_id IN ({area_sql})
+                  ORDER BY indicator_id, area_id, year"""
+        params = indicator_params + area_params
     else:
-        sql = f"""WITH value_data AS (
-                  SELECT *
-                  FROM granular_table
-                  WHERE indicator_code = '{ind_code}'
-                  ),
-    bridge_table AS (
-        SELECT * 
-        FROM results_to_parameters
-        WHERE parameter_value = '{param_value}'
-        )
-    SELECT *
-    FROM bridge_table
-    INNER JOIN value_data
-    ON bridge_table.measurement_id = value_data.measurement_id
-    ORDER BY measurement_year"""
-    
-    data = pd.read_sql(sql, con = conn).rename(columns = {'measurement_year':'year'})
-    conn.close()
-    return data
+        parameter_sql, parameter_params = __placeholders(parameter_value_ids)
+        sql = f"""SELECT g.indicator_id, g.area_id, r.parameter_value_id, g.year, g.numeric_value, g.low, g.high
+                  FROM granular_table g
+                  JOIN results_to_parameters r
+                  ON r.measurement_id = g.measurement_id
+                  AND r.parameter_value_id IN ({parameter_sql})
+                  WHERE g.indicator_id IN ({indicator_sql})
+                  AND g.area_id IN ({area_sql})
+                  ORDER BY g.indicator_id, g.area_id, r.parameter_value_id, g.year"""
+        params = parameter_params + indicator_params + area_params
+    dtypes = {'indicator_id': 'int64', 'area_id': 'int64', 'parameter_value_id': 'int64',
+              'year': float, 'numeric_value': float, 'low': float, 'high': float}
+    data = __read_columns(sql, params, dtypes, conn)
+    data['year'][data['year'] == year_sentinel] = np.nan
 
-def __get_parameter_types_for_ind(ind_code):
-    """
+    keys = [data['indicator_id'], data['area_id'], data['parameter_value_id']]
+    change = np.zeros(len(keys[0]), dtype = bool)
+    change[:1] = True
+    for column in keys:
+        change[1:] |= column[1:] != column[:-1]
+    starts = np.flatnonzero(change)
+    ends = np.r_[starts[1:], len(change)]
+    groups = {}
+    for start, end in zip(starts, ends):
+        key = tuple(int(column[start]) for column in keys)
+        groups[key] = {column: data[column][start:end] for column in ['year', 'numeric_value', 'low', 'high']}
+    return groups
+
+def __iter_export_rows(indicator_code, area_codes = None, parameter_value = None, chunk_size = 5000):
     """
-    conn = create_connection(db_file)
-    
-    sql = f"""SELECT DISTINCT parameter_name
-              FROM indicator_to_parameters
-              WHERE indicator_code = '{ind_code}'"""
-    data = pd.read_sql(sql, con = conn)
-    conn.close()
-    return data
+    Helper: streams an indicator's measurements in chunks of rows, for
+    exports. Rows are read with fetchmany, in primary key order (so SQLite
+    doesn't sort the whole result), so memory stays flat however large the
+    export
 
-def __get_param_options(param_name):
-    """Helper to grab parameter options once a type chosen"""
+    Parameters
+    ----------
+    indicator_code : str
+        The indicator to export
+    area_codes : list
+        Areas to export. None for every area
+    parameter_value : str
+        Export the granular rows with this parameter value (of any parameter
+        type), rather than the main measures
+    chunk_size : int
+        Rows per chunk
+    Yields
+    ------
+    rows : list
+        Tuples of export_columns
+    """
+    if not parameter_value:
+        table, filter_sql, filter_params = 'value_table', '', []
+    else:
+        table = 'granular_table'
+        filter_sql = """AND v.measurement_id IN (SELECT r.measurement_id
+                                                 FROM results_to_parameters r
+                                                 JOIN parameter_values p
+                                                 ON p.parameter_value_id = r.parameter_value_id
+                                                 WHERE p.parameter_value = ?)"""
+        filter_params = [parameter_value]
+    area_sql, area_params = '', []
+    if area_codes:
+        area_sql = f"AND a.area_code IN ({', '.join('?' * len(area_codes))})"
+        area_params = list(area_codes)
+    sql = f"""SELECT i.indicator_code, a.area_code, a.area_name, NULLIF(v.year, ?) AS year,
+                     v.measurement_value, v.numeric_value, v.low, v.high
+              FROM indicators i
+              JOIN {table} v
+              ON v.indicator_id = i.indicator_id
+              JOIN areas a
+              ON a.area_id = v.area_id
+              WHERE i.indicator_code = ?
+              {area_sql}
+              {filter_sql}
+              ORDER BY v.area_id, v.year"""
     conn = create_connection(db_file)
-    
-    sql = f"""SELECT DISTINCT parameter_value
-              FROM indicator_to_parameters
-              WHERE parameter_name = '{param_name}'"""
-    data = pd.read_sql(sql, con = conn)
-    conn.close()
-    return data
+    try:
+        cursor = conn.execute(sql, [year_sentinel, indicator_code] + area_params + filter_params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
 ##############################################################################
 #   - Data retrieval
 ##############################################################################
\ No newline at end of file
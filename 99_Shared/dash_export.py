@@ -0,0 +1,166 @@
+"""
+ Bulk export of the data behind the dashboard's charts, as a download route
+ on the Flask server Dash wraps:
+
+     /export?indicator=WHOSIS_000001&areas=GBR,FRA&parameter=Female&format=csv
+
+ 'areas' (comma separated, or repeated) and 'parameter' are optional. The
+ format is 'csv' (default) or 'parquet', which needs the optional 'pyarrow'
+ package.
+
+ Rows are streamed from the visualisation database a chunk at a time (see
+ dash_data_extraction.__iter_export_rows), and written to the response as
+ they're read, so memory stays flat whatever the size of the export. The CSV
+ and Parquet mimetypes aren't in dash_server_helpers' compression_config, and
+ exports aren't cached: either would buffer the whole response.
+
+ -----------------------------------
+ Created on Mon Oct 19 22:20:31 2026
+ @author: matthew.mcfahn
+"""
+
+from flask import request
+import csv
+import re
+import io
+
+from dash_data_extraction import create_connection, __iter_export_rows, export_columns
+import dash_data_extraction
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+export_path = '/export'
+export_chunk_rows = 5000
+content_types = {'csv': 'text/csv; charset=utf-8',
+                 'parquet': 'application/vnd.apache.parquet'}
+
+### - Formats
+def __csv_chunks(row_chunks):
+    """Helper: CSV text (header first) for each chunk of rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_columns)
+    for rows in row_chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+class _ChunkSink:
+    """
+    A write-only file for pyarrow that hands back what's been written so far,
+    so a Parquet file can be sent a row group at a time. It keeps its own
+    position, as the Parquet footer records where each row group starts
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks += [bytes(data)]
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        """Everything written since the last drain"""
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def __parquet_schema():
+    """Helper: the Parquet schema of export_columns"""
+    types = {'year': pa.int64(), 'numeric_value': pa.float64(), 'low': pa.float64(), 'high': pa.float64()}
+    return pa.schema([(column, types.get(column, pa.string())) for column in export_columns])
+
+def __parquet_chunks(row_chunks):
+    """Helper: a Parquet file, one row group per chunk of rows"""
+    schema = __parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for rows in row_chunks:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays([pa.array(column, type = field.type)
+                                                     for column, field in zip(columns, schema)], schema = schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+formats = {'csv': __csv_chunks, 'parquet': __parquet_chunks}
+
+### - Route
+def __indicator_exists(indicator_code):
+    """Helper: whether the indicator is in the visualisation database"""
+    conn = create_connection(dash_data_extraction.db_file)
+    try:
+        return conn.execute('SELECT 1 FROM indicators WHERE indicator_code = ?', [indicator_code]).fetchone() is not None
+    finally:
+        conn.close()
+
+def register_export(server):
+    """
+    Adds the export route to the Flask server Dash wraps
+
+    Parameters
+    ----------
+    server : flask.Flask
+        The Flask server, i.e. app.server
+    Returns
+    -------
+    server : flask.Flask
+        The same server, modified in place
+    """
+    @server.route(export_path)
+    def __export():
+        """Streams the rows for an indicator, in the requested format"""
+        indicator_code = request.args.get('indicator')
+        export_format = request.args.get('format', 'csv').lower()
+        parameter_value = request.args.get('parameter') or None
+        area_codes = [code for value in request.args.getlist('areas') for code in value.split(',') if code]
+
+        if not indicator_code:
+            return server.response_class('An indicator is required', status = 400, mimetype = 'text/plain')
+        if export_format not in formats:
+            return server.response_class(f"Unknown format '{export_format}'. Use one of {', '.join(formats)}",
+                                         status = 400, mimetype = 'text/plain')
+        if export_format == 'parquet' and pa is None:
+            return server.response_class('Parquet exports need pyarrow, which is not installed',
+                                         status = 501, mimetype = 'text/plain')
+        if not __indicator_exists(indicator_code):
+            return server.response_class(f"Unknown indicator '{indicator_code}'", status = 404, mimetype = 'text/plain')
+
+        row_chunks = __iter_export_rows(indicator_code, area_codes or None, parameter_value,
+                                        chunk_size = export_chunk_rows)
+        def __stream():
+            """Closes the database connection as soon as the download ends, or is abandoned"""
+            try:
+                yield from formats[export_format](row_chunks)
+            finally:
+                row_chunks.close()
+
+        response = server.response_class(__stream(), content_type = content_types[export_format],
+                                          direct_passthrough = True)
+        filename = re.sub(r'[^\w.-]', '_', f"{indicator_code}{'_' + parameter_value if parameter_value else ''}")
+        filename = f'{filename}.{export_format}'
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    return server
@@ -1,2 +1,4 @@
-SELECT DISTINCT area_code, area_name
-FROM value_table;
\ No newline at end of file
+SELECT area_id, area_code, area_name,
+       area_id IN (SELECT DISTINCT area_id FROM value_table) AS has_main_measure
+FROM areas
+ORDER BY area_id;
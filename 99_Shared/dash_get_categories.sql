@@ -1,2 +1,6 @@
-SELECT DISTINCT category_name
-FROM value_table;  
\ No newline at end of file
+SELECT category_id, category_name
+FROM categories
+WHERE category_id IN (SELECT category_id
+                      FROM indicators
+                      WHERE indicator_id IN (SELECT DISTINCT indicator_id FROM value_table))
+ORDER BY category_id;
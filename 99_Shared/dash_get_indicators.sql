@@ -1,2 +1,6 @@
-SELECT DISTINCT indicator_code, indicator_name, category_name
-FROM value_table;  
\ No newline at end of file
+SELECT indicators.indicator_id, indicator_code, indicator_name, category_name,
+       indicator_id IN (SELECT DISTINCT indicator_id FROM value_table) AS has_main_measure
+FROM indicators
+INNER JOIN categories
+ON indicators.category_id = categories.category_id
+ORDER BY indicators.indicator_id;
@@ -0,0 +1,5 @@
+SELECT parameter_value_id, parameter_name, parameter_value
+FROM parameter_values
+INNER JOIN parameters
+ON parameter_values.parameter_id = parameters.parameter_id
+ORDER BY parameter_value_id;
@@ -0,0 +1,3 @@
+SELECT group_id, group_type, group_code, group_name
+FROM rollup_groups
+ORDER BY group_id;
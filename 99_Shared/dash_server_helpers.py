@@ -0,0 +1,174 @@
+"""
+ Helpers for the Flask server that the Dash app wraps. Adds:
+     > gzip / brotli compression of callback responses and static assets
+     > HTTP cache validators (ETag / Cache-Control), keyed on the version of
+       the visualisation database, so repeat loads of 'assets/' are cheap
+     > A small in-memory cache of callback payloads, so identical callback
+       requests against the same database version aren't recomputed
+     > A session cookie, so a callback can tell when a newer request from the
+       same browser replaces it (see dash_async_data)
+     > A /metrics endpoint, serving query metrics in the Prometheus text
+       format (see query_metrics)
+
+ -----------------------------------
+ Created on Mon Oct 19 09:12:44 2026
+ @author: matthew.mcfahn
+"""
+
+from flask import request
+from flask_compress import Compress
+from collections import OrderedDict
+import threading
+import hashlib
+import uuid
+
+from dash_data_extraction import __get_db_version
+import query_metrics
+
+# Compression settings. Brotli level 4 is a good speed / size tradeoff for
+# JSON figures generated per request
+compression_config = {'COMPRESS_ALGORITHM': ['br', 'gzip'],
+                      'COMPRESS_LEVEL': 6,
+                      'COMPRESS_BR_LEVEL': 4,
+                      'COMPRESS_MIN_SIZE': 500,
+                      'COMPRESS_MIMETYPES': ['text/html', 'text/css', 'text/plain',
+                                             'application/json', 'application/javascript',
+                                             'image/x-icon', 'image/vnd.microsoft.icon']}
+
+# Static assets are fingerprinted by Dash ('?m=<modified time>'), so can be
+# cached for a long time. Anything without a fingerprint must be revalidated
+assets_max_age = 60 * 60 * 24 * 365
+callback_path = '/_dash-update-component'
+max_cached_payloads = 256
+session_cookie = 'who_session'
+metrics_path = '/metrics'
+
+def __payload_key(db_version, body):
+    """Helper: cache key for a callback request body against a db version"""
+    return hashlib.sha1(db_version.encode() + b'|' + body).hexdigest()
+
+def get_session_id():
+    """The browser session of the current request, or None if it has no session cookie yet"""
+    return request.cookies.get(session_cookie)
+
+def skip_payload_cache():
+    """
+    Keeps the current callback's response out of the payload cache, e.g. when
+    it's a message about a transient failure rather than the figures asked for
+    """
+    request.environ['who.payload_uncacheable'] = True
+    return None
+
+def __matches_compressed_etag(response):
+    """
+    Helper: the compression hook suffixes ETags with the encoding (e.g. ':br'),
+    which Flask's own conditional check doesn't know about. Returns True if
+    the client already holds this response, in any encoding
+    """
+    etag, _ = response.get_etag()
+    if not etag:
+        return False
+    held = {tag.split(':')[0] for tag in request.if_none_match.as_set()}
+    return etag in held
+
+def configure_server(server, db_file):
+    """
+    Configures compression and HTTP caching on the Flask server Dash wraps.
+
+    NOTE: This must be called after the Dash app is created, and before any
+    other after_request hooks that rely on seeing uncompressed responses.
+
+    Parameters
+    ----------
+    server : flask.Flask
+        The Flask server, i.e. app.server
+    db_file : str
+        Filepath to the visualisation database, used to version responses
+    Returns
+    -------
+    server : flask.Flask
+        The same server, modified in place
+    """
+    for key, value in compression_config.items():
+        server.config.setdefault(key, value)
+    # Flask runs after_request hooks in reverse order of registration, so the
+    # compression hook (registered first) sees the final, validated response
+    Compress(server)
+
+    # Shared by the worker's request threads (gthread), so only used under the lock
+    payload_cache = OrderedDict()
+    payload_cache_lock = threading.Lock()
+
+    @server.route(metrics_path)
+    def __serve_metrics():
+        """Query metrics for Prometheus to scrape"""
+        response = server.response_class(query_metrics.metrics_text(), mimetype = 'text/plain')
+        response.headers['Content-Type'] = query_metrics.content_type
+        return response
+
+    @server.before_request
+    def __serve_cached_payload():
+        """Short-circuits identical callback requests for the same db version"""
+        if request.method != 'POST' or not request.path.endswith(callback_path):
+            return None
+        key = __payload_key(__get_db_version(db_file), request.get_data(cache = True))
+        request.environ['who.payload_key'] = key
+        with payload_cache_lock:
+            payload = payload_cache.get(key)
+            if payload is not None:
+                payload_cache.move_to_end(key)
+        if payload is None:
+            return None
+        response = server.response_class(payload, mimetype = 'application/json')
+        request.environ['who.payload_cached'] = True
+        return response
+
+    @server.after_request
+    def __add_cache_headers(response):
+        """Adds ETag / Cache-Control headers, and stores callback payloads"""
+        if response.status_code != 200:
+            return response
+        # Kept out of the callback body, so cached payloads are shared between sessions
+        if session_cookie not in request.cookies and request.path != metrics_path:
+            response.set_cookie(session_cookie, uuid.uuid4().hex, httponly = True, samesite = 'Lax')
+        db_version = __get_db_version(db_file)
+
+        # Callbacks: versioned on the request body and database version
+        if request.method == 'POST' and request.path.endswith(callback_path) and not response.is_streamed:
+            key = request.environ.get('who.payload_key')
+            if key and not (request.environ.get('who.payload_cached') or request.environ.get('who.payload_uncacheable')):
+                payload = response.get_data()
+                with payload_cache_lock:
+                    payload_cache[key] = payload
+                    payload_cache.move_to_end(key)
+                    if len(payload_cache) > max_cached_payloads:
+                        payload_cache.popitem(last = False)
+            # No ETag: browsers don't make conditional POST requests
+            response.headers['Cache-Control'] = 'no-cache'
+
+        # Static assets: long lived when fingerprinted, else revalidate
+        elif request.method == 'GET' and '/assets/' in request.path:
+            if 'm' in request.args:
+                response.headers['Cache-Control'] = f'public, max-age={assets_max_age}, immutable'
+            else:
+                response.headers['Cache-Control'] = 'no-cache'
+            if __matches_compressed_etag(response):
+                not_modified = server.response_class(status = 304)
+                not_modified.headers['Cache-Control'] = response.headers['Cache-Control']
+                not_modified.set_etag(response.get_etag()[0])
+                return not_modified
+
+        # Metrics change on every request, so are never cached
+        elif request.path == metrics_path:
+            response.headers['Cache-Control'] = 'no-store'
+
+        # Layout / dependencies etc: revalidate against the database version.
+        # Files sent directly (assets, component suites) already carry an ETag
+        elif request.method == 'GET' and not (response.direct_passthrough or response.is_streamed):
+            response.set_etag(__payload_key(db_version, response.get_data()))
+            response.headers['Cache-Control'] = 'no-cache'
+            response.make_conditional(request)
+
+        return response
+
+    return server
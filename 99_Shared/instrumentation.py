@@ -0,0 +1,268 @@
+"""
+ Lightweight instrumentation for the pipeline stages: timed spans (as context
+ managers or decorators) that record wall and CPU time, memory, and rows in /
+ rows out, written as JSON lines so runs can be compared to find regressions
+ in the hot paths.
+
+     with instrumentation.span('cleaning.load', table = 'indicator_data') as s:
+         frame = ...
+         s.rows_out(len(frame))
+
+     @instrumentation.timed(rows = True)
+     def __split_ind_data(indicator_dataframe): ...
+
+     @instrumentation.profile_stage('cleaning')
+     def main(db_file, out_db_file): ...
+
+ Configured with environment variables:
+     WHO_INSTRUMENTATION      '0' to turn spans off entirely (default on)
+     WHO_INSTRUMENTATION_LOG  The JSON-lines file (default <outdir>/instrumentation.jsonl)
+     WHO_TRACEMALLOC          '1' to also record Python heap peaks per span. This
+                              slows allocation heavy code, so it's off by default
+     WHO_PROFILE              'cprofile' or 'pyinstrument' to profile each stage
+                              (see profile_stage). Output goes to WHO_PROFILE_DIR
+                              (default <outdir>/profiles)
+
+ Current RSS needs the optional 'psutil' package. Without it, only the peak
+ RSS of the process is recorded.
+
+ -----------------------------------
+ Created on Mon Oct 19 16:05:21 2026
+ @author: matthew.mcfahn
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+import functools
+import threading
+import tracemalloc
+import json
+import time
+import sys
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+enabled = os.environ.get('WHO_INSTRUMENTATION', '1') != '0'
+log_file = os.environ.get('WHO_INSTRUMENTATION_LOG')
+use_tracemalloc = os.environ.get('WHO_TRACEMALLOC', '0') == '1'
+profiler = os.environ.get('WHO_PROFILE', '').lower() or None
+profile_dir = os.environ.get('WHO_PROFILE_DIR')
+
+# Groups the records of one process run
+run_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+
+### - Measurements
+def __default_dir():
+    """Helper: the pipeline's output directory. Imported here, as sqlite_helpers imports this module"""
+    from sqlite_helpers import outdir
+    return outdir
+
+def __log_path():
+    """Helper: where the JSON lines go"""
+    return log_file or f'{__default_dir()}/instrumentation.jsonl'
+
+def rss_mb():
+    """Current resident memory of this process in Mb, or None without psutil"""
+    if psutil is None:
+        return None
+    return round(psutil.Process().memory_info().rss / 1024**2, 1)
+
+def peak_rss_mb():
+    """Peak resident memory of this process in Mb, or None where unsupported"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return round(peak / (1024**2 if sys.platform == 'darwin' else 1024), 1)
+
+# Single underscore: these are used inside Span, where '__' names would be mangled
+_write_lock = threading.Lock()
+_span_stack = ContextVar('span_stack', default = ())
+
+def _write(record):
+    """Helper: append one record to the JSON-lines log"""
+    path = __log_path()
+    line = json.dumps(record, default = str) + '\n'
+    with _write_lock:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+        with open(path, 'a') as file:
+            file.write(line)
+    return None
+
+### - Spans
+class Span:
+    """
+    A timed section of the pipeline. Use through span() or timed(). On exit,
+    one JSON line is written with: name, parent, run_id, started_at,
+    wall_s, cpu_s, rss_mb (start / end, with psutil), peak_rss_mb,
+    heap_peak_mb (with WHO_TRACEMALLOC=1), rows_in, rows_out, status, and any
+    extra fields given
+    """
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.rows = {'rows_in': None, 'rows_out': None}
+
+    def rows_in(self, count):
+        """Record the number of rows going into the span"""
+        self.rows['rows_in'] = int(count)
+
+    def rows_out(self, count):
+        """Record the number of rows coming out of the span"""
+        self.rows['rows_out'] = int(count)
+
+    def add(self, **fields):
+        """Record extra fields on the span"""
+        self.fields.update(fields)
+
+    def __enter__(self):
+        stack = _span_stack.get()
+        self.parent = stack[-1] if stack else None
+        self.token = _span_stack.set(stack + (self.name,))
+        self.started_at = datetime.now().isoformat(timespec = 'milliseconds')
+        self.rss_start = rss_mb()
+        if use_tracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.heap_start = tracemalloc.get_traced_memory()[0]
+            # Python < 3.9 can't reset the peak, so nested spans report the outer peak
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        self.cpu_start = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu_start
+        _span_stack.reset(self.token)
+        record = {'name': self.name, 'parent': self.parent, 'run_id': run_id,
+                  'started_at': self.started_at, 'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4),
+                  'rss_start_mb': self.rss_start, 'rss_end_mb': rss_mb(), 'peak_rss_mb': peak_rss_mb(),
+                  **self.rows,
+                  'status': 'ok' if exc_type is None else exc_type.__name__}
+        if use_tracemalloc:
+            record['heap_peak_mb'] = round((tracemalloc.get_traced_memory()[1] - self.heap_start) / 1024**2, 2)
+        if self.rows['rows_in'] and self.rows['rows_out'] is not None:
+            record['rows_per_s'] = round(self.rows['rows_in'] / max(wall, 1e-9))
+        record.update(self.fields)
+        _write(record)
+        return False
+
+class _NullSpan:
+    """Stands in for a Span when instrumentation is turned off"""
+    def rows_in(self, count): pass
+    def rows_out(self, count): pass
+    def add(self, **fields): pass
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc, traceback): return False
+
+_null_span = _NullSpan()
+
+def span(name, **fields):
+    """
+    A timed span, for use as a context manager
+
+    Parameters
+    ----------
+    name : str
+        The span's name, e.g. 'cleaning.split_ind_data'
+    **fields
+        Extra fields for the JSON line, e.g. table = 'indicator_data'
+    Returns
+    -------
+    span : Span
+        Call .rows_in(n) / .rows_out(n) / .add(...) on it inside the block
+    """
+    return Span(name, **fields) if enabled else _null_span
+
+def __count_rows(value):
+    """Helper: rows in a DataFrame / Series, or the first one in a tuple. None otherwise"""
+    if isinstance(value, tuple):
+        value = value[0] if value else None
+    if hasattr(value, 'shape') and hasattr(value, 'index'):
+        return len(value)
+    return None
+
+def timed(name = None, rows = False):
+    """
+    Decorator: wraps each call to the function in a span
+
+    Parameters
+    ----------
+    name : str
+        The span's name. Defaults to '<module>.<function>', without leading underscores
+    rows : bool
+        If True, rows_in is the length of the first DataFrame argument, and
+        rows_out the length of the returned DataFrame (or the first in a tuple)
+    """
+    def decorator(function):
+        span_name = name or f"{function.__module__}.{function.__name__.lstrip('_')}"
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name) as current:
+                if rows:
+                    counts = [__count_rows(arg) for arg in args]
+                    counts = [count for count in counts if count is not None]
+                    if counts:
+                        current.rows_in(counts[0])
+                result = function(*args, **kwargs)
+                if rows:
+                    count = __count_rows(result)
+                    if count is not None:
+                        current.rows_out(count)
+                return result
+        return wrapper
+    return decorator
+
+### - Profiling
+@contextmanager
+def profile_stage(name):
+    """
+    Wraps a whole stage in a span, and profiles it if WHO_PROFILE is set. Use
+    as a context manager, or as a decorator on the stage's main():
+    'cprofile' writes <name>_<run_id>.prof (open with pstats or snakeviz),
+    'pyinstrument' writes <name>_<run_id>.html (pyinstrument must be installed)
+
+    Parameters
+    ----------
+    name : str
+        The stage name, e.g. 'cleaning'
+    """
+    output_dir = profile_dir or f'{__default_dir()}/profiles'
+    with span(f'{name}.stage') as current:
+        if profiler is None:
+            yield current
+        elif profiler == 'cprofile':
+            import cProfile
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield current
+            finally:
+                profile.disable()
+                os.makedirs(output_dir, exist_ok = True)
+                profile.dump_stats(os.path.join(output_dir, f'{name}_{run_id}.prof'))
+        elif profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            profile = Profiler()
+            profile.start()
+            try:
+                yield current
+            finally:
+                profile.stop()
+                os.makedirs(output_dir, exist_ok = True)
+                with open(os.path.join(output_dir, f'{name}_{run_id}.html'), 'w') as file:
+                    file.write(profile.output_html())
+        else:
+            raise Exception(f"Unknown WHO_PROFILE '{profiler}'. Use 'cprofile' or 'pyinstrument'")
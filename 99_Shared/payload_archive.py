@@ -0,0 +1,222 @@
+"""
+ A compressed, content-addressed local store for the raw indicator payloads
+ pulled from the GHO API, so the staged database can be rebuilt offline
+ ("replayed") after a downstream fix, rather than re-downloading everything.
+
+ Layout of archive_dir:
+     objects/<ab>/<hash>.pages.<gz|zst>   One object per indicator version: the
+                                          page bodies of the response, each as
+                                          b'<length>\n<body>' so they round trip
+                                          byte for byte
+     snapshots/<YYYYmmddTHHMMSS>.json     Manifest of one retrieval: the object
+                                          for every indicator, {code: hash}
+
+ The hash is the sha256 of the raw response pages, as recorded in the
+ retrieval journal (see sqlite_helpers.__checkpoint_response), so a resumed
+ retrieval can fill in its manifest from the journal. Objects are compressed
+ with zstd if the 'zstandard' package is installed, otherwise gzip.
+
+ -----------------------------------
+ Created on Mon Oct 19 14:02:37 2026
+ @author: matthew.mcfahn
+"""
+
+from collections.abc import Mapping
+from datetime import datetime
+import hashlib
+import json
+import gzip
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from sqlite_helpers import outdir
+
+archive_dir = f'{outdir}/payload_archive'
+gzip_level = 6
+zstd_level = 10
+
+### - Objects
+def payload_hash(response):
+    """
+    The content address of a response: sha256 of its page bodies, in order
+
+    Parameters
+    ----------
+    response : bytes / list
+        The response body, or a list of page bodies from paged retrieval
+    Returns
+    -------
+    digest : str
+        The hex digest
+    """
+    pages = response if type(response) == list else [response]
+    digest = hashlib.sha256()
+    for page in pages:
+        digest.update(page)
+    return digest.hexdigest()
+
+def __find_object(digest, archive_dir):
+    """Helper: path of the stored object for a hash (any codec), or None"""
+    folder = os.path.join(archive_dir, 'objects', digest[:2])
+    for suffix in ('zst', 'gz'):
+        path = os.path.join(folder, f'{digest}.pages.{suffix}')
+        if os.path.exists(path):
+            return path
+    return None
+
+def __encode_pages(pages):
+    """Helper: frames each page as b'<length>\\n<body>', so the bytes are kept exactly"""
+    return b''.join(b'%d\n' % len(page) + page for page in pages)
+
+def __decode_pages(body):
+    """Helper: the inverse of __encode_pages"""
+    pages = []
+    position = 0
+    while position < len(body):
+        newline = body.index(b'\n', position)
+        length = int(body[position:newline])
+        pages += [body[newline + 1:newline + 1 + length]]
+        position = newline + 1 + length
+    return pages
+
+def archive_response(indicator, response, archive_dir = archive_dir):
+    """
+    Stores a response in the archive, unless an identical one is already there
+
+    Parameters
+    ----------
+    indicator : str
+        The IndicatorCode (for reporting only; objects are keyed by content)
+    response : bytes / list
+        The response body, or a list of page bodies from paged retrieval
+    archive_dir : str
+        Root directory of the archive
+    Returns
+    -------
+    digest : str
+        The object's hash, for the snapshot manifest
+    """
+    digest = payload_hash(response)
+    if __find_object(digest, archive_dir) is not None:
+        return digest
+
+    pages = response if type(response) == list else [response]
+    body = __encode_pages(pages)
+    if zstandard is not None:
+        suffix, compressed = 'zst', zstandard.ZstdCompressor(level = zstd_level).compress(body)
+    else:
+        suffix, compressed = 'gz', gzip.compress(body, compresslevel = gzip_level)
+
+    folder = os.path.join(archive_dir, 'objects', digest[:2])
+    os.makedirs(folder, exist_ok = True)
+    path = os.path.join(folder, f'{digest}.pages.{suffix}')
+    # Written under a unique temporary name, so concurrent writers can't clash
+    with open(f'{path}.{os.getpid()}.tmp', 'wb') as file:
+        file.write(compressed)
+    os.replace(f'{path}.{os.getpid()}.tmp', path)
+    return digest
+
+def read_object(digest, archive_dir = archive_dir):
+    """
+    Reads a stored response back from the archive
+
+    Returns
+    -------
+    pages : list
+        The list of page bodies (bytes)
+    """
+    path = __find_object(digest, archive_dir)
+    if path is None:
+        raise Exception(f'Object {digest} not found in the payload archive at {archive_dir}')
+    with open(path, 'rb') as file:
+        compressed = file.read()
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise Exception(f"Reading {path} needs the 'zstandard' package")
+        body = zstandard.ZstdDecompressor().decompress(compressed)
+    else:
+        body = gzip.decompress(compressed)
+    return __decode_pages(body)
+
+### - Snapshots
+def write_snapshot(objects, archive_dir = archive_dir):
+    """
+    Writes the manifest of a retrieval: which object holds each indicator
+
+    Parameters
+    ----------
+    objects : dict
+        {IndicatorCode: object hash}
+    archive_dir : str
+        Root directory of the archive
+    Returns
+    -------
+    snapshot_file : str
+        Path to the manifest
+    """
+    folder = os.path.join(archive_dir, 'snapshots')
+    os.makedirs(folder, exist_ok = True)
+    created_at = datetime.now()
+    snapshot_file = os.path.join(folder, f"{created_at.strftime('%Y%m%dT%H%M%S')}.json")
+    with open(f'{snapshot_file}.tmp', 'w') as file:
+        json.dump({'created_at': created_at.isoformat(timespec = 'seconds'),
+                   'indicators': dict(sorted(objects.items()))}, file, indent = 1)
+    os.replace(f'{snapshot_file}.tmp', snapshot_file)
+    print(f'[ARCHIVE] Snapshot of {len(objects)} indicators written to {snapshot_file}')
+    return snapshot_file
+
+def latest_snapshot(archive_dir = archive_dir):
+    """Path to the most recent snapshot manifest in the archive"""
+    folder = os.path.join(archive_dir, 'snapshots')
+    snapshots = sorted(x for x in os.listdir(folder) if x.endswith('.json')) if os.path.isdir(folder) else []
+    if not snapshots:
+        raise Exception(f'No snapshots found in the payload archive at {archive_dir}')
+    return os.path.join(folder, snapshots[-1])
+
+class SnapshotResponses(Mapping):
+    """
+    A read-only {IndicatorCode: pages} view of a snapshot, in the same shape
+    as the responses from data_retrieval.__get_maindata_async. Objects are
+    read and decompressed only when accessed, so a whole snapshot is never
+    held in memory at once
+    """
+    def __init__(self, snapshot_file, archive_dir = archive_dir):
+        with open(snapshot_file, 'r') as file:
+            self.manifest = json.load(file)
+        self.objects = self.manifest['indicators']
+        self.archive_dir = archive_dir
+
+    def __getitem__(self, indicator):
+        return read_object(self.objects[indicator], self.archive_dir)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __len__(self):
+        return len(self.objects)
+
+def load_snapshot(snapshot_file = None, archive_dir = archive_dir):
+    """
+    Opens a snapshot for replay
+
+    Parameters
+    ----------
+    snapshot_file : str
+        Path to a manifest. If None, the most recent snapshot is used
+    archive_dir : str
+        Root directory of the archive
+    Returns
+    -------
+    responses : SnapshotResponses
+        A lazy {IndicatorCode: list of page bodies} mapping
+    """
+    if snapshot_file is None:
+        snapshot_file = latest_snapshot(archive_dir)
+    responses = SnapshotResponses(snapshot_file, archive_dir)
+    print(f"[ARCHIVE] Replaying snapshot {snapshot_file} ({len(responses)} indicators, "
+          f"retrieved {responses.manifest['created_at']})")
+    return responses
@@ -0,0 +1,296 @@
+"""
+ Query level metrics for the app.py Dash app: a decorator for the retrieval
+ functions in dash_data_extraction that records a latency histogram, row
+ counts and errors per query, and logs slow queries with their
+ EXPLAIN QUERY PLAN. The stats are served in the Prometheus text format on
+ /metrics (see dash_server_helpers.configure_server).
+
+     @query_metrics.timed_query('linegraph')
+     def __get_linegraph_data(area_id, indicator_id, ...): ...
+
+ Metrics are recorded in memory, per process. Under gunicorn, each worker
+ also writes its stats to a file in a shared directory (WHO_METRICS_DIR, set
+ by gunicorn.conf.py), and /metrics adds up every worker's file, so whichever
+ worker is scraped reports the totals. Files of workers that have exited are
+ kept, so the totals never go backwards. Without a directory, /metrics
+ reports the stats of the process serving it, as the development server does.
+
+ Writing the files, and explaining and logging slow queries, happen on a
+ background thread, outside the callback that ran the query.
+
+ Configured with environment variables:
+     WHO_QUERY_METRICS    '0' to turn query metrics off (default on)
+     WHO_SLOW_QUERY_MS    Queries slower than this are logged with their plan
+                          (default 250)
+     WHO_METRICS_DIR      Directory shared by the worker processes (default
+                          none: per process metrics)
+
+ -----------------------------------
+ Created on Mon Oct 19 20:52:18 2026
+ @author: matthew.mcfahn
+"""
+
+from contextvars import ContextVar
+import functools
+import threading
+import bisect
+import queue
+import json
+import time
+import glob
+import os
+
+enabled = os.environ.get('WHO_QUERY_METRICS', '1') != '0'
+slow_query_ms = float(os.environ.get('WHO_SLOW_QUERY_MS', 250))
+metrics_dir = os.environ.get('WHO_METRICS_DIR') or None
+flush_interval = 1.0        # Seconds between writes of a worker's stats to metrics_dir
+# Histogram bucket upper bounds, in seconds
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Single underscore: used inside the decorator's closure
+_lock = threading.Lock()
+_stats = {}
+_dirty = False
+_flush_lock = threading.Lock()
+_statements = ContextVar('query_statements', default = None)
+_slow_queries = queue.Queue()
+_background = None
+_background_pid = None
+
+### - Recording
+def _new_stats():
+    """Helper: empty stats for one query"""
+    return {'buckets': [0] * (len(latency_buckets) + 1), 'sum': 0.0, 'count': 0,
+            'rows': 0, 'slow': 0, 'errors': {}}
+
+def _record(name, seconds, rows, error):
+    """Helper: adds one call to a query's stats"""
+    global _dirty
+    with _lock:
+        stats = _stats.setdefault(name, _new_stats())
+        stats['buckets'][bisect.bisect_left(latency_buckets, seconds)] += 1
+        stats['sum'] += seconds
+        stats['count'] += 1
+        stats['rows'] += rows or 0
+        if seconds * 1000 > slow_query_ms:
+            stats['slow'] += 1
+        if error is not None:
+            stats['errors'][error] = stats['errors'].get(error, 0) + 1
+        _dirty = True
+    return None
+
+def record_statement(sql, params):
+    """
+    Notes a statement run by the query being timed, so it can be explained if
+    the query is slow. Called by dash_data_extraction.__read_sql; does nothing
+    outside timed_query
+    """
+    statements = _statements.get()
+    if statements is not None:
+        statements.append((sql, list(params or [])))
+    return None
+
+def _count_rows(result):
+    """Helper: rows in a DataFrame, list, or dict of equal length arrays"""
+    if isinstance(result, dict):
+        result = next(iter(result.values()), [])
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+### - Background thread: slow query log, and shared stats
+def _query_plan(sql, params):
+    """Helper: EXPLAIN QUERY PLAN for a statement, one step per line"""
+    # Imported here, as dash_data_extraction imports this module
+    from dash_data_extraction import create_connection
+    import dash_data_extraction
+    conn = create_connection(dash_data_extraction.db_file)
+    try:
+        steps = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    finally:
+        conn.close()
+    return '\n'.join(f'    {step[-1]}' for step in steps)
+
+def _log_slow_query(name, seconds, statements):
+    """Helper: prints a slow query, with the plan of each statement it ran"""
+    message = f'[SLOW QUERY] {name} took {round(seconds * 1000)}ms (threshold {slow_query_ms:g}ms)'
+    for sql, params in statements:
+        try:
+            plan = _query_plan(sql, params)
+        except Exception as e:
+            plan = f'    Unable to explain: {e}'
+        message += f"\n  {' '.join(sql.split())}\n  params: {params}\n{plan}"
+    print(message, flush = True)
+    return None
+
+def _stats_file(pid = None):
+    """Helper: the file a process writes its stats to, in metrics_dir"""
+    return os.path.join(metrics_dir, f'{pid or os.getpid()}.json')
+
+def _snapshot():
+    """Helper: a copy of this process's stats"""
+    with _lock:
+        return {name: {**stats, 'buckets': list(stats['buckets']), 'errors': dict(stats['errors'])}
+                for name, stats in _stats.items()}
+
+def _flush():
+    """Helper: writes this process's stats to metrics_dir, if they've changed"""
+    global _dirty
+    if metrics_dir is None or not _dirty:
+        return None
+    # The background thread and a scrape can both flush
+    with _flush_lock:
+        with _lock:
+            _dirty = False
+        os.makedirs(metrics_dir, exist_ok = True)
+        # Written to a temporary file and renamed, so a scrape never reads half a file
+        temp_file = _stats_file() + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(_snapshot(), f)
+        os.replace(temp_file, _stats_file())
+    return None
+
+def _run_background():
+    """Helper: logs slow queries as they're queued, and flushes the stats every flush_interval"""
+    while True:
+        try:
+            slow_query = _slow_queries.get(timeout = flush_interval)
+        except queue.Empty:
+            slow_query = None
+        try:
+            if slow_query is not None:
+                _log_slow_query(*slow_query)
+            _flush()
+        except Exception as e:
+            print(f'[METRICS] Background thread error: {e}', flush = True)
+
+def _ensure_background():
+    """Helper: starts the background thread, once in each process (threads don't survive a fork)"""
+    global _background, _background_pid
+    if _background_pid == os.getpid():
+        return None
+    with _lock:
+        if _background_pid != os.getpid():
+            # A forked worker starts from zero: what it inherited is in its parent's file
+            if _background_pid is not None:
+                _stats.clear()
+            _background = threading.Thread(target = _run_background, name = 'who-query-metrics', daemon = True)
+            _background.start()
+            _background_pid = os.getpid()
+    return None
+
+def timed_query(name = None):
+    """
+    Decorator: records the latency, rows returned and errors of each call,
+    and logs calls slower than WHO_SLOW_QUERY_MS
+
+    Parameters
+    ----------
+    name : str
+        The query's label in the metrics. Defaults to the function name,
+        without leading underscores
+    """
+    def decorator(function):
+        query_name = name or function.__name__.lstrip('_')
+        if not enabled:
+            return function
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            statements = []
+            token = _statements.set(statements)
+            start = time.perf_counter()
+            result, error = None, None
+            try:
+                result = function(*args, **kwargs)
+                return result
+            except Exception as e:
+                error = e.__class__.__name__
+                raise
+            finally:
+                seconds = time.perf_counter() - start
+                _statements.reset(token)
+                _ensure_background()
+                _record(query_name, seconds, _count_rows(result) if error is None else None, error)
+                if seconds * 1000 > slow_query_ms:
+                    _slow_queries.put((query_name, seconds, statements))
+        return wrapper
+    return decorator
+
+### - Exposition
+def __format_bound(bound):
+    """Helper: a bucket bound as Prometheus writes it"""
+    return '+Inf' if bound == float('inf') else f'{bound:g}'
+
+def __merge(totals, stats):
+    """Helper: adds one process's stats for a query to the totals"""
+    totals['buckets'] = [x + y for x, y in zip(totals['buckets'], stats['buckets'])]
+    for key in ['sum', 'count', 'rows', 'slow']:
+        totals[key] += stats[key]
+    for error, count in stats['errors'].items():
+        totals['errors'][error] = totals['errors'].get(error, 0) + count
+    return totals
+
+def __all_stats():
+    """Helper: the stats of every process writing to metrics_dir, added up (or this process's, without one)"""
+    if metrics_dir is None:
+        return _snapshot()
+    _flush()
+    totals = {}
+    for stats_file in glob.glob(os.path.join(metrics_dir, '*.json')):
+        try:
+            with open(stats_file) as f:
+                process_stats = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, stats in process_stats.items():
+            __merge(totals.setdefault(name, _new_stats()), stats)
+    return totals
+
+def metrics_text():
+    """
+    The query metrics in the Prometheus text exposition format
+
+    Returns
+    -------
+    text : str
+        who_query_duration_seconds (histogram), who_query_rows_total,
+        who_query_slow_total and who_query_errors_total, labelled by query,
+        over all worker processes
+    """
+    snapshot = __all_stats()
+    lines = ['# HELP who_query_duration_seconds Time taken by dashboard queries',
+             '# TYPE who_query_duration_seconds histogram']
+    for name, stats in sorted(snapshot.items()):
+        labels = f'query="{name}"'
+        cumulative = 0
+        for bound, count in zip(latency_buckets + (float('inf'),), stats['buckets']):
+            cumulative += count
+            lines += [f'who_query_duration_seconds_bucket{{{labels},le="{__format_bound(bound)}"}} {cumulative}']
+        lines += [f'who_query_duration_seconds_sum{{{labels}}} {stats["sum"]:.6f}',
+                  f'who_query_duration_seconds_count{{{labels}}} {stats["count"]}']
+
+    counters = [('who_query_rows_total', 'Rows returned by dashboard queries', 'rows'),
+                ('who_query_slow_total', f'Dashboard queries slower than {slow_query_ms:g}ms', 'slow')]
+    for metric, description, key in counters:
+        lines += [f'# HELP {metric} {description}', f'# TYPE {metric} counter']
+        lines += [f'{metric}{{query="{name}"}} {stats[key]}' for name, stats in sorted(snapshot.items())]
+
+    lines += ['# HELP who_query_errors_total Dashboard queries that raised, by exception',
+              '# TYPE who_query_errors_total counter']
+    for name, stats in sorted(snapshot.items()):
+        lines += [f'who_query_errors_total{{query="{name}",error="{error}"}} {count}'
+                  for error, count in sorted(stats['errors'].items())]
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    """Clears all recorded metrics, including every process's file in metrics_dir"""
+    global _dirty
+    with _lock:
+        _stats.clear()
+        _dirty = False
+    if metrics_dir is not None:
+        for stats_file in glob.glob(os.path.join(metrics_dir, '*.json')):
+            os.remove(stats_file)
+    return None
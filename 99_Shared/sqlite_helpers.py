@@ -8,13 +8,17 @@
  @author: matthew.mcfahn
 """
 
+from datetime import datetime, timezone
 import pandas as pd
+import hashlib
 import json
 import sqlite3
 from sqlite3 import Error
 from getpass import getuser
 import os
 
+import instrumentation
+
 # Set up the out directory, based on the user, and whether the OS is Mac or Windows
 if os.name == 'posix':
     outdir = f'/Users/{getuser()}/Documents/World Health Organisation project'
@@ -24,6 +28,7 @@ sqlite_name = 'WHO_Data'
 
 db_file = f'{outdir}/{sqlite_name}.sqlite3'
 create_db_script = f'/Users/matthew.mcfahn/Documents/Github/who-api-analysis/create_modelled_db.sql'
+create_visualisation_script = f'/Users/matthew.mcfahn/Documents/Github/who-api-analysis/create_visualisation_db.sql'
 
 ### - Generic helpers
 def create_connection(db_file = db_file):
@@ -51,7 +56,9 @@ def __frame_to_sqlite(frame, table_name, db_file, if_exists = 'fail'):
     """
     conn = create_connection(db_file)
     
-    frame.to_sql(name = table_name, con = conn, index = False, if_exists = if_exists)
+    with instrumentation.span('sqlite.write_table', table = table_name) as span:
+        span.rows_in(len(frame))
+        frame.to_sql(name = table_name, con = conn, index = False, if_exists = if_exists)
     
     conn.close()
     return None
@@ -82,7 +89,9 @@ def __load_db_to_pandas(db_file, table_names):
     # Deal with string case
     if type(table_names) == str:
         print(f"""[SQLite] Loading table: {table_names}... """)
-        dataframe = pd.read_sql(sql = f"""SELECT * FROM {table_names}""", con = conn)
+        with instrumentation.span('sqlite.load_table', table = table_names) as span:
+            dataframe = pd.read_sql(sql = f"""SELECT * FROM {table_names}""", con = conn)
+            span.rows_out(len(dataframe))
         print(f"""[SQLite] Loading table: {table_names}... DONE""")
         conn.close()
         return dataframe
@@ -93,7 +102,9 @@ def __load_db_to_pandas(db_file, table_names):
     dataframes = {}
     for table in table_names:
         print(f"""[SQLite] Loading table: {table}...""")
-        dataframes[table] = pd.read_sql(sql = f"""SELECT * FROM {table}""", con = conn)
+        with instrumentation.span('sqlite.load_table', table = table) as span:
+            dataframes[table] = pd.read_sql(sql = f"""SELECT * FROM {table}""", con = conn)
+            span.rows_out(len(dataframes[table]))
         print(f"""[SQLite] Loading table: {table}... DONE""")
     return dataframes
 
@@ -144,64 +155,178 @@ def __get_table_schema(db_file):
     return table_schema
 
 ### - Bespoke functions
-def __responses_to_sqlite(responses, db_file = db_file):
+# Define the structure of the 'indicator_data' table, with datatypes
+indicator_data_sql = """CREATE TABLE IF NOT EXISTS indicator_data (
+                                ID integer PRIMARY KEY,
+                                IndicatorCode varchar(100) NOT NULL,
+                                SpatialDimType varchar(100),
+                                SpatialDim varchar(20),
+                                TimeDimType varchar(20),
+                                TimeDim integer,
+                                Dim1Type text,
+                                Dim1 text,
+                                Dim2Type text,
+                                Dim2 text,
+                                Dim3Type text,
+                                Dim3 text,
+                                DataSourceDimType text,
+                                DataSourceDim text,
+                                Value integer,
+                                NumericValue decimal,
+                                Low decimal,
+                                High decimal,
+                                Comments text,
+                                Date datetime,
+                                TimeDimensionValue int,
+                                TimeDimensionBegin datetime,
+                                TimeDimensionEnd datetime
+               );"""
+# Checkpoint journal: one row per indicator whose data is fully in indicator_data
+retrieval_journal_sql = """CREATE TABLE IF NOT EXISTS retrieval_journal (
+                                IndicatorCode varchar(100) PRIMARY KEY,
+                                row_count integer NOT NULL,
+                                content_hash varchar(64) NOT NULL,
+                                completed_at datetime NOT NULL
+               );"""
+
+def __create_retrieval_tables(conn):
+    """Helper: creates the 'indicator_data' and 'retrieval_journal' tables, if needed"""
+    try:
+        cur = conn.cursor()
+        cur.execute(indicator_data_sql)
+        cur.execute(retrieval_journal_sql)
+        conn.commit()
+    except Error as e:
+        raise Exception(f'Creating SQLite table failed with error code {e}')
+    return None
+
+def __insert_pages(conn, pages):
+    """
+    Helper: inserts the records in a list of OData page bodies into
+    'indicator_data', without committing. Only columns the table defines are
+    written, so extra fields in the API response are ignored
+
+    Returns
+    -------
+    row_count : int
+        The number of rows inserted
+    """
+    table_columns = {row[1].lower(): row[1] for row in conn.execute('PRAGMA table_info(indicator_data)')}
+    row_count = 0
+    for page in pages:
+        records = json.loads(page)['value']
+        if not records:
+            continue
+        columns = [column for column in records[0] if column.lower() in table_columns]
+        insert_sql = (f"""INSERT INTO indicator_data ({', '.join(table_columns[c.lower()] for c in columns)}) """
+                      f"""VALUES ({', '.join('?' * len(columns))})""")
+        conn.executemany(insert_sql, [tuple(record.get(c) for c in columns) for record in records])
+        row_count += len(records)
+    return row_count
+
+def __get_completed_indicators(db_file = db_file, column = 'row_count'):
+    """
+    Reads the checkpoint journal of a (possibly interrupted) retrieval
+    
+    Parameters
+    ----------
+    db_file : str
+        Filepath to the staging database
+    column : str
+        The journal column to return for each indicator: 'row_count',
+        'content_hash' or 'completed_at'
+    Returns
+    -------
+    completed : dict
+        {IndicatorCode: column} for every indicator already written in full.
+        Empty if the database or journal doesn't exist yet
+    """
+    if column not in ('row_count', 'content_hash', 'completed_at'):
+        raise Exception(f"Unknown retrieval_journal column '{column}'")
+    if not os.path.exists(db_file):
+        return {}
+    conn = create_connection(db_file)
+    __create_retrieval_tables(conn)
+    completed = dict(conn.execute(f'SELECT IndicatorCode, {column} FROM retrieval_journal').fetchall())
+    conn.close()
+    return completed
+
+def __checkpoint_response(conn, indicator, response):
+    """
+    Writes one indicator's response to 'indicator_data' and records it in the
+    checkpoint journal, in a single transaction. If the process dies part way,
+    neither is written, so the indicator is simply requested again on restart
+    
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        Connection to the staging database (see __create_retrieval_tables)
+    indicator : str
+        The IndicatorCode
+    response : bytes / list
+        The response body, or a list of page bodies from paged retrieval. The
+        journal's content_hash is the sha256 of the pages, in order (the same
+        as the payload archive's object hash)
+    Returns
+    -------
+    row_count : int
+        The number of rows written for the indicator
+    """
+    pages = response if type(response) == list else [response]
+    content_hash = hashlib.sha256()
+    for page in pages:
+        content_hash.update(page)
+    
+    with conn:
+        # Rows are only ever written with their journal entry, so an indicator
+        # has old rows to replace only if it's journalled. indicator_data isn't
+        # indexed on IndicatorCode, so the DELETE (a full scan) is kept to that case
+        if conn.execute('SELECT 1 FROM retrieval_journal WHERE IndicatorCode = ?', (indicator,)).fetchone():
+            conn.execute('DELETE FROM indicator_data WHERE IndicatorCode = ?', (indicator,))
+        row_count = __insert_pages(conn, pages)
+        conn.execute('INSERT OR REPLACE INTO retrieval_journal VALUES (?, ?, ?, ?)',
+                     (indicator, row_count, content_hash.hexdigest(),
+                      datetime.now(timezone.utc).isoformat(timespec = 'seconds')))
+    return row_count
+
+def __responses_to_sqlite(responses, db_file = db_file, replace = False):
     """
     Bespoke function: outputs all responses for the indicator_data table.
     
     Takes the contents of the responses dict, converts to JSON in sequence, and
-    outputs to a sqlite file.
+    outputs to a sqlite file. Each indicator is checkpointed in the retrieval
+    journal as it's written (see __checkpoint_response).
         
     Parameters
     ----------
     responses : dict
-        The http responses from the WHO API
+        The http responses from the WHO API. Each response is either a single
+        body, or a list of page bodies from paged retrieval
     db_file : str
         Filepath to the database to output to
+    replace : bool
+        If True, 'indicator_data' and the journal are emptied first, so the
+        table holds exactly these responses (e.g. when replaying a snapshot)
     Returns
     -------
     None
     """
-    # Create connection
+    # Create connection, and the 'indicator_data' and 'retrieval_journal' tables
     conn = create_connection(db_file)
+    __create_retrieval_tables(conn)
+    if replace:
+        with conn:
+            conn.execute('DELETE FROM indicator_data')
+            conn.execute('DELETE FROM retrieval_journal')
     
-    # Define the structure of the 'indicator_data' table, with datatypes
-    create_table_sql = """CREATE TABLE IF NOT EXISTS indicator_data (
-                                    ID integer PRIMARY KEY,
-                                    IndicatorCode varchar(100) NOT NULL,
-                                    SpatialDimType varchar(100),
-                                    SpatialDim varchar(20),
-                                    TimeDimType varchar(20),
-                                    TimeDim integer,
-                                    Dim1Type text,
-                                    Dim1 text,
-                                    Dim2Type text,
-                                    Dim2 text,
-                                    Dim3Type text,
-                                    Dim3 text,
-                                    DataSourceDimType text,
-                                    DataSourceDim text,
-                                    Value integer,
-                                    NumericValue decimal,
-                                    Low decimal,
-                                    High decimal,
-                                    Comments text,
-                                    Date datetime,
-                                    TimeDimensionValue int,
-                                    TimeDimensionBegin datetime,
-                                    TimeDimensionEnd datetime
-                   );"""
-    # Create 'indicator_data' table
-    try:
-        cur = conn.cursor()
-        cur.execute(create_table_sql)
-    except Error as e:
-        raise Exception(f'Creating SQLite table failed with error code {e}')
-    
-    # Finally, update table with results from responses
-    for key, response in responses.items():
-        print(f'Inserting data for: {key}')
-        frame = pd.DataFrame(json.loads(response)['value'])
-        frame.to_sql(name = 'data', con = conn, if_exists = 'append', index = False)
+    # Finally, update table with results from responses, an indicator at a time
+    with instrumentation.span('sqlite.responses_to_sqlite') as span:
+        rows = 0
+        for key, response in responses.items():
+            print(f'Inserting data for: {key}')
+            rows += __checkpoint_response(conn, key, response)
+        span.rows_out(rows)
+        span.add(indicators = len(responses))
     
     # Close connection
     conn.close()
@@ -220,7 +345,9 @@ def __dimensions_to_sqlite(dimensions, db_file = db_file, val_is_frame = False):
         else:
             frame = contents
         # Just use inbuilt pandas function to write to SQLite via conn
-        frame.to_sql(name = key, con = conn, index = False)
+        with instrumentation.span('sqlite.write_table', table = key) as span:
+            span.rows_in(len(frame))
+            frame.to_sql(name = key, con = conn, index = False)
     
     conn.close()
     print(f'Outputting to SQLite database: {db_file} <<< DONE')
@@ -265,10 +392,111 @@ def __output_modelled_data(final_frames, out_db_file):
     # Finally, update table with results from responses
     for key, frame in final_frames.items():
         print(f'Outputting:{key}\n{frame}')
-        frame.to_sql(name = key, con = conn, if_exists = 'append', 
-                     index = False)
+        with instrumentation.span('sqlite.write_table', table = key) as span:
+            span.rows_in(len(frame))
+            frame.to_sql(name = key, con = conn, if_exists = 'append', 
+                         index = False)
     print('Data output: COMPLETE')
     # Close connection
     cur.close()
     conn.close()
     return None
+
+def __output_visualisation_data(final_frames, out_db_file):
+    """
+    Outputs the visualisation model with the compact serving schema in
+    create_visualisation_db.sql: integer keys, and the fact tables clustered
+    (WITHOUT ROWID) on (indicator_id, area_id, year, measurement_id)
+    
+    Parameters
+    ----------
+    final_frames : dict (str : pd.DataFrame())
+        A dictionary of table names and data for tables. Frames are written
+        in the order of their primary keys, which is quickest to insert
+    out_db_file : str
+        Filepath to the SQLite file to be output
+    Returns
+    -------
+    None
+    """
+    # Create connection
+    conn = create_connection(out_db_file)
+    create_table_sql = ""
+    for content in open(create_visualisation_script,'r'):
+        create_table_sql += content
+    try:
+        conn.executescript(create_table_sql)
+    except Error as e:
+        raise Exception(f'Creating SQLites table failed with error code {e}')
+    
+    # Check we have the tables the schema defines
+    schema_tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    if not sorted(final_frames.keys()) == sorted(schema_tables):
+        raise Exception('Expected a different set of tables. Please review.')
+    
+    for key, frame in final_frames.items():
+        print(f'Outputting: {key}')
+        with instrumentation.span('sqlite.write_table', table = key) as span:
+            span.rows_in(len(frame))
+            frame.to_sql(name = key, con = conn, if_exists = 'append', index = False)
+    conn.close()
+    print(f'Outputting to SQLite database: {out_db_file} <<< DONE')
+    return None
+
+def __upsert_modelled_data(final_frames, out_db_file, indicator_ids):
+    """
+    Incremental counterpart to __output_modelled_data, for a model that already
+    exists. In one transaction: the measurements of indicator_ids (and their
+    comments, parameters and datasource links) are deleted and the new rows
+    inserted, and the dimension tables are replaced whole. So a failed run
+    leaves the model as it was
+    
+    Parameters
+    ----------
+    final_frames : dict (str : pd.DataFrame())
+        As for __output_modelled_data, but the measurement tables only hold the
+        rows of the changed indicators
+    out_db_file : str
+        Filepath to the existing modelled SQLite file
+    indicator_ids : array-like
+        The indicator_ids being replaced: changed, new and removed indicators
+    Returns
+    -------
+    None
+    """
+    tables = list(final_frames.keys())
+    if not tables == ['comments','results_to_parameters', 'parameters', 'indicator_info', 
+                      'categories', 'datasources', 'datasource_bridge_table', 'areas', 'values_table']:
+        raise Exception('Expected a different set of tables. Please review.')
+    measurement_tables = ['comments', 'results_to_parameters', 'datasource_bridge_table']
+    
+    conn = create_connection(out_db_file)
+    try:
+        with conn:
+            conn.execute('CREATE TEMP TABLE replaced_indicators (indicator_id integer PRIMARY KEY)')
+            conn.executemany('INSERT OR IGNORE INTO replaced_indicators VALUES (?)', [(int(x),) for x in indicator_ids])
+            conn.execute("""CREATE TEMP TABLE replaced_measurements AS
+                                SELECT measurement_id FROM values_table
+                                WHERE indicator_id IN (SELECT indicator_id FROM replaced_indicators)""")
+            conn.execute('CREATE INDEX temp.replaced_measurements_id ON replaced_measurements (measurement_id)')
+            for table in measurement_tables:
+                conn.execute(f"""DELETE FROM {table}
+                                 WHERE measurement_id IN (SELECT measurement_id FROM replaced_measurements)""")
+            conn.execute('DELETE FROM values_table WHERE indicator_id IN (SELECT indicator_id FROM replaced_indicators)')
+            for table in tables:
+                if table not in measurement_tables + ['values_table']:
+                    conn.execute(f'DELETE FROM {table}')
+            
+            # executemany rather than to_sql, which commits part way through
+            for key, frame in final_frames.items():
+                with instrumentation.span('sqlite.upsert_table', table = key) as span:
+                    span.rows_in(len(frame))
+                    rows = frame.astype(object).where(frame.notna(), None).itertuples(index = False, name = None)
+                    conn.executemany(f"""INSERT INTO {key} ({', '.join(frame.columns)}) """
+                                     f"""VALUES ({', '.join('?' * len(frame.columns))})""", rows)
+        print(f'Data upserted for {len(indicator_ids)} indicators: COMPLETE')
+    finally:
+        conn.execute('DROP TABLE IF EXISTS temp.replaced_measurements')
+        conn.execute('DROP TABLE IF EXISTS temp.replaced_indicators')
+        conn.close()
+    return None
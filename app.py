@@ -11,7 +11,10 @@ import dash_core_components as dcc
 import dash_html_components as html
 import plotly.express as px
 import plotly.graph_objects as go
+import numpy as np
 
+import functools
+import time
 import sys
 sys.path.append('/Users/matthew.mcfahn/Documents/GitHub/who-api-analysis')
 sys.path.append('/Users/matthew.mcfahn/Documents/GitHub/who-api-analysis/99_Shared')
@@ -20,16 +23,37 @@ sys.path.append('/Users/matthew.mcfahn/Documents/GitHub/who-api-analysis/99_Shar
 ##############################################################################
 #   - Setup data needed for app, and helper functions from database connection
 ##############################################################################
-from dash_data_extraction import __get_years_tickvals, db_file, get_static_data_assets, __get_available_areas, __get_linegraph_data, __get_worldmap_data, __get_parameter_types_for_ind, __get_param_options
+from dash_data_extraction import __get_years_tickvals, db_file, __get_db_version, get_static_snapshot, __get_available_areas, __get_linegraph_data, __get_worldmap_data, __get_parameter_values_for_ind, __get_comparison_data
+from dash_server_helpers import configure_server, get_session_id, skip_payload_cache
+from dash_export import register_export
+from dash_async_data import run_queries, QueryCancelled, QueryTimeout
 
+# Static assets are loaded lazily, on first use (or once in the gunicorn master
+# via load_static_assets(), so workers share them through fork). They're cached
+# per database version, so a rebuilt database is picked up without a restart
+@functools.lru_cache(maxsize = 1)
+def __load_static_assets(db_version):
+    """Helper: load the static snapshot for this version of the database"""
+    print('[DATA LOAD] Loading static assets...')
+    start = time.time()
+    snapshot = get_static_snapshot(db_file)
+    print(f'[DATA LOAD] Complete in {round(time.time() - start, 3)} seconds')
+    return snapshot
 
-print('[DATA LOAD] Loading static assets...')
-indicators, categories, areas = get_static_data_assets(db_file)
+def load_static_assets():
+    """
+    Returns the static assets for the app: a dict of the 'indicators',
+    'categories', 'areas' and 'parameters' dimension frames, 'options' for the
+    dropdowns, and 'lookups' between codes and ids
+    """
+    return __load_static_assets(__get_db_version(db_file))
 
-indicators_dict = [{'label': indicators.loc[i]['indicator_name'], 'value': indicators.loc[i]['indicator_code']} for i in indicators.index]
-areas_dict = [{'label': areas.loc[i]['area_name'], 'value': areas.loc[i]['area_code']} for i in areas.index]
-categories_dict = [{'label':categories.category_name[i], 'value':categories.category_name[i]} for i in categories.category_name.index]
-print('[DATA LOAD] Complete <<< Launching app')
+def __parameter_value_ids(param_value):
+    """Helper: the parameter_value_ids with this value (of any parameter type)"""
+    if not param_value:
+        return None
+    parameters = load_static_assets()['parameters']
+    return list(parameters.loc[parameters['parameter_value'] == param_value, 'parameter_value_id'])
 
 ##############################################################################
 #   - Setup data needed for app
@@ -38,13 +62,14 @@ print('[DATA LOAD] Complete <<< Launching app')
 ##############################################################################
 #   - Main Dash app functions
 ##############################################################################
-# Initalise Dash app  class
-app = dash.Dash(__name__)
+# Initalise Dash app  class. Compression is configured on the server below, rather than by Dash
+app = dash.Dash(__name__, compress = False)
 app.title = 'World Health Organisation: Dash data explorer'
-def main():
-    """Just testing"""
-    # Set defaults to be loaded    
-    app.layout = html.Div( # First \div element
+server = configure_server(app.server, db_file)
+server = register_export(server)
+def __build_layout(options):
+    """Builds the app layout, with the given dropdown options"""
+    layout = html.Div( # First \div element
     
     children=[
               html.Div(className='row',  # Define the row element. This'll have two cols
@@ -54,7 +79,7 @@ def main():
                                                      style={'marginBottom': 0, 'marginTop': 0}),
                                              html.Div([html.Label(['Choose category:'],style={'font-weight': 'bold', "text-align": "left"}),
                                                        dcc.Dropdown(id='category_dropdown',
-                                                                    options=categories_dict,
+                                                                    options=options['categories'],
                                                                     optionHeight=65,                    #height/space between dropdown options
                                                                     value="Mortality and Global Health Estimates",#dropdown value selected automatically when page loads
                                                                     disabled=False,                     #disable dropdown value selection
@@ -71,7 +96,7 @@ def main():
                                              html.Div([html.Label(['Choose indicator:'],style={'font-weight': 'normal', "text-align": "left"}),
                                                        
                                                        dcc.Dropdown(id='indicator_dropdown',
-                                                                    options=indicators_dict,
+                                                                    options=options['indicators'],
                                                                     optionHeight=65,                    #height/space between dropdown options
                                                                     value='WHOSIS_000014',              #dropdown value selected automatically when page loads
                                                                     disabled=False,                     #disable dropdown value selection
@@ -147,7 +172,7 @@ def main():
                                                                 html.Div([html.Label(['Choose area:'],style={'font-weight': 'bold', "text-align": "left"}),
                                                       
                                                                           dcc.Dropdown(id='area_dropdown',
-                                                                                       options=areas_dict,
+                                                                                       options=options['areas'],
                                                                                        optionHeight=65,                    #height/space between dropdown options
                                                                                        value='GBR',                        #dropdown value selected automatically when page loads
                                                                                        disabled=False,                     #disable dropdown value selection
@@ -160,6 +185,25 @@ def main():
                                                                                        ),                                  #'memory': browser tab is refreshed
                                                                           ],className='DropDown'),
                                                                 dcc.Graph(id ='single_country_graph',className = 'Graph'),
+                                                                
+                                                                html.H2(children ="Country comparison: Compare several countries over time"),
+                                                                
+                                                                html.Div([html.Label(['Choose areas:'],style={'font-weight': 'bold', "text-align": "left"}),
+                                                      
+                                                                          dcc.Dropdown(id='compare_area_dropdown',
+                                                                                       options=options['areas'],
+                                                                                       optionHeight=65,                    #height/space between dropdown options
+                                                                                       value=['GBR', 'FRA', 'USA'],        #dropdown values selected automatically when page loads
+                                                                                       disabled=False,                     #disable dropdown value selection
+                                                                                       multi=True,                         #allow multiple dropdown values to be selected
+                                                                                       searchable=True,                    #allow user-searching of dropdown values
+                                                                                       search_value='',                    #remembers the value searched in dropdown
+                                                                                       placeholder='Please select...',     #gray, default text shown when no option is selected
+                                                                                       clearable=True,                     #allow user to removes the selected value
+                                                                                       style={'width':"100%"},              #use dictionary to define CSS styles of your dropdown
+                                                                                       ),
+                                                                          ],className='DropDown'),
+                                                                dcc.Graph(id ='comparison_graph',className = 'Graph'),
                                                                 ], style = {'backgroundColor':'rgb(50, 50, 50)'}
                                                       )
                                              ],
@@ -169,6 +213,25 @@ def main():
               ]
     )
     
+    return layout
+
+def __serve_layout():
+    """Builds the app layout. Served lazily, so dropdown options come from the
+    static assets snapshot on first page load rather than at import"""
+    return __build_layout(load_static_assets()['options'])
+
+# Dash calls a layout function when it's set, to validate callbacks against it,
+# unless it has a validation layout. Give it one without any options, so
+# setting the layout here doesn't load the static assets at import
+app.validation_layout = __build_layout({'categories': [], 'indicators': [], 'areas': []})
+app.layout = __serve_layout
+
+def main(debug = True):
+    """
+    Runs the app on the development server. In production the WSGI entry point
+    is 'server' (see the Procfile and gunicorn.conf.py) and this isn't called
+    """
+    app.run_server(debug = debug)
     return None
 
 ###############################################################################
@@ -177,6 +240,7 @@ def main():
 ### - Callback: Update area and parameter options, based on indicator
 @app.callback(
     dash.dependencies.Output('area_dropdown', 'options'),
+    dash.dependencies.Output('compare_area_dropdown', 'options'),
     dash.dependencies.Output('parameter_type_dropdown_div', 'style'),
     dash.dependencies.Output('parameter_dropdown_div', 'style'),
     dash.dependencies.Output('parameter_type_dropdown', 'options'),
@@ -184,27 +248,40 @@ def main():
 
 def __restrict_areas_dropdown_add_param_dropdowns(ind_code):
     """Restrict to only areas with a value, and update parameter types. Needs to:
-        > Update areas options
+        > Update areas options (for the single country and comparison graphs)
         > Update parameter_type dropdown visibility
         > Update parameter_type dropdown OPTIONS
         > Update parameter dropdown visibility
         """
-    # Find present country codes, update areas_dict using this
-    area_codes = __get_available_areas(ind_code)
-    cut_areas = areas.loc[areas['area_code'].isin(area_codes)]
+    # Find present countries, update areas_dict using this
+    assets = load_static_assets()
+    areas, parameters = assets['areas'], assets['parameters']
+    # A cleared indicator leaves the options as they were
+    if ind_code not in assets['lookups']['indicator_id'].index:
+        raise dash.exceptions.PreventUpdate
+    ind_id = assets['lookups']['indicator_id'][ind_code]
+    queries = {'areas': functools.partial(__get_available_areas, ind_id),
+               'parameter_values': functools.partial(__get_parameter_values_for_ind, ind_id)}
+    try:
+        data = run_queries(queries, session_id = get_session_id(), channel = 'dropdowns')
+    except QueryCancelled:
+        raise dash.exceptions.PreventUpdate
+    area_ids = data['areas']
+    cut_areas = areas.loc[areas['area_id'].isin(area_ids)]
     cut_areas = cut_areas.sort_values(by = 'area_code').reset_index(drop = True)
     areas_dict = [{'label': cut_areas.loc[i]['area_name'], 'value': cut_areas.loc[i]['area_code']} for i in cut_areas.index]
     
     # Update visibility based on whether there are any parameter_type options
-    param_types = __get_parameter_types_for_ind(ind_code)
-    if param_types.empty:
+    param_types = parameters.loc[parameters['parameter_value_id'].isin(data['parameter_values']),
+                                 'parameter_name'].unique()
+    if len(param_types) == 0:
         style = {"display":"none"}
         param_type_dict = [{'label':0,'value':0}]
     else:
         style = {"display":"block"}
-        param_type_dict = [{'label':x,'value':x} for x in param_types['parameter_name'].values]
+        param_type_dict = [{'label':x,'value':x} for x in param_types]
     
-    return areas_dict, style, style, param_type_dict
+    return areas_dict, areas_dict, style, style, param_type_dict
 
 ### - Callback: Update indicator options, based on category
 @app.callback(
@@ -214,7 +291,8 @@ def __restrict_areas_dropdown_add_param_dropdowns(ind_code):
 
 def __restrict_indicator_dropdown(category_name):
     """Restrict to only indicators with a value"""
-    cut_indicators = indicators.loc[indicators['category_name'] == category_name]
+    indicators = load_static_assets()['indicators']
+    cut_indicators = indicators.loc[(indicators['category_name'] == category_name) & (indicators['has_main_measure'] == 1)]
     
     indicators_dict = [{'label': cut_indicators.loc[i]['indicator_name'], 'value': cut_indicators.loc[i]['indicator_code']} for i in cut_indicators.index]
     return indicators_dict
@@ -227,9 +305,10 @@ def __restrict_indicator_dropdown(category_name):
 
 def __get_paramater_options(param_name):
     """Helper to get parameter options given the parameter name selected"""
-    data = __get_param_options(param_name)
+    parameters = load_static_assets()['parameters']
+    values = parameters.loc[parameters['parameter_name'] == param_name, 'parameter_value'].unique()
     
-    params_dict = [{'label':x,'value':x} for x in data['parameter_value'].values]
+    params_dict = [{'label':x,'value':x} for x in values]
     return params_dict
 
 ### - Callback: Update parameter value based on new indicator
@@ -250,103 +329,98 @@ def __overwrite_param_value(ind_code):
 ###############################################################################
 # - Callbacks to update graphics
 ###############################################################################
-### - Callback: Update line graph, based on inputs
-@app.callback(
-    dash.dependencies.Output(component_id = 'single_country_graph', component_property = 'figure'),
-    [dash.dependencies.Input(component_id = 'area_dropdown', component_property = 'value'),
-     dash.dependencies.Input(component_id = 'indicator_dropdown', component_property = 'value'),
-     dash.dependencies.Input(component_id = 'parameter_dropdown', component_property = 'value'),
-     ])
+### - Pre-built figure parts
+# The fixed parts of each figure (layouts with the default template, trace
+# styles) are built and validated once, here. Each render copies them into a
+# plain dict figure with its data, skipping graph_objects' validation of every
+# property, which was most of the callbacks' CPU time
+def __base_layout(**layout):
+    """Helper: a validated layout dict, including the default template"""
+    return go.Figure(layout = go.Layout(**layout)).to_dict()['layout']
+
+background = dict(plot_bgcolor='#ced4da', paper_bgcolor='#ced4da')
+message_layout = __base_layout()
+line_layout = __base_layout(xaxis_title='Year', yaxis_title='Value', xaxis_tickmode='array', **background)
+bar_layout = __base_layout(barmode='group', xaxis_title='Area', yaxis_title='Value', **background)
+globe_layout = __base_layout(geo=dict(showframe=False,
+                                      showcoastlines=False,
+                                      projection_type='equirectangular'
+                                      ),
+                             **background)
+line_trace = go.Scatter(line=dict(color='rgb(0,100,80)'),
+                        mode='lines',
+                        name='Value',
+                        hovertemplate='Value: %{y:.1f}'+'<br>Year: %{x}').to_plotly_json()
+band_trace = go.Scatter(fill='toself',
+                        fillcolor='rgba(0,100,80,0.2)',
+                        line=dict(color='rgba(255,255,255,0)'),
+                        showlegend=True,
+                        name='Low & high bounds',
+                        hoverinfo='skip').to_plotly_json()
+bar_trace = go.Bar(name='SF Zoo').to_plotly_json()
+comparison_layout = __base_layout(xaxis_title='Year', yaxis_title='Value', hovermode='x unified', **background)
+comparison_trace = go.Scatter(mode='lines+markers',
+                              hovertemplate='%{y:.1f}').to_plotly_json()
+globe_trace = go.Choropleth(colorscale = 'Blues',
+                            autocolorscale=False,
+                            reversescale=False,
+                            marker_line_color='darkgray',
+                            marker_line_width=0.5,
+                            colorbar_title = 'Value',
+                            hoverinfo = 'text').to_plotly_json()
 
-def __update_lineplot(area_code, ind_code, param_value):
-    """Helper to render a lineplot for the area and indicator"""
+def __message_figure(message, areas = None):
+    """Helper: an empty figure (or world map of areas) with a message on it"""
+    data = [] if areas is None else [{'type': 'choropleth', 'locations': areas['area_code'].to_numpy()}]
+    return {'data': data, 'layout': {**message_layout, 'annotations': [{'text': message}]}}
+
+def __lineplot_figure(data, area_code, ind_code, param_value):
+    """Helper to render a lineplot for the area and indicator, from the
+    {'year', 'numeric_value', 'low', 'high'} arrays of __get_linegraph_data"""
+    assets = load_static_assets()
+    areas, indicators = assets['areas'], assets['indicators']
     area_name = areas.loc[areas['area_code'] ==area_code].reset_index(drop=True).loc[0]['area_name']
     ind_name = indicators.loc[indicators['indicator_code'] ==ind_code].reset_index(drop=True).loc[0]['indicator_name']
     
-    # Read the data
-    data = __get_linegraph_data(area_code, ind_code, param_value)
-    if data.empty:
-        fig = go.Figure()
-        fig.add_annotation(text = """No data for the selected area and indicator""")
-        return fig
+    if len(data['year']) == 0:
+        return __message_figure("""No data for the selected area and indicator""")
     
     if not param_value:
         title = f"""{area_name}: <br>{ind_name}"""
     else:
         title = f"""{area_name}: <br>{ind_name} - {param_value}"""
     
-    years = data['year'].unique()
+    years = np.unique(data['year'])
     if len(years) > 1:
-        x = list(data["year"])
-        y = list(data["numeric_value"])
-        y_lower = list(data["low"])
-        y_upper = list(data["high"])
-        
-        fig = go.Figure([
-                go.Scatter(
-                           x=x,
-                           y=y,
-                           line=dict(color='rgb(0,100,80)'),
-                           mode='lines',
-                           name='Value',
-                           hovertemplate='Value: %{y:.1f}'+'<br>Year: %{x}')
-                ,
-                go.Scatter(
-                           x=x+x[::-1], # x, then x reversed
-                           y=y_upper+y_lower[::-1], # upper, then lower reversed
-                           fill='toself',
-                           fillcolor='rgba(0,100,80,0.2)',
-                           line=dict(color='rgba(255,255,255,0)'),
-                           showlegend=True,
-                           name='Low & high bounds',
-                           hoverinfo='skip')
-                       ])
-        fig.update_layout(xaxis_title='Year',
-                          yaxis_title='Value',
-                          title = title,
-                          xaxis = dict(tickmode = 'array',
-                                       tickvals = __get_years_tickvals(years)),
-                          plot_bgcolor='#ced4da',
-                          paper_bgcolor='#ced4da'
-                          )
+        x = data["year"]
+        traces = [{**line_trace, 'x': x, 'y': data["numeric_value"]},
+                  {**band_trace,
+                   'x': np.concatenate([x, x[::-1]]), # x, then x reversed
+                   'y': np.concatenate([data["high"], data["low"][::-1]])}] # upper, then lower reversed
+        layout = {**line_layout, 'title': {'text': title},
+                  'xaxis': {**line_layout['xaxis'], 'tickvals': __get_years_tickvals(years)}}
     else:
-        y = data[['low','numeric_value','high']].reset_index(drop = True)
-        y = list(y.loc[0])
-        groups = ['Low','Estimate','High']
-        fig = go.Figure(data=[
-                        go.Bar(name='SF Zoo', x=groups, y=y)
-                        ])
-        # Change the bar mode
-        fig.update_layout(barmode='group',
-                          xaxis_title='Area',
-                          yaxis_title='Value',
-                          title = title,
-                          plot_bgcolor='#ced4da',
-                          paper_bgcolor='#ced4da'
-                          )
-    return fig
-
-### - Callback: Update world graph, based on inputs
-@app.callback(
-    dash.dependencies.Output(component_id = 'globe_graph', component_property = 'figure'),
-     [dash.dependencies.Input(component_id = 'indicator_dropdown', component_property = 'value'),
-      dash.dependencies.Input(component_id = 'parameter_dropdown', component_property = 'value'),
-     ])
+        y = [data['low'][0], data['numeric_value'][0], data['high'][0]]
+        traces = [{**bar_trace, 'x': ['Low','Estimate','High'], 'y': y}]
+        layout = {**bar_layout, 'title': {'text': title}}
+    return {'data': traces, 'layout': layout}
 
-def __update_globe_graphic(ind_code, param_value):
+def __globe_figure(data, ind_code, param_value):
     """Helper to render a world heat map based on the indicator selected"""
+    assets = load_static_assets()
+    areas, indicators = assets['areas'], assets['indicators']
     indicator_name = indicators.loc[indicators['indicator_code'] == ind_code].reset_index(drop = True).loc[0].indicator_name
     
-    data = __get_worldmap_data(ind_code, param_value)
+    lookups = assets['lookups']
+    data['area_code'] = data['area_id'].map(lookups['area_code'])
+    data['area_name'] = data['area_id'].map(lookups['area_name'])
     data.drop_duplicates(subset = ['area_code','year','numeric_value'], inplace = True)
     # Deal with no data cases. This does sometimes happen unfortunately (as data is available at a more granular level)
     if data.empty:
-        fig = go.Figure(data = go.Choropleth(locations = areas['area_code']))
-        fig.add_annotation(text = 'No data available at the top level. Select a lower granularity')
-        return fig
+        return __message_figure('No data available at the top level. Select a lower granularity', areas)
     
     # Cut to just the latest year for all areas. Could pass this upstream into the SQL, but it's easier to handle the edge case here 
-    if list(data.year.unique()) == [None]:
+    if data['year'].isna().all():
         max_year = 'Unknown'
     else:
         max_year = int(data['year'].max())
@@ -358,33 +432,115 @@ def __update_globe_graphic(ind_code, param_value):
     else:
         title_text=f'{indicator_name} - {param_value}: <br>Data up to {max_year}'
         
-    text = 'Country: ' + data['area_name'] + '<br>Year: ' +\
+    text = ('Country: ' + data['area_name'] + '<br>Year: ' +\
             data['year'].astype(int).astype(str) +\
-                '<br>Value: ' + data['numeric_value'].round(1).astype(str)
+                '<br>Value: ' + data['numeric_value'].round(1).astype(str)).to_numpy()
     
-    fig = go.Figure(data=go.Choropleth(locations = data['area_code'],
-                                       z = data['numeric_value'],
-                                       text = text,
-                                       colorscale = 'Blues',
-                                       autocolorscale=False,
-                                       reversescale=False,
-                                       marker_line_color='darkgray',
-                                       marker_line_width=0.5,
-                                       colorbar_title = 'Value',
-                                       hovertext = text,
-                                       hoverinfo = 'text'
-                                       )
-                    )
-    fig.update_layout(title_text=title_text,
-                      geo=dict(showframe=False,
-                               showcoastlines=False,
-                               projection_type='equirectangular'
-                               ),
-                      plot_bgcolor='#ced4da',
-                      paper_bgcolor='#ced4da'
-                     )
+    trace = {**globe_trace,
+             'locations': data['area_code'].to_numpy(),
+             'z': data['numeric_value'].to_numpy(),
+             'text': text,
+             'hovertext': text}
+    return {'data': [trace], 'layout': {**globe_layout, 'title': {'text': title_text}}}
+
+### - Callback: Update line graph and world map, based on inputs
+@app.callback(
+    dash.dependencies.Output(component_id = 'single_country_graph', component_property = 'figure'),
+    dash.dependencies.Output(component_id = 'globe_graph', component_property = 'figure'),
+    [dash.dependencies.Input(component_id = 'area_dropdown', component_property = 'value'),
+     dash.dependencies.Input(component_id = 'indicator_dropdown', component_property = 'value'),
+     dash.dependencies.Input(component_id = 'parameter_dropdown', component_property = 'value'),
+     ])
+
+def __update_graphs(area_code, ind_code, param_value):
+    """
+    Helper to render the line graph and world map. Both queries run at once,
+    and are cancelled if the user changes a dropdown again before they finish.
+    NOTE: Both are always rendered. Dash drops the response of a callback
+    that's been requested again, so a world map left out on an area change
+    would be lost if it replaced an indicator change still in flight
+    """
+    lookups = load_static_assets()['lookups']
+    # The dropdowns are clearable, so either code can be None
+    if ind_code not in lookups['indicator_id'].index:
+        message = 'Select an indicator'
+        return __message_figure(message), __message_figure(message, load_static_assets()['areas'])
+    ind_id = lookups['indicator_id'][ind_code]
+    parameter_value_ids = __parameter_value_ids(param_value)
+    queries = {'worldmap': functools.partial(__get_worldmap_data, ind_id, parameter_value_ids)}
+    if area_code in lookups['area_id'].index:
+        queries['linegraph'] = functools.partial(__get_linegraph_data, lookups['area_id'][area_code], ind_id, parameter_value_ids)
+    try:
+        data = run_queries(queries, session_id = get_session_id(), channel = 'graphs')
+    except QueryCancelled:
+        raise dash.exceptions.PreventUpdate
+    except QueryTimeout:
+        # Transient, so not cached against these inputs
+        skip_payload_cache()
+        message = 'This is taking too long to load. Please try again'
+        return __message_figure(message), __message_figure(message, load_static_assets()['areas'])
     
-    return fig
+    if 'linegraph' in data:
+        lineplot = __lineplot_figure(data['linegraph'], area_code, ind_code, param_value)
+    else:
+        lineplot = __message_figure('Select an area')
+    return lineplot, __globe_figure(data['worldmap'], ind_code, param_value)
+
+def __comparison_figure(groups, ind_code, param_value):
+    """Helper to render a line per area (and parameter value), from the grouped
+    arrays of __get_comparison_data"""
+    assets = load_static_assets()
+    indicators, parameters = assets['indicators'], assets['parameters']
+    ind_name = indicators.loc[indicators['indicator_code'] == ind_code].reset_index(drop = True).loc[0]['indicator_name']
+    
+    if not groups:
+        return __message_figure('No data for the selected areas and indicator')
+    
+    # A value can belong to several parameter types, so name the lines by both when it does
+    parameter_names = dict(zip(parameters['parameter_value_id'], parameters['parameter_name']))
+    several_types = len({key[2] for key in groups}) > 1
+    traces = []
+    for (_, area_id, parameter_value_id), data in groups.items():
+        name = assets['lookups']['area_name'][area_id]
+        if several_types:
+            name = f'{name} ({parameter_names[parameter_value_id]})'
+        traces += [{**comparison_trace, 'x': data['year'], 'y': data['numeric_value'], 'name': name}]
+    years = np.unique(np.concatenate([data['year'] for data in groups.values()]))
+    
+    title = f'{ind_name}' if not param_value else f'{ind_name} - {param_value}'
+    layout = {**comparison_layout, 'title': {'text': title},
+              'xaxis': {**comparison_layout['xaxis'], 'tickmode': 'array', 'tickvals': __get_years_tickvals(years)}}
+    return {'data': traces, 'layout': layout}
+
+### - Callback: Update comparison graph, based on inputs
+@app.callback(
+    dash.dependencies.Output(component_id = 'comparison_graph', component_property = 'figure'),
+    [dash.dependencies.Input(component_id = 'compare_area_dropdown', component_property = 'value'),
+     dash.dependencies.Input(component_id = 'indicator_dropdown', component_property = 'value'),
+     dash.dependencies.Input(component_id = 'parameter_dropdown', component_property = 'value'),
+     ])
+
+def __update_comparison(area_codes, ind_code, param_value):
+    """Helper to render the comparison graph for the areas and indicator. All
+    the areas come from one query, however many are selected"""
+    lookups = load_static_assets()['lookups']
+    if ind_code not in lookups['indicator_id'].index:
+        return __message_figure('Select an indicator')
+    area_ids = [lookups['area_id'][code] for code in (area_codes or []) if code in lookups['area_id'].index]
+    if not area_ids:
+        return __message_figure('Select areas to compare')
+    
+    queries = {'comparison': functools.partial(__get_comparison_data, area_ids, [lookups['indicator_id'][ind_code]],
+                                               __parameter_value_ids(param_value))}
+    try:
+        data = run_queries(queries, session_id = get_session_id(), channel = 'comparison')
+    except QueryCancelled:
+        raise dash.exceptions.PreventUpdate
+    except QueryTimeout:
+        skip_payload_cache()
+        return __message_figure('This is taking too long to load. Please try again')
+    return __comparison_figure(data['comparison'], ind_code, param_value)
+
 ###############################################################################
 # - Callbacks to update graphics
 ###############################################################################
@@ -393,5 +549,4 @@ def __update_globe_graphic(ind_code, param_value):
 
 # Startup app on running module
 if __name__ == "__main__":
-    main()
-    app.run_server(debug=True)
\ No newline at end of file
+    main()
\ No newline at end of file
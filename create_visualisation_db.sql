@@ -0,0 +1,100 @@
+CREATE TABLE IF NOT EXISTS value_table (
+	indicator_id integer NOT NULL,
+	area_id integer NOT NULL,
+	year integer NOT NULL,
+	measurement_id integer NOT NULL,
+	measurement_value text,
+	numeric_value real,
+	low real,
+	high real,
+	PRIMARY KEY (indicator_id, area_id, year, measurement_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS granular_table (
+	indicator_id integer NOT NULL,
+	area_id integer NOT NULL,
+	year integer NOT NULL,
+	measurement_id integer NOT NULL,
+	measurement_value text,
+	numeric_value real,
+	low real,
+	high real,
+	PRIMARY KEY (indicator_id, area_id, year, measurement_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS results_to_parameters (
+	parameter_value_id integer NOT NULL,
+	measurement_id integer NOT NULL,
+	PRIMARY KEY (parameter_value_id, measurement_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS indicator_to_parameters (
+	indicator_id integer NOT NULL,
+	parameter_value_id integer NOT NULL,
+	PRIMARY KEY (indicator_id, parameter_value_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollups (
+	indicator_id integer NOT NULL,
+	group_id integer NOT NULL,
+	parameter_value_id integer NOT NULL,
+	year integer NOT NULL,
+	country_count integer NOT NULL,
+	mean_value real,
+	median_value real,
+	min_value real,
+	max_value real,
+	PRIMARY KEY (indicator_id, group_id, parameter_value_id, year)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_groups (
+	group_id integer NOT NULL,
+	group_type text NOT NULL,
+	group_code text NOT NULL,
+	group_name text,
+	PRIMARY KEY (group_id)
+);
+CREATE TABLE IF NOT EXISTS parameter_values (
+	parameter_value_id integer NOT NULL,
+	parameter_id integer NOT NULL,
+	parameter_value text NOT NULL,
+	PRIMARY KEY (parameter_value_id)
+);
+CREATE TABLE IF NOT EXISTS parameters (
+	parameter_id integer NOT NULL,
+	parameter_name text NOT NULL,
+	PRIMARY KEY (parameter_id)
+);
+CREATE TABLE IF NOT EXISTS indicators (
+	indicator_id integer NOT NULL,
+	indicator_code text NOT NULL,
+	indicator_name text,
+	category_id integer NOT NULL,
+	PRIMARY KEY (indicator_id)
+);
+CREATE TABLE IF NOT EXISTS categories (
+	category_id integer NOT NULL,
+	category_name text NOT NULL,
+	PRIMARY KEY (category_id)
+);
+CREATE TABLE IF NOT EXISTS areas (
+	area_id integer NOT NULL,
+	area_code text NOT NULL,
+	area_name text,
+	PRIMARY KEY (area_id)
+);
+CREATE TABLE IF NOT EXISTS datasource_bridge_table (
+	matching_id integer NOT NULL,
+	datasource_id integer NOT NULL,
+	measurement_id integer NOT NULL,
+	PRIMARY KEY (matching_id)
+);
+CREATE TABLE IF NOT EXISTS datasources (
+	datasource_id integer NOT NULL,
+	datasource_code text NOT NULL,
+	display text,
+	source_url text,
+	description text,
+	PRIMARY KEY (datasource_id)
+);
+CREATE TABLE IF NOT EXISTS comments (
+	comment_id integer NOT NULL,
+	measurement_id integer NOT NULL,
+	comments text NOT NULL,
+	PRIMARY KEY (comment_id)
+);
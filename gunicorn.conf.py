@@ -0,0 +1,50 @@
+"""
+ gunicorn configuration for serving the Dash app in production:
+     gunicorn app:server --preload --config gunicorn.conf.py
+ 
+ The app is imported once in the master process ('--preload'), and the static
+ assets loaded there, so all workers share them through fork (copy-on-write).
+ Workers and threads are configurable through environment variables:
+     > WEB_CONCURRENCY: number of worker processes
+     > GUNICORN_THREADS: threads per worker (gthread worker class)
+     > PORT: the port to bind to
+ Query metrics from all workers are added up through WHO_METRICS_DIR (see
+ 99_Shared/query_metrics.py), which defaults to a directory per port.
+ 
+ -----------------------------------
+ Created on Mon Oct 19 11:36:51 2026
+ @author: matthew.mcfahn
+"""
+
+import gc
+import multiprocessing
+import tempfile
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8050')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+# Set before the app is preloaded, so query_metrics picks it up
+os.environ.setdefault('WHO_METRICS_DIR', os.path.join(tempfile.gettempdir(), f"who-query-metrics-{os.environ.get('PORT', '8050')}"))
+
+def on_starting(server):
+    """
+    Runs in the master after the app has been preloaded, before any workers
+    are forked. Loads the static assets once, then freezes the garbage 
+    collector so the shared objects aren't touched (and so copied) by each
+    worker's garbage collection. Also clears the query metrics of any previous
+    run, so they start from zero
+    """
+    import app
+    import query_metrics
+    query_metrics.reset()
+    app.load_static_assets()
+    gc.collect()
+    gc.freeze()
+    server.log.info('[DATA LOAD] Static assets loaded in master, shared with workers')
+    return None
@@ -0,0 +1,286 @@
+"""
+ Orchestrates the data pipeline, from the staged retrieval database through
+ to the visualisation database the app reads:
+
+     [replay] -> cleaning -> modelling -> visualisation
+
+ Each stage declares its input and output files (including the code and rules
+ it runs), and the stages form a DAG by matching outputs to inputs. A stage is
+ skipped when the content fingerprints of its inputs and outputs match those
+ recorded the last time it ran, in a JSON state file. Stages whose inputs are
+ ready run concurrently, each in its own process, so wall time and peak RSS are
+ reported per stage and memory is handed back between stages.
+
+ Retrieval itself (network) isn't a stage: the staged database is the source.
+ Use --replay to rebuild it from the payload archive first.
+
+ Usage:
+     python pipeline.py [--stages cleaning modelling] [--force] [--replay [SNAPSHOT]] [--dry-run]
+
+ -----------------------------------
+ Created on Mon Oct 19 15:11:46 2026
+ @author: matthew.mcfahn
+"""
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+import multiprocessing
+import importlib
+import argparse
+import hashlib
+import shutil
+import json
+import time
+import sys
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+repo_root = os.path.dirname(os.path.abspath(__file__))
+for folder in ['1_Retrieval', '2_Cleaning', '3_Modelling', '99_Shared']:
+    path = os.path.join(repo_root, folder)
+    if path not in sys.path:
+        sys.path.append(path)
+
+import payload_archive
+import sqlite_helpers
+import cleaning
+import modelling_main
+import visualisation_model
+
+state_file = f'{sqlite_helpers.outdir}/pipeline_state.json'
+fingerprint_chunk = 1024 * 1024
+
+def __code(*paths):
+    """Helper: absolute paths of source files in the repo"""
+    return [os.path.join(repo_root, path) for path in paths]
+
+# The stage DAG. 'run' is (module, function), called as function(*args) in a child
+# process, and must write 'outputs'. Outputs are written to a temporary file and
+# moved into place, so a failed stage never leaves a half written database behind.
+# 'in_place' stages (replay) update their output directly, with arguments (input, output).
+# 'kwargs' are passed on to the function, and 'copy_previous' stages start from a copy
+# of their last output (modelling updates it incrementally)
+stages = {'replay': {'run': ('data_retrieval', 'replay_snapshot'),
+                     'inputs': __code('1_Retrieval/data_retrieval.py', '99_Shared/payload_archive.py',
+                                      '99_Shared/sqlite_helpers.py'),
+                     'outputs': [cleaning.db_file],
+                     'in_place': True},
+          'cleaning': {'run': ('cleaning', 'main'),
+                       'inputs': [cleaning.db_file] + __code('2_Cleaning/cleaning.py', '2_Cleaning/regex_cleaning.py',
+                                                             '2_Cleaning/indicator_rules.json',
+                                                             '1_Retrieval/data_sources_scraping.py',
+                                                             '99_Shared/who_helpers.py'),
+                       'outputs': [cleaning.out_db_file]},
+          'modelling': {'run': ('modelling_main', 'main'),
+                        'inputs': [modelling_main.db_file] + __code('3_Modelling/modelling_main.py',
+                                                                    '3_Modelling/surrogate_keys.py',
+                                                                    'create_modelled_db.sql'),
+                        'outputs': [modelling_main.out_db_file],
+                        'kwargs': {'incremental': True},
+                        'copy_previous': True},
+          'visualisation': {'run': ('visualisation_model', 'main'),
+                            'inputs': [visualisation_model.db_file] + __code('3_Modelling/visualisation_model.py',
+                                                                             '3_Modelling/surrogate_keys.py',
+                                                                             '3_Modelling/rollups.py',
+                                                                             'create_visualisation_db.sql'),
+                            'outputs': [visualisation_model.out_db_file]}
+          }
+
+### - Fingerprints and state
+def __load_state(state_file):
+    """Helper: the saved pipeline state, or an empty one"""
+    if not os.path.exists(state_file):
+        return {'files': {}, 'stages': {}}
+    with open(state_file, 'r') as file:
+        return json.load(file)
+
+def __save_state(state, state_file):
+    """Helper: writes the pipeline state atomically"""
+    os.makedirs(os.path.dirname(state_file), exist_ok = True)
+    with open(f'{state_file}.tmp', 'w') as file:
+        json.dump(state, file, indent = 1)
+    os.replace(f'{state_file}.tmp', state_file)
+    return None
+
+def __fingerprint(path, state):
+    """
+    Content fingerprint (sha1) of a file, or None if it doesn't exist. Hashes
+    are remembered in the state against the file's size and mtime, so large
+    databases are only re-read when they've actually been written to
+    """
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    known = state['files'].get(path)
+    if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+        return known['sha1']
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(fingerprint_chunk), b''):
+            digest.update(chunk)
+    state['files'][path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': digest.hexdigest()}
+    return digest.hexdigest()
+
+def __is_up_to_date(name, stage, state):
+    """Helper: True if the stage's inputs and outputs match its last successful run"""
+    previous = state['stages'].get(name)
+    if previous is None:
+        return False
+    inputs = {path: __fingerprint(path, state) for path in stage['inputs']}
+    outputs = {path: __fingerprint(path, state) for path in stage['outputs']}
+    return (None not in outputs.values() and inputs == previous['inputs'] and outputs == previous['outputs'])
+
+def __dependencies(pipeline):
+    """Helper: {stage: set of stages producing one of its inputs}"""
+    producers = {path: name for name, stage in pipeline.items() for path in stage['outputs']}
+    return {name: {producers[path] for path in stage['inputs']
+                   if path in producers and producers[path] != name}
+            for name, stage in pipeline.items()}
+
+### - Running a stage
+def __peak_rss_mb():
+    """Helper: peak resident memory of this process, in Mb (None where unsupported)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return round(peak / (1024**2 if sys.platform == 'darwin' else 1024), 1)
+
+def __run_stage(module_name, function_name, args, kwargs = None):
+    """
+    Runs one stage in a fresh child process (see main), returning its wall time
+    and peak RSS
+    """
+    start = time.time()
+    function = getattr(importlib.import_module(module_name), function_name)
+    function(*args, **(kwargs or {}))
+    return {'wall_time': round(time.time() - start, 2), 'peak_rss_mb': __peak_rss_mb()}
+
+def __stage_args(stage):
+    """Helper: the arguments for a stage, and {temporary output: output} to move into place"""
+    if stage.get('in_place'):
+        return (stage['inputs'][0], stage['outputs'][0]), {}
+    temporary = {f'{path}.tmp': path for path in stage['outputs']}
+    for path, destination in temporary.items():
+        if os.path.exists(path):
+            os.remove(path)
+        if stage.get('copy_previous') and os.path.exists(destination):
+            shutil.copy2(destination, path)
+    return (stage['inputs'][0], list(temporary)[0]), temporary
+
+def main(selected = None, force = False, replay = False, snapshot_file = None, dry_run = False,
+         state_file = state_file):
+    """
+    Runs the pipeline, skipping stages that are up to date
+
+    Parameters
+    ----------
+    selected : list
+        The stages to consider. Defaults to cleaning, modelling, visualisation
+        (plus replay if replay = True)
+    force : bool
+        Run the selected stages even if they're up to date
+    replay : bool
+        Rebuild the staged database from the payload archive first
+    snapshot_file : str
+        The snapshot to replay. Defaults to the most recent
+    dry_run : bool
+        Only report which stages would run
+    state_file : str
+        Where fingerprints of the last successful runs are kept
+    Returns
+    -------
+    report : dict
+        {stage: 'skipped' / 'would run' / {'wall_time', 'peak_rss_mb'}}
+    """
+    if selected is None:
+        selected = ['cleaning', 'modelling', 'visualisation']
+    if replay and 'replay' not in selected:
+        selected = ['replay'] + list(selected)
+    unknown = set(selected) - set(stages)
+    if unknown:
+        raise Exception(f'Unknown pipeline stages: {sorted(unknown)}. Choose from {list(stages)}')
+
+    # This run's DAG. Replay's first input is the snapshot, so a new snapshot re-runs it
+    pipeline = {name: dict(stages[name]) for name in selected}
+    if 'replay' in pipeline:
+        if snapshot_file is None:
+            snapshot_file = payload_archive.latest_snapshot()
+        pipeline['replay']['inputs'] = [snapshot_file] + pipeline['replay']['inputs']
+    
+    state = __load_state(state_file)
+    dependencies = __dependencies(pipeline)
+    pending = list(selected)
+    running = {}
+    report = {}
+    # A stage runs if forced, out of date, or anything upstream of it ran
+    upstream_ran = set()
+
+    # Each stage gets its own spawned process, so it starts with a clean interpreter,
+    # its peak RSS is its own, and its memory is handed back when it finishes
+    context = multiprocessing.get_context('spawn')
+    try:
+        while pending or running:
+            for name in [x for x in pending if not dependencies[x] & (set(pending) | set(running))]:
+                pending.remove(name)
+                stage = pipeline[name]
+                if not (force or dependencies[name] & upstream_ran) and __is_up_to_date(name, stage, state):
+                    print(f'[PIPELINE] {name}: inputs unchanged, skipping')
+                    report[name] = 'skipped'
+                    continue
+                upstream_ran.add(name)
+                if dry_run:
+                    print(f'[PIPELINE] {name}: would run')
+                    report[name] = 'would run'
+                    continue
+                print(f'[PIPELINE] {name}: running... ')
+                args, temporary = __stage_args(stage)
+                # Fingerprint the inputs as they were when the stage started
+                inputs = {path: __fingerprint(path, state) for path in stage['inputs']}
+                executor = ProcessPoolExecutor(max_workers = 1, mp_context = context)
+                future = executor.submit(__run_stage, *stage['run'], args, stage.get('kwargs'))
+                running[future] = (name, inputs, temporary, executor)
+            if not running:
+                continue
+
+            done, _ = wait(list(running), return_when = FIRST_COMPLETED)
+            for future in done:
+                name, inputs, temporary, executor = running.pop(future)
+                executor.shutdown()
+                try:
+                    stats = future.result()
+                except Exception:
+                    for path in temporary:
+                        if os.path.exists(path):
+                            os.remove(path)
+                    __save_state(state, state_file)
+                    raise
+                for source, destination in temporary.items():
+                    os.replace(source, destination)
+                outputs = {path: __fingerprint(path, state) for path in pipeline[name]['outputs']}
+                state['stages'][name] = {'inputs': inputs, 'outputs': outputs,
+                                         'finished_at': datetime.now().isoformat(timespec = 'seconds'), **stats}
+                __save_state(state, state_file)
+                report[name] = stats
+                print(f"[PIPELINE] {name}: running... DONE in {stats['wall_time']}s, "
+                      f"peak RSS {stats['peak_rss_mb']} Mb")
+    finally:
+        for _, _, _, executor in running.values():
+            executor.shutdown()
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run the WHO GHO data pipeline, skipping unchanged stages')
+    parser.add_argument('--stages', nargs = '+', choices = list(stages), default = None)
+    parser.add_argument('--force', action = 'store_true', help = 'Run the stages even if up to date')
+    parser.add_argument('--replay', nargs = '?', const = True, default = False, metavar = 'SNAPSHOT',
+                        help = 'Rebuild the staged database from the payload archive (latest snapshot by default)')
+    parser.add_argument('--dry-run', action = 'store_true', help = 'Only report what would run')
+    arguments = parser.parse_args()
+    main(selected = arguments.stages, force = arguments.force, replay = bool(arguments.replay),
+         snapshot_file = arguments.replay if isinstance(arguments.replay, str) else None,
+         dry_run = arguments.dry_run)